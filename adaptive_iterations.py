@@ -0,0 +1,104 @@
+from statistics import NormalDist
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from results_aggregation import PASS_SCORE
+
+
+def wilson_interval(successes, runs, confidence: float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Wilson score confidence interval of a proportion, vectorized over arrays of successes and runs.
+
+    Unlike the normal approximation it stays meaningful for few runs and for proportions of 0 or 1, so a test
+    passed in all of its first few iterations still gets an interval of honest width. Runs of 0 give [0, 1].
+    """
+    successes = np.asarray(successes, dtype=float)
+    runs = np.asarray(runs, dtype=float)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        proportion = successes / runs
+        denominator = 1 + z ** 2 / runs
+        centre = (proportion + z ** 2 / (2 * runs)) / denominator
+        half_width = z * np.sqrt(proportion * (1 - proportion) / runs + z ** 2 / (4 * runs ** 2)) / denominator
+
+    low = np.where(runs > 0, np.clip(centre - half_width, 0, 1), 0.0)
+    high = np.where(runs > 0, np.clip(centre + half_width, 0, 1), 1.0)
+    return low, high
+
+
+class AdaptiveIterations:
+    """
+    Decides how many iterations each test of a (model, suite) needs, instead of a fixed test_iterations.
+
+    Iterations are run one at a time. After min_iterations, a test stops once the confidence interval of its
+    pass rate is narrower than ci_width, and the whole suite stops once the upper bound of its average score is
+    below the leaderboard threshold - the model clearly can't be listed. No test runs more than max_iterations.
+    """
+
+    def __init__(self,
+                 test_count: int,
+                 min_iterations: int = 3,
+                 max_iterations: int = 10,
+                 ci_width: float = 0.3,
+                 leaderboard_threshold: Optional[float] = 0.75,
+                 confidence: float = 0.95):
+        """
+        Initialize the adaptive iteration count.
+
+        Args:
+            test_count: Number of tests in the suite
+            min_iterations: Number of iterations every test runs before it may stop
+            max_iterations: Maximum number of iterations of any test
+            ci_width: A test stops once the confidence interval of its pass rate is narrower than this
+            leaderboard_threshold: The suite stops once its average score is confidently below this (None to disable)
+            confidence: Confidence level of the intervals
+        """
+        if min_iterations < 1 or max_iterations < min_iterations:
+            raise Exception(f"Invalid adaptive iterations, expected 1 <= min_iterations ({min_iterations}) <= max_iterations ({max_iterations})")
+
+        self.min_iterations = min_iterations
+        self.max_iterations = max_iterations
+        self.ci_width = ci_width
+        self.leaderboard_threshold = leaderboard_threshold
+        self.confidence = confidence
+
+        self.runs = np.zeros(test_count)
+        self.passes = np.zeros(test_count)
+        self.score_sums = np.zeros(test_count)
+        self.active = np.ones(test_count, dtype=bool)
+        self.iterations_done = 0
+        self.below_threshold = False
+
+    def active_tests(self) -> List[int]:
+        """The tests that need another iteration."""
+        return [int(test_index) for test_index in np.flatnonzero(self.active)]
+
+    def done(self) -> bool:
+        return not self.active.any()
+
+    def record(self, test_index: int, score: float) -> None:
+        self.runs[test_index] += 1
+        self.passes[test_index] += score >= PASS_SCORE
+        self.score_sums[test_index] += score
+
+    def end_iteration(self) -> None:
+        """Decide which tests carry on after an iteration has been run and scored."""
+        self.iterations_done += 1
+
+        if self.iterations_done >= self.max_iterations:
+            self.active[:] = False
+            return
+        if self.iterations_done < self.min_iterations:
+            return
+
+        low, high = wilson_interval(self.passes, self.runs, self.confidence)
+        self.active &= (high - low) > self.ci_width
+
+        if self.leaderboard_threshold is not None:
+            # scores are in [0, 1], so the total score is treated as a number of (fractional) successes
+            _, suite_high = wilson_interval(self.score_sums.sum(), self.runs.sum(), self.confidence)
+            if suite_high < self.leaderboard_threshold:
+                self.below_threshold = True
+                self.active[:] = False
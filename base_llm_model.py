@@ -1,6 +1,89 @@
 # Abstract base class for LLM
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
+
+
+class ModelResponse:
+    """The content of a model response, together with the metrics and usage reported while it was generated."""
+
+    def __init__(self,
+                 content: str,
+                 ttft: Optional[float] = None,
+                 inter_token_latency: Optional[float] = None,
+                 tokens_per_second: Optional[float] = None,
+                 output_tokens: Optional[int] = None,
+                 prompt_tokens: Optional[int] = None,
+                 cached_prompt_tokens: Optional[int] = None,
+                 finish_reason: Optional[str] = None,
+                 cost: Optional[float] = None,
+                 cached: bool = False,
+                 call_time: Optional[float] = None):
+        """
+        Initialize the model response.
+
+        Args:
+            content: The generated text
+            ttft: Time to first token in seconds (streaming only)
+            inter_token_latency: Average time between streamed chunks in seconds (streaming only)
+            tokens_per_second: Output tokens per second after the first token (streaming, or reported by the server)
+            output_tokens: Number of generated tokens, if known
+            prompt_tokens: Number of prompt tokens, if reported by the server
+            cached_prompt_tokens: Number of prompt tokens served from the server's prompt (KV) cache instead of
+                being evaluated, if reported by the server
+            finish_reason: Why generation stopped (e.g. "stop" or "length"), if reported by the server
+            cost: Cost of the call in USD, if reported by the provider (e.g. OpenRouter's usage.cost)
+            cached: True if the response was served from the response cache
+            call_time: Duration in seconds of the request that produced the response, if the model retried it -
+                without the waits for the rate limiter and the backoff between attempts
+        """
+        self.content = content
+        self.ttft = ttft
+        self.inter_token_latency = inter_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.prompt_tokens = prompt_tokens
+        self.cached_prompt_tokens = cached_prompt_tokens
+        self.finish_reason = finish_reason
+        self.cost = cost
+        self.cached = cached
+        self.call_time = call_time
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "ttft": self.ttft,
+            "inter_token_latency": self.inter_token_latency,
+            "tokens_per_second": self.tokens_per_second,
+            "output_tokens": self.output_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "finish_reason": self.finish_reason,
+            "cost": self.cost
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"content": self.content, **self.metrics()}
+
+    @staticmethod
+    def from_dict(value: Any, cached: bool = False) -> 'ModelResponse':
+        # plain strings are stored by caches written before responses carried metrics
+        if isinstance(value, str):
+            return ModelResponse(value, cached=cached)
+        return ModelResponse(value['content'], value.get('ttft'), value.get('inter_token_latency'),
+                             value.get('tokens_per_second'), value.get('output_tokens'),
+                             value.get('prompt_tokens'), value.get('cached_prompt_tokens'), value.get('finish_reason'),
+                             value.get('cost'), cached=cached)
+
+
+# sampling parameters a test suite may set, passed through to the chat completion request
+SAMPLING_PARAMETERS = ["temperature", "top_p", "seed", "max_tokens", "stop"]
+
+
+def is_deterministic_sampling(sampling: Optional[Dict[str, Any]]) -> bool:
+    """True if the sampling parameters make the response depend on the prompt only (greedy or seeded)."""
+    if not sampling:
+        return False
+    return sampling.get('temperature') == 0 or sampling.get('seed') is not None
 
 
 class BaseLLMModel(ABC):
@@ -22,6 +105,33 @@ class BaseLLMModel(ABC):
         pass
 
     @abstractmethod
-    def call_with_messages(self, messages_json: str) -> str:
-        """Generate a response for a conversation with multiple messages."""
-        pass
\ No newline at end of file
+    def call_with_messages(self, messages_json: str, iteration: int = 0) -> str:
+        """
+        Generate a response for a conversation with multiple messages.
+
+        The iteration index of the test is part of the response cache key, so that repeated
+        iterations of the same test are still sampled independently.
+        """
+        pass
+
+    def generate_with_messages(self, messages_json: str, iteration: int = 0, sampling: Optional[Dict[str, Any]] = None) -> ModelResponse:
+        """
+        Generate a response for a conversation, returning the content together with its generation metrics.
+
+        Models that can measure more than the content (e.g. streaming metrics) or that support sampling
+        parameters override this.
+        """
+        return ModelResponse(self.call_with_messages(messages_json, iteration))
+
+    async def acall(self, prompt: str) -> str:
+        """
+        Generate a response for a single prompt from asyncio code.
+
+        The blocking call runs on the default executor, so many calls can be awaited concurrently
+        while sharing the pooled keep-alive connections of the underlying HTTP session.
+        """
+        return await asyncio.to_thread(self.call, prompt)
+
+    async def acall_with_messages(self, messages_json: str, iteration: int = 0) -> str:
+        """Generate a response for a conversation with multiple messages from asyncio code."""
+        return await asyncio.to_thread(self.call_with_messages, messages_json, iteration)
@@ -1,5 +1,11 @@
+import argparse
+import csv
+import json
+import math
 import sys
+import threading
 import yaml
+import numpy as np
 from pathlib import Path
 import os
 
@@ -13,39 +19,197 @@ sys.path.append(project_root)
 
 from lmstudio_model import LmStudioModel
 from function_calling_scorer import FunctionCallingScorer, Scorer
+from lexical_scorer import LexicalScorer
+from adaptive_iterations import AdaptiveIterations
+from base_llm_model import ModelResponse
+from http_session import close_session
+from inference_scheduler import InferenceRequest, InferenceResult, InferenceScheduler
+from latency_histogram import LatencyHistogram, dump_histogram
+from model_lifecycle import ModelLifecycle
+from response_cache import create_response_cache
+from results_aggregation import PASS_SCORE, PER_TEST_RESULTS_HEADER, SuiteScores, usage_summary, write_per_test_results
+from results_store import ResultsStore, export_csv, export_failures
+from run_state import METRIC_FIELDS, CallRecords
+from run_journal import RunJournal
+from scoring_pipeline import ScoringPipeline
+from shard_coordinator import EndpointFailure, ShardCoordinator, WorkUnit
+from suite_compiler import load_compiled_config
 from utils import Timer
 
 def load_config_from_yaml(yaml_file_path):
     try:
-        with open(yaml_file_path, 'r', encoding='utf-8') as file:
-            data = yaml.safe_load(file)
-        config = data.get('config', {})
-        return config
+        return load_compiled_config(yaml_file_path)
     except FileNotFoundError:
         print(f"Error: YAML file '{yaml_file_path}' not found.")
         return None
     except yaml.YAMLError as e:
         print(f"Error parsing YAML file: {e}")
         return None
+    except Exception as e:
+        print(f"Error in test suites: {e}")
+        return None
+
+def format_metric(value, decimals):
+    return "" if value is None else f"{value:.{decimals}f}"
+
+def create_scorer(scorer_config, verdict_cache) -> Scorer:
+    if scorer_config['type'] == "FunctionCallingScorer":
+        return FunctionCallingScorer()
+    elif scorer_config['type'] == "OpenRouterScorer":
+        return OpenRouterScorer(scorer_config['model'], cache=verdict_cache, batch_size=scorer_config.get('batch_size', 1))
+    elif scorer_config['type'] == "LmStudioScorer":
+        return LmStudioScorer(scorer_config['endpoint'], scorer_config['model'], cache=verdict_cache,
+                              parallelism=scorer_config.get('parallelism', 4), batch_size=scorer_config.get('batch_size', 1))
+    elif scorer_config['type'] == "LexicalScorer":
+        return LexicalScorer(scorer_config.get('metric', "normalized"), scorer_config.get('ngram_size', 3))
+    else:
+        raise Exception(f"Scorer {scorer_config['type']} not implemented")
+
+def strip_thinking(response_text):
+    #ignore thinking part of response for models such as DeepSeek R1
+    if '</think>' in response_text:
+        response_text = response_text.split('</think>')[1]
+    return response_text
+
+class SuiteRun:
+    """
+    The inference results of one (model, test suite), kept until they have been scored and reported.
+
+    Calls only refer to their test by index - the prompt messages and expected response are shared with the compiled suite.
+    """
+
+    def __init__(self, model_name, test_suite_name, tests, spill_threshold_bytes):
+        self.model_name = model_name
+        self.test_suite_name = test_suite_name
+        self.tests = tests
+        self.records = CallRecords(spill_threshold_bytes)
+        self.latency_histogram = LatencyHistogram()
+        self.pipeline = None
+        self.adaptive = None
+
+    def add(self, result: InferenceResult):
+        self.records.append(result.request.iteration, result.request.test_index, strip_thinking(result.response_text),
+                            result.latency, result.response, result.sent)
+        # cache hits take no time and replicas repeat the latency of the call they copy
+        if result.sent:
+            self.latency_histogram.record(result.latency_ns)
+
+    def question(self, index):
+        return self.tests[self.records.test_indices[index]].messages
+
+    def reference(self, index):
+        return self.tests[self.records.test_indices[index]].expected_response
+
+def report_suite(suite_run: SuiteRun, scores, per_test_results_file, journal: RunJournal, histograms_file,
+                 results_store: ResultsStore, run_id, pricing=None):
+    model_name = suite_run.model_name
+    test_suite_name = suite_run.test_suite_name
+    latency_histogram = suite_run.latency_histogram
+    records = suite_run.records
+
+    # a scorer returning a non-finite score (e.g. NaN) failed to score the response - it counts as 0, and the
+    # results store only takes numbers
+    scores = [score if math.isfinite(score) else 0.0 for score in scores]
+
+    #get min, max, and average score, and the statistics of every test from the (iterations x tests) score array
+    suite_scores = SuiteScores.from_cells(len(suite_run.tests), records.iterations, records.test_indices, scores, records.sent_latencies())
+    min_score = float(np.nanmin(suite_scores.scores))
+    max_score = float(np.nanmax(suite_scores.scores))
+    average_score = float(np.nanmean(suite_scores.scores))
+    per_test, average_score_ci_low, average_score_ci_high = suite_scores.per_test(suite_run.tests)
+    average_inference_time = latency_histogram.mean()
+    average_ttft = records.average('ttft')
+    average_inter_token_latency = records.average('inter_token_latency')
+    average_tokens_per_second = records.average('tokens_per_second')
+    average_prompt_tokens = records.average('prompt_tokens')
+    average_cached_prompt_tokens = records.average('cached_prompt_tokens')
+    usage = usage_summary(records.latencies, records.metrics['prompt_tokens'], records.metrics['output_tokens'],
+                          records.metrics['cost'], pricing, records.sent)
+
+    print(f"Model: {model_name}, Test Suite: {test_suite_name}")
+    print(f"Max score: {max_score}, Min score: {min_score}, Average score: {average_score} (95% CI {average_score_ci_low:.3f}-{average_score_ci_high:.3f}), Model inference time: {format_metric(average_inference_time, 2) or '-'} seconds")
+    print(f"Tests passed in every iteration: {sum(1 for test in per_test if test['pass_rate'] == 1)} of {len(per_test)} (see {per_test_results_file})")
+    if average_inference_time is not None:
+        print(f"Inference time p50: {latency_histogram.percentile(50):.2f}, p90: {latency_histogram.percentile(90):.2f}, p99: {latency_histogram.percentile(99):.2f}, max: {latency_histogram.percentile(100):.2f} seconds")
+    if average_ttft is not None:
+        print(f"Time to first token: {average_ttft:.3f} seconds, Tokens/sec: {format_metric(average_tokens_per_second, 1)}")
+    if average_prompt_tokens is not None and average_cached_prompt_tokens is not None:
+        print(f"Prompt tokens per call: {average_prompt_tokens:.0f}, of which {average_cached_prompt_tokens:.0f} cached and {average_prompt_tokens - average_cached_prompt_tokens:.0f} evaluated")
+    if usage['total_output_tokens'] is not None:
+        print(f"Tokens: {format_metric(usage['total_prompt_tokens'], 0) or '?'} prompt, {usage['total_output_tokens']:.0f} output, "
+              f"{format_metric(usage['output_tokens_per_second'], 1) or '?'} output tokens/sec of call time")
+    if usage['cost_per_1k_calls'] is not None:
+        print(f"Cost: ${usage['total_cost']:.4f}, ${usage['cost_per_1k_calls']:.4f} per 1000 calls")
+
+    print()
+
+    result = {"min": min_score, "max": max_score, "average": average_score, "average_inference_time": average_inference_time,
+              "p50_inference_time": latency_histogram.percentile(50), "p90_inference_time": latency_histogram.percentile(90),
+              "p99_inference_time": latency_histogram.percentile(99), "max_inference_time": latency_histogram.percentile(100),
+              "average_ttft": average_ttft, "average_inter_token_latency": average_inter_token_latency,
+              "average_tokens_per_second": average_tokens_per_second, "average_prompt_tokens": average_prompt_tokens,
+              "average_cached_prompt_tokens": average_cached_prompt_tokens, "average_score_ci_low": average_score_ci_low,
+              "average_score_ci_high": average_score_ci_high, **usage, "per_test": per_test}
+    if suite_run.adaptive is not None:
+        result["stopped_below_threshold"] = suite_run.adaptive.below_threshold
+    journal.record_result(model_name, test_suite_name, result)
+
+    # every call of the suite goes to the results store in one transaction
+    calls = []
+    for i, (iteration, test_index) in enumerate(records.cells()):
+        calls.append({"iteration": iteration, "test": test_index, "input": suite_run.tests[test_index].input,
+                      "reference": suite_run.reference(i), "response": records.candidates[i], "score": scores[i],
+                      "latency": records.latencies[i], "finish_reason": records.finish_reasons[i],
+                      **{field: records.metric(field, i) for field in METRIC_FIELDS}})
+    results_store.record_suite(run_id, model_name, test_suite_name, calls, result)
+
+    #write the per-test results to their csv file - results.csv and responses.txt are exported from the store at the end of the run
+    write_per_test_results(per_test_results_file, model_name, test_suite_name, per_test)
+
+    if histograms_file:
+        dump_histogram(histograms_file, model_name, test_suite_name, latency_histogram)
+
+    records.close()
 
 def main():
 
     # Load configuration from YAML
-    if len(sys.argv) < 2:
-        print("Usage: python benchmark.py <config_file>")
-        print("Example: python benchmark.py tests/function_test_data.yaml")
-        sys.exit(1)
-
-    test_config_file = sys.argv[1]
-    config = load_config_from_yaml(test_config_file)
-    if config is None:
+    parser = argparse.ArgumentParser(description="Benchmark LLMs for use with Mantella",
+                                     epilog="Example: python benchmark.py tests/function_test_data.yaml")
+    parser.add_argument("config_file", help="YAML test configuration file")
+    parser.add_argument("--journal", default="run_journal.jsonl", help="Journal file every completed inference and score is appended to")
+    parser.add_argument("--resume", metavar="JOURNAL", help="Resume an interrupted run from its journal, skipping finished work")
+    parser.add_argument("--histograms", metavar="FILE", help="Write the latency histogram of every model and test suite to a JSONL file")
+    parser.add_argument("--results-db", default="results.db", help="SQLite results store every run, call and score is added to")
+    args = parser.parse_args()
+
+    test_config_file = args.config_file
+    loaded_config = load_config_from_yaml(test_config_file)
+    if loaded_config is None:
         sys.exit(1)
+    config, test_suites = loaded_config
 
     test_iterations = config.get('test_iterations', 10)
     model_list = config.get('models', [])
     model_type = config.get('model_type', "lmstudio")
     model_endpoint = config.get('model_endpoint', "")
-    test_suites = config.get('test_suites', [])
+    # several endpoints serving the same models - the (model, suite) units of the run are shared out between them
+    model_endpoints = config.get('model_endpoints') or [model_endpoint]
+    model_endpoint = model_endpoints[0]
+    concurrency = config.get('concurrency', 1)
+    stream = config.get('stream', False)
+    prefix_cache = config.get('prefix_cache', False)
+    default_sampling = config.get('sampling') or {}
+    # USD per million prompt / completion tokens of each model, for providers that don't report the cost of a call
+    pricing = config.get('pricing') or {}
+    pipeline_scoring = config.get('pipeline_scoring', False)
+    adaptive_config = config.get('adaptive_iterations')
+    if adaptive_config is not None and pipeline_scoring:
+        print("Adaptive iterations score every iteration before running the next one, pipelined scoring is disabled")
+    # candidate responses beyond this size are kept in a temporary file until their suite is reported
+    spill_threshold_bytes = int(config.get('spill_to_disk_mb', 16) * 1024 ** 2)
+    response_cache = create_response_cache(config.get('response_cache'))
+    verdict_cache = create_response_cache(config.get('verdict_cache'), default_path='.cache/verdicts')
 
     # Override model_api_key with environment variable if set
     model_api_key = ""
@@ -53,134 +217,365 @@ def main():
     if env_api_key:
         model_api_key = env_api_key        
 
-    #create a csv file to store the results
-    results_file = "results.csv"
-    with open(results_file, "w") as f:
-        f.write("Model,Test,Min,Max,Average,Average Inference Time\n")
+    # per-test pass rates, score confidence intervals and latencies
+    per_test_results_file = "per_test_results.csv"
+    with open(per_test_results_file, "w", newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow(PER_TEST_RESULTS_HEADER)
 
-    with open("responses.txt", "w", encoding='utf-8') as f:
-        f.write("")
+    if args.histograms:
+        with open(args.histograms, "w", encoding='utf-8') as f:
+            f.write("")
 
-    for model_name in model_list:
-        for test_suite in test_suites:
+    journal = RunJournal(args.resume or args.journal, resume=bool(args.resume))
 
-            test_suite_name = list(test_suite.keys())[0]
+    # the results store keeps every run, a resumed run carries on with its own run id. results.csv and responses.txt
+    # are exported from it at the end of the run
+    results_store = ResultsStore(args.results_db)
+    run_id = results_store.start_run(test_config_file, journal.path, config, resume=bool(args.resume))
 
-            print(f"===================================================")
-            print(f"Model: {model_name}, Test Suite: {test_suite_name}")
+    def report(suite_run, scores):
+        report_suite(suite_run, scores, per_test_results_file, journal, args.histograms, results_store, run_id,
+                     pricing.get(suite_run.model_name))
 
-            # Load model and run inference
-            model = None
-            if model_type == "lmstudio":
-                model = LmStudioModel(model_endpoint, model_name, context_length=8192)
-            elif model_type == "remote":
-                model = RemoteLLMModel(model_endpoint, model_api_key, model_name)
+    # pipelined suites still being scored in the background - reported in order once their scores are in
+    pending_suites = []
+
+    def report_pipelined_suites(wait):
+        while pending_suites and (wait or pending_suites[0].pipeline.done()):
+            suite_run = pending_suites.pop(0)
+            try:
+                cell_scores = suite_run.pipeline.results()
+            except Exception as e:
+                print(f"Error scoring model {suite_run.model_name}: {e}")
+                continue
+            scores = [cell_scores[cell] if cell in cell_scores else journal.get_score(suite_run.model_name, suite_run.test_suite_name, *cell)
+                      for cell in suite_run.records.cells()]
+            if len(scores) != len(suite_run.tests)*test_iterations:
+                print(f"Error: scores not populated by scorer for {suite_run.model_name} for test {suite_run.test_suite_name}")
+                continue
+            report(suite_run, scores)
+
+    def create_model(model_name, endpoint):
+        if model_type == "lmstudio":
+            return LmStudioModel(endpoint, model_name, context_length=8192, cache=response_cache, stream=stream,
+                                 cache_prompt=prefix_cache)
+        elif model_type == "remote":
+            return RemoteLLMModel(endpoint, model_api_key, model_name, cache=response_cache, stream=stream)
+        raise Exception(f"Model type {model_type} not implemented")
+
+    # scorers are created once per distinct scorer config and shared by every model and suite,
+    # so that e.g. a local judge model is only loaded once per run
+    scorers = {}
+    scorers_lock = threading.Lock()
+
+    def loaded_judges():
+        """The LM Studio judge models loaded by the scorers, which share the memory budget with the models under test."""
+        with scorers_lock:
+            return [scorer.model for scorer in scorers.values() if isinstance(scorer, LmStudioScorer) and scorer.loaded]
+
+    def get_scorer(scorer_config) -> Scorer:
+        scorer_key = json.dumps(scorer_config, sort_keys=True)
+        with scorers_lock:
+            if scorer_key not in scorers:
+                scorers[scorer_key] = create_scorer(scorer_config, verdict_cache)
+            return scorers[scorer_key]
+
+    def run_suite(model_lifecycle, endpoint, model_name, test_suite, on_inferred, allow_pipeline):
+        """
+        Run and score one (model, test suite) on an endpoint.
+
+        on_inferred is called once the model is no longer needed for the suite. Raises EndpointFailure if the
+        model could not be loaded or called.
+
+        Returns:
+            The suite run and its scores (None while pipelined scoring is still running), or None if the suite failed
+        """
+        test_suite_name = test_suite.name
+        scorer_config = test_suite.scorer
+        tests = test_suite.tests
+        # suite sampling parameters override the run wide ones, and null removes a run wide parameter
+        sampling = {key: value for key, value in {**default_sampling, **test_suite.sampling}.items() if value is not None}
+        suite_run = SuiteRun(model_name, test_suite_name, tests, spill_threshold_bytes)
+
+        if allow_pipeline and pipeline_scoring and adaptive_config is None:
+            try:
+                scorer = get_scorer(scorer_config)
+                suite_run.pipeline = ScoringPipeline(scorer, model_name, test_suite_name,
+                                                     on_score=lambda cell, score, suite_run=suite_run: journal.record_score(suite_run.model_name, suite_run.test_suite_name, cell[0], cell[1], score))
+            except Exception as e:
+                print(f"Error scoring model {model_name}: {e}")
+                return None
+
+        def submit_for_scoring(suite_run: SuiteRun, result: InferenceResult):
+            cell = (result.request.iteration, result.request.test_index)
+            if suite_run.pipeline is not None and journal.get_score(suite_run.model_name, suite_run.test_suite_name, *cell) is None:
+                suite_run.pipeline.submit(cell, result.request.messages, suite_run.tests[cell[1]].expected_response, strip_thinking(result.response_text))
+
+        # with adaptive iterations every iteration is run and scored before deciding which tests need another,
+        # otherwise all iterations are run in one go
+        adaptive = None
+        iteration_rounds = [list(range(test_iterations))]
+        if adaptive_config is not None:
+            adaptive = AdaptiveIterations(len(tests), **{"max_iterations": test_iterations, **adaptive_config})
+            iteration_rounds = [[iteration] for iteration in range(adaptive.max_iterations)]
+
+        requested_count = 0
+        suite_failed = False
+        endpoint_error = None
+        for round_index, round_iterations in enumerate(iteration_rounds):
+            active_tests = range(len(tests)) if adaptive is None else adaptive.active_tests()
+            first_new_cell = len(suite_run.records)
+
+            # the messages of each test are built once, when the suite is compiled, and shared by all iterations
+            inference_requests = []
+            for i in round_iterations:
+                for test_index in active_tests:
+                    inference_requests.append(InferenceRequest(i, test_index, tests[test_index].messages, sampling))
+            requested_count += len(inference_requests)
+
+            # reuse the inferences already recorded in the journal when resuming
+            inference_results = [None] * len(inference_requests)
+            pending_requests = []
+            for n, request in enumerate(inference_requests):
+                record = journal.get_inference(model_name, test_suite_name, request.iteration, request.test_index)
+                if record is not None:
+                    inference_results[n] = InferenceResult(request, ModelResponse.from_dict({**record, "content": record['response']}, record.get('cached', False)),
+                                                           int(record['latency'] * 1e9), replicated=record.get('replicated', False))
+                    submit_for_scoring(suite_run, inference_results[n])
+                else:
+                    pending_requests.append(n)
 
-            with Timer("Model load time"):
-                # print error on failure, but continue to next model
+            if pending_requests:
+                # Load model (once for all of its test suites) and run inference
                 try:
-                    model.load()
+                    model = model_lifecycle.acquire(model_name)
                 except Exception as e:
+                    # print error on failure, but continue to next model
                     print(f"Error loading model {model_name}: {e}")
+                    endpoint_error = e
+                    suite_failed = True
+                    break
+
+                def record_inference(result: InferenceResult, suite_run=suite_run):
+                    if result.error is None:
+                        journal.record_inference(model_name, test_suite_name, result.request.iteration, result.request.test_index,
+                                                 result.response_text, result.latency,
+                                                 {**result.response.metrics(), "cached": result.response.cached, "replicated": result.replicated})
+                        submit_for_scoring(suite_run, result)
+
+                scheduler = InferenceScheduler(model, endpoint, concurrency, prefix_order=prefix_cache)
+                with Timer("Model inference"):
+                    pending_results = scheduler.run([inference_requests[n] for n in pending_requests], on_result=record_inference)
+
+                for n, result in zip(pending_requests, pending_results):
+                    inference_results[n] = result
+
+            if adaptive is None:
+                on_inferred()
+
+            for result in inference_results:
+                if result.error is not None:
+                    print(f"Error calling model {model_name}: {result.error}")
+                    endpoint_error = result.error
                     continue
 
-            scorer_config = test_suite[test_suite_name]['scorer']
-
-            if scorer_config is None:
-                raise Exception(f"Scorer not configured for test suite {test_suite_name}")
-
-            questions = []
-            references = []
-            candidates = []
-
-            with Timer("Model inference") as model_inference_time:
-                for i in range(test_iterations):
-                    
-                    tests = test_suite[test_suite_name]['tests']
-                    for test_index, test in enumerate(tests):
-
-                        percentage_progress = ((i * len(tests) + test_index) * 100) / (test_iterations * len(tests))
-                        print(f"\rInference progress: {percentage_progress:.2f}% ...", end="", flush=True)
-
-                        test_messages = []
-                        for prompt in test_suite[test_suite_name]['setup_prompts']:
-                            prompt_type = list(prompt.keys())[0]
-                            prompt_content = str(prompt[prompt_type])
-                            test_messages.append({"role": prompt_type, "content": prompt_content})
-                        test_messages.append({"role": "user", "content": test['input']})
-
-                        response_text = ""
-                        try:
-                            response_text = model.call_with_messages(test_messages)
-                        except Exception as e:
-                            print(f"Error calling model {model_name}: {e}")
-                            response_text = "Error calling model"
-                            continue
+                assert result.response_text is not None
+
+                suite_run.add(result)
+
+            if suite_run.pipeline is not None:
+                # scoring carries on in the background while the next model / suite runs
+                break
+
+            # Score the model, skipping the responses already scored in the journal
+            records = suite_run.records
+            new_cells = range(first_new_cell, len(records))
+            for i in new_cells:
+                score = journal.get_score(model_name, test_suite_name, *records.cell(i))
+                if score is not None:
+                    records.scores[i] = score
+            unscored = [i for i in new_cells if not records.is_scored(i)]
+
+            if unscored:
+                try:
+                    scorer = get_scorer(scorer_config)
+
+                    with Timer("Scoring"):
+                        new_scores = scorer.score(model_name=model_name, test_name=test_suite_name,
+                                                  questions=[suite_run.question(i) for i in unscored],
+                                                  references=[suite_run.reference(i) for i in unscored],
+                                                  candidates=[records.candidates[i] for i in unscored])
                         
-                        #ignore thinking part of response for models such as DeepSeek R1
-                        if '</think>' in response_text:
-                            response_text = response_text.split('</think>')[1]
+                except Exception as e:
+                    print(f"Error scoring model {model_name}: {e}")
+                    suite_failed = True
+                    break
+
+                if not (isinstance(new_scores, list) and len(new_scores) == len(unscored)):
+                    print(f"Error: scores not populated by scorer for {model_name} for test {test_suite_name}")
+                    suite_failed = True
+                    break
+
+                for i, score in zip(unscored, new_scores):
+                    records.scores[i] = score
+                    journal.record_score(model_name, test_suite_name, *records.cell(i), score)
+
+            if endpoint_error is not None:
+                break
+
+            if adaptive is not None:
+                for i in new_cells:
+                    adaptive.record(records.test_indices[i], records.scores[i])
+                adaptive.end_iteration()
+                if adaptive.done():
+                    break
+
+        if adaptive is not None:
+            on_inferred()
+
+        if endpoint_error is not None:
+            # the successful calls are in the journal, only the failed ones are repeated on a retry
+            suite_run.records.close()
+            raise EndpointFailure(str(endpoint_error))
+
+        if suite_failed:
+            suite_run.records.close()
+            return None
+
+        if suite_run.pipeline is not None:
+            return suite_run, None
+
+        if len(suite_run.records) != requested_count:
+            print(f"Error: scores not populated by scorer for {model_name} for test {test_suite_name}")
+            return None
+
+        if adaptive is not None:
+            print(f"Adaptive iterations: {requested_count} calls instead of {len(tests) * adaptive.max_iterations}"
+                  + (f", stopped below the leaderboard threshold of {adaptive.leaderboard_threshold}" if adaptive.below_threshold else ""))
+            suite_run.adaptive = adaptive
+
+        return suite_run, suite_run.records.scores
+
+    def report_finished(model_name, test_suite_name, finished_result):
+        # keep per_test_results.csv in run order
+        write_per_test_results(per_test_results_file, model_name, test_suite_name, finished_result.get('per_test', []))
+        results_store.record_result(run_id, model_name, test_suite_name, finished_result)
+
+    if len(model_endpoints) > 1:
+        # sharded run - every endpoint works through the (model, suite) units on its own thread
+        if pipeline_scoring:
+            print("Sharded runs score every suite on its endpoint's thread, pipelined scoring is disabled")
+
+        units = [WorkUnit(len(test_suites) * model_index + test_suite_index, model_name, test_suite)
+                 for model_index, model_name in enumerate(model_list) for test_suite_index, test_suite in enumerate(test_suites)]
+        model_lifecycles = {endpoint: ModelLifecycle(lambda model_name, endpoint=endpoint: create_model(model_name, endpoint))
+                            for endpoint in model_endpoints}
+
+        # units finish out of order - each is reported in run order, once every unit before it is done
+        outcomes = {}
+        next_report = 0
+        report_lock = threading.Lock()
+
+        def complete(unit, outcome):
+            nonlocal next_report
+            with report_lock:
+                outcomes[unit.index] = outcome
+                while next_report in outcomes:
+                    outcome = outcomes.pop(next_report)
+                    next_report += 1
+                    if outcome is not None:
+                        outcome()
+
+        pending_units = []
+        for unit in units:
+            finished_result = journal.get_result(unit.model_name, unit.test_suite.name)
+            if finished_result is not None:
+                print(f"Model: {unit.model_name}, Test Suite: {unit.test_suite.name} already finished in {journal.path}, skipping")
+                complete(unit, lambda unit=unit, finished_result=finished_result: report_finished(unit.model_name, unit.test_suite.name, finished_result))
+            else:
+                pending_units.append(unit)
+
+        def run_unit(endpoint, unit):
+            model_lifecycle = model_lifecycles[endpoint]
+            # an endpoint holds one model at a time
+            model_lifecycle.release_others(unit.model_name)
 
-                        assert response_text is not None
+            print(f"===================================================")
+            print(f"Model: {unit.model_name}, Test Suite: {unit.test_suite.name}, Endpoint: {endpoint}")
+            suite = run_suite(model_lifecycle, endpoint, unit.model_name, unit.test_suite, on_inferred=lambda: None, allow_pipeline=False)
+            complete(unit, None if suite is None else lambda: report(*suite))
 
-                        questions.append(test_messages)
-                        candidates.append(response_text)
-                        references.append(test['expected_response'])
+        coordinator = ShardCoordinator(model_endpoints, pending_units, max_failures=config.get('endpoint_max_failures', 3))
+        coordinator.run(run_unit, on_abandoned=lambda unit: complete(unit, None),
+                        on_endpoint_done=lambda endpoint: model_lifecycles[endpoint].shutdown())
 
-                print()
+    else:
+        model_lifecycle = ModelLifecycle(lambda model_name: create_model(model_name, model_endpoint),
+                                         prefetch=config.get('prefetch_next_model', False),
+                                         memory_budget_gb=config.get('model_memory_budget_gb'),
+                                         other_resident_models=loaded_judges)
 
-            if model is not None:
-                model.unload()
+        for model_index, model_name in enumerate(model_list):
+            for test_suite_index, test_suite in enumerate(test_suites):
 
-            # Score the model
-            try:
-                scorer: Scorer = None
-                if scorer_config['type'] == "FunctionCallingScorer":
-                    scorer = FunctionCallingScorer()
-                elif scorer_config['type'] == "OpenRouterScorer":
-                    scorer = OpenRouterScorer(scorer_config['model'])
-                elif scorer_config['type'] == "LmStudioScorer":
-                    scorer = LmStudioScorer(scorer_config['endpoint'], scorer_config['model'])
-                else:
-                    raise Exception(f"Scorer {scorer_config['type']} not implemented")
+                test_suite_name = test_suite.name
 
-                with Timer("Scoring"):
-                    scores = scorer.score(model_name=model_name, test_name=test_suite_name, questions=questions, references=references, candidates=candidates)
+                print(f"===================================================")
+                print(f"Model: {model_name}, Test Suite: {test_suite_name}")
 
-                scorer.shutdown()
-                    
-            except Exception as e:
-                print(f"Error scoring model {model_name}: {e}")
-                continue
+                finished_result = journal.get_result(model_name, test_suite_name)
+                if finished_result is not None:
+                    print(f"Already finished in {journal.path}, skipping")
+                    report_pipelined_suites(wait=True)
+                    report_finished(model_name, test_suite_name, finished_result)
+                    continue
 
-            if not (isinstance(scores, list) and len(scores) == len(tests)*test_iterations):
-                print(f"Error: scores not populated by scorer for {model_name} for test {test_suite_name}")
-                continue
+                def on_inferred(model_index=model_index, test_suite_index=test_suite_index):
+                    if test_suite_index == len(test_suites) - 1:
+                        # last suite of this model - warm the next model while this one is scored, and free it up. The
+                        # prefetch is decided first, while this model still counts against the memory budget
+                        model_lifecycle.prefetch(model_list[model_index + 1] if model_index + 1 < len(model_list) else None)
+                        model_lifecycle.release(model_list[model_index])
 
-            # dump failures for further analysis
-            for i, score in enumerate(scores):
-                if score < 0.5:
-                    with open("responses.txt", "a", encoding='utf-8') as f:
-                        f.write(f"Model: {model_name}\n")
-                        f.write(f"Question: {questions[i]}\n")
-                        f.write(f"Reference: {references[i]}\n")
-                        f.write(f"Candidate: {candidates[i]}\n")
-                        f.write(f" = Score: {score}\n")
-                        f.write(f"--------------------------------\n")
-
-            #get min, max, and average score
-            min_score = min(scores)
-            max_score = max(scores)
-            average_score = sum(scores) / len(scores)
-            average_inference_time = model_inference_time.elapsed_time / (test_iterations * len(tests))
-
-            print(f"Max score: {max_score}, Min score: {min_score}, Average score: {average_score}, Model inference time: {average_inference_time:.2f} seconds")
-
-            print()
-
-            #write the results to the csv file
-            with open(results_file, "a") as f:
-                f.write(f"{model_name},{test_suite_name},{min_score},{max_score},{average_score},{average_inference_time:.2f}\n")
+                try:
+                    suite = run_suite(model_lifecycle, model_endpoint, model_name, test_suite, on_inferred, allow_pipeline=True)
+                except EndpointFailure:
+                    continue
+                if suite is None:
+                    continue
+
+                suite_run, scores = suite
+                if suite_run.pipeline is not None:
+                    pending_suites.append(suite_run)
+                    report_pipelined_suites(wait=False)
+                    continue
+
+                report(suite_run, scores)
+
+            model_lifecycle.release(model_name)
+
+        model_lifecycle.shutdown()
+
+    if pending_suites:
+        with Timer("Waiting for pipelined scoring"):
+            report_pipelined_suites(wait=True)
+
+    for scorer in scorers.values():
+        try:
+            scorer.shutdown()
+        except Exception as e:
+            print(f"Error shutting down scorer: {e}")
+
+    journal.close()
+    results_store.finish_run(run_id)
+
+    # the results and failures of the run (including the parts finished before a resume), from the store
+    with open("results.csv", "w", newline='', encoding='utf-8') as f:
+        f.write(export_csv(results_store, run_id))
+    with open("responses.txt", "w", encoding='utf-8') as f:
+        f.write(export_failures(results_store, run_id, PASS_SCORE))
+    results_store.close()
+    close_session()
 
 
 if __name__ == "__main__":
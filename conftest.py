@@ -0,0 +1 @@
+# the benchmark modules live in the repository root - having a conftest.py here puts the root on sys.path for tests/
@@ -0,0 +1,251 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+
+import benchmark
+from function_calling_scorer import FunctionCallingScorer
+from http_session import close_session
+from inference_scheduler import InferenceRequest, InferenceScheduler
+from lexical_scorer import LexicalScorer
+from lmstudio_model import LmStudioModel
+from lmstudio_scorer import LmStudioScorer
+from mock_server import DEFAULT_RESPONSE, MockServer
+from openrouter_scorer import OpenRouterScorer
+from remote_llm_model import RemoteLLMModel
+from suite_compiler import load_compiled_config
+
+
+class HarnessBenchmark:
+    """
+    Measures the benchmark's own overhead against the mock server, without any real model.
+
+    Every section drives one part of the harness (model clients, scorers, or benchmark.main end to end)
+    with a fresh mock server, if it calls one, and reports its throughput, the time per call not spent
+    waiting for the (simulated) model, and the peak Python memory of a second, traced run of the section.
+    Only the calls themselves are timed, not starting and stopping the mock server.
+    """
+
+    def __init__(self, test_file: str, calls: int, concurrency: int, latency: str, tokens_per_second: float,
+                 memory: bool = True):
+        """
+        Initialize the harness benchmark.
+
+        Args:
+            test_file: Test YAML whose suites provide the prompts
+            calls: Number of model calls (or scored responses) per section
+            concurrency: Concurrent requests to the mock server
+            latency: Latency distribution of the mock server (see mock_server.parse_distribution)
+            tokens_per_second: Generation speed of the mock server, 0 for instant
+            memory: Also run every section under tracemalloc to measure its peak memory
+        """
+        self.test_file = test_file
+        self.calls = calls
+        self.concurrency = concurrency
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.memory = memory
+        _, self.test_suites = load_compiled_config(test_file)
+        self.tests = [test for test_suite in self.test_suites for test in test_suite.tests]
+
+    def _mock_server(self, **options) -> MockServer:
+        return MockServer(latency=self.latency, tokens_per_second=self.tokens_per_second, models=["mock-model", "mock-judge"], **options)
+
+    def _requests(self) -> List[InferenceRequest]:
+        # distinct iterations, so that every call is sent even for deterministic sampling
+        return [InferenceRequest(n // len(self.tests), n % len(self.tests), self.tests[n % len(self.tests)].messages)
+                for n in range(self.calls)]
+
+    def _run_model(self, create_model: Callable[[str], Any], **server_options) -> Dict[str, Any]:
+        with self._mock_server(**server_options) as server:
+            scheduler = InferenceScheduler(create_model(server.url), server.url, self.concurrency)
+            requests = self._requests()
+            start_time = time.perf_counter()
+            results = scheduler.run(requests)
+            seconds = time.perf_counter() - start_time
+            stats = server.stats()
+        failed = sum(1 for result in results if result.error is not None)
+        latencies = [result.latency for result in results if result.error is None]
+        return {"calls": len(results), "failed": failed, "seconds": seconds, "latencies": latencies, "server": stats}
+
+    def remote_model(self) -> Dict[str, Any]:
+        return self._run_model(lambda url: RemoteLLMModel(url, model_name="mock-model"))
+
+    def remote_model_streaming(self) -> Dict[str, Any]:
+        return self._run_model(lambda url: RemoteLLMModel(url, model_name="mock-model", stream=True))
+
+    def remote_model_faults(self) -> Dict[str, Any]:
+        # retried 429s and 500s, paced by the adaptive rate limiter
+        return self._run_model(lambda url: RemoteLLMModel(url, model_name="mock-model"),
+                               error_rate=0.01, rate_limit_rate=0.05, retry_after=0.05)
+
+    def lmstudio_model(self) -> Dict[str, Any]:
+        def create_model(url):
+            model = LmStudioModel(url, "mock-model")
+            model.load()
+            return model
+        return self._run_model(create_model)
+
+    def _score(self, create_scorer: Callable[[Optional[str]], Any], uses_server: bool = True) -> Dict[str, Any]:
+        # unique candidates, so that the LLM scorers judge every one of them
+        questions = [self.tests[n % len(self.tests)].messages for n in range(self.calls)]
+        references = [self.tests[n % len(self.tests)].expected_response for n in range(self.calls)]
+        # in-process scorers don't call the mock server, so none is started for them
+        with self._mock_server() if uses_server else contextlib.nullcontext() as server:
+            candidates = [f"{DEFAULT_RESPONSE} {n}" for n in range(self.calls)]
+            scorer = create_scorer(server.url if server is not None else None)
+            start_time = time.perf_counter()
+            scores = scorer.score(model_name="mock-model", test_name="harness", questions=questions,
+                                  references=references, candidates=candidates)
+            seconds = time.perf_counter() - start_time
+            stats = server.stats() if server is not None else None
+        return {"calls": len(scores), "failed": 0, "seconds": seconds, "latencies": None, "server": stats}
+
+    def function_calling_scorer(self) -> Dict[str, Any]:
+        return self._score(lambda url: FunctionCallingScorer(), uses_server=False)
+
+    def lexical_scorer(self) -> Dict[str, Any]:
+        return self._score(lambda url: LexicalScorer("token_f1"), uses_server=False)
+
+    def lmstudio_scorer(self) -> Dict[str, Any]:
+        # not shut down - the mock reports the judge as loaded, there is nothing to unload
+        return self._score(lambda url: LmStudioScorer(url, "mock-judge", parallelism=self.concurrency))
+
+    def openrouter_scorer(self) -> Dict[str, Any]:
+        def create_scorer(url):
+            os.environ["OPENROUTER_API_ENDPOINT"] = url
+            os.environ.setdefault("OPENROUTER_API_KEY", "mock")
+            return OpenRouterScorer("mock-judge")
+        return self._score(create_scorer)
+
+    def benchmark_main(self) -> Dict[str, Any]:
+        """Run benchmark.main end to end on the test suites, with as many iterations as give the number of calls."""
+        with open(self.test_file, 'r', encoding='utf-8') as f:
+            test_suites = yaml.safe_load(f)['config']['test_suites']
+
+        with self._mock_server() as server, tempfile.TemporaryDirectory() as run_directory:
+            config_file = os.path.join(run_directory, "harness.yaml")
+            with open(config_file, 'w', encoding='utf-8') as f:
+                yaml.safe_dump({"config": {"model_type": "remote", "model_endpoint": server.url, "models": ["mock-model"],
+                                           "test_iterations": max(1, self.calls // len(self.tests)),
+                                           "concurrency": self.concurrency, "test_suites": test_suites}}, f)
+
+            working_directory = os.getcwd()
+            argv = sys.argv
+            try:
+                os.chdir(run_directory)
+                sys.argv = ["benchmark.py", config_file]
+                start_time = time.perf_counter()
+                benchmark.main()
+                seconds = time.perf_counter() - start_time
+            finally:
+                sys.argv = argv
+                os.chdir(working_directory)
+            stats = server.stats()
+        return {"calls": stats['completions'], "failed": 0, "seconds": seconds, "latencies": None, "server": stats}
+
+    def sections(self) -> Dict[str, Callable[[], Dict[str, Any]]]:
+        return {
+            "remote_model": self.remote_model,
+            "remote_model_streaming": self.remote_model_streaming,
+            "remote_model_faults": self.remote_model_faults,
+            "lmstudio_model": self.lmstudio_model,
+            "function_calling_scorer": self.function_calling_scorer,
+            "lexical_scorer": self.lexical_scorer,
+            "lmstudio_scorer": self.lmstudio_scorer,
+            "openrouter_scorer": self.openrouter_scorer,
+            "benchmark_main": self.benchmark_main
+        }
+
+    def run_section(self, name: str) -> Dict[str, Any]:
+        """
+        Run a section, with its console output suppressed.
+
+        Returns:
+            Calls per second, mean time per call spent outside the mock server's simulated latency (model
+            sections only), peak traced memory in MB (None if memory is not measured), and what the mock
+            server served (None for sections without one)
+        """
+        section = self.sections()[name]
+        with contextlib.redirect_stdout(io.StringIO()):
+            outcome = section()
+            seconds = outcome['seconds']
+
+            peak_memory_mb = None
+            if self.memory:
+                tracemalloc.start()
+                try:
+                    section()
+                    peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                finally:
+                    tracemalloc.stop()
+
+        server = outcome['server'] or {}
+        overhead_ms = None
+        if outcome['latencies']:
+            simulated = server['delay_seconds'] / server['completions'] if server['completions'] else 0.0
+            overhead_ms = (sum(outcome['latencies']) / len(outcome['latencies']) - simulated) * 1000
+
+        return {"section": name, "calls": outcome['calls'], "failed": outcome['failed'], "seconds": seconds,
+                "calls_per_second": outcome['calls'] / seconds if seconds > 0 else None,
+                "overhead_ms_per_call": overhead_ms, "peak_memory_mb": peak_memory_mb,
+                "server_requests": server.get('requests'), "server_rate_limited": server.get('rate_limited'),
+                "server_errors": server.get('errors')}
+
+
+def format_value(value: Optional[float], decimals: int) -> str:
+    return "-" if value is None else f"{value:.{decimals}f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the benchmark harness's own throughput, per-call overhead and memory against a mock server",
+                                     epilog="Example: python harness_benchmark.py --calls 2000 --concurrency 8 --output harness_results.json")
+    parser.add_argument("--test-file", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "function_test_data.yaml"),
+                        help="Test YAML whose suites provide the prompts")
+    parser.add_argument("--calls", type=int, default=1000, help="Model calls (or scored responses) per section")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests to the mock server")
+    parser.add_argument("--latency", default="constant:0", help="Latency distribution of the mock server, e.g. constant:0, lognormal:0.05,0.5")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Generation speed of the mock server (0 for instant)")
+    parser.add_argument("--sections", nargs="+", help="Sections to run (default all)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the traced run measuring peak memory")
+    parser.add_argument("--output", metavar="FILE", help="Also write the results as JSON, e.g. to compare against a baseline")
+    args = parser.parse_args()
+
+    # keep LmStudioModel away from a real LM Studio - the registry falls back to the mock's REST model listing
+    os.environ["LMS_PATH"] = os.path.join(tempfile.gettempdir(), "no-lms-for-harness-benchmark")
+
+    harness = HarnessBenchmark(args.test_file, args.calls, args.concurrency, args.latency, args.tokens_per_second,
+                               memory=not args.no_memory)
+    section_names = args.sections or list(harness.sections())
+    unknown = [name for name in section_names if name not in harness.sections()]
+    if unknown:
+        print(f"Error: unknown sections {unknown}, expected any of {list(harness.sections())}")
+        sys.exit(1)
+
+    print(f"{'Section':<26}{'Calls':>8}{'Failed':>8}{'Seconds':>10}{'Calls/sec':>11}{'Overhead ms':>13}{'Peak MB':>10}")
+    results = []
+    for name in section_names:
+        result = harness.run_section(name)
+        results.append(result)
+        print(f"{name:<26}{result['calls']:>8}{result['failed']:>8}{result['seconds']:>10.2f}"
+              f"{format_value(result['calls_per_second'], 1):>11}{format_value(result['overhead_ms_per_call'], 3):>13}"
+              f"{format_value(result['peak_memory_mb'], 1):>10}")
+
+    close_session()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"calls": args.calls, "concurrency": args.concurrency, "latency": args.latency,
+                       "tokens_per_second": args.tokens_per_second, "sections": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# maximum number of keep-alive connections kept open per host
+POOL_MAXSIZE = 32
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Return the process-wide HTTP session.
+
+    The session keeps connections alive and pools them per host, so repeated calls to the same
+    endpoint reuse an open TCP/TLS connection instead of paying a fresh handshake every time.
+    requests.Session is safe to share between the scheduler's worker threads for plain POST/GET calls.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def close_session() -> None:
+    """Close the process-wide HTTP session and all of its pooled connections."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
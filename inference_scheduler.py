@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from base_llm_model import BaseLLMModel, ModelResponse, is_deterministic_sampling
+
+
+class EndpointLimit:
+    """
+    Limit on the requests in flight to one endpoint, used as a context manager around each request.
+
+    Unlike a semaphore the limit can be lowered while requests are in flight - new requests then wait
+    until the in-flight count has dropped below it.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def lower(self, limit: int) -> None:
+        with self.condition:
+            self.limit = min(self.limit, limit)
+
+    def __enter__(self) -> "EndpointLimit":
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+
+# one limit per endpoint, shared by every scheduler in the process, so that two schedulers pointed at the
+# same server (e.g. model under test and an LM Studio judge) respect a single limit. When they ask for
+# different limits the smallest one applies to both
+_endpoint_limits: Dict[str, EndpointLimit] = {}
+_endpoint_limits_lock = threading.Lock()
+
+
+def get_endpoint_limit(endpoint: str, concurrency: int) -> EndpointLimit:
+    """Return the shared limit of in-flight requests to an endpoint, lowered to concurrency if it is higher."""
+    with _endpoint_limits_lock:
+        endpoint_limit = _endpoint_limits.get(endpoint)
+        if endpoint_limit is None:
+            endpoint_limit = EndpointLimit(concurrency)
+            _endpoint_limits[endpoint] = endpoint_limit
+        elif concurrency < endpoint_limit.limit:
+            print(f"Lowering the concurrency limit of {endpoint} from {endpoint_limit.limit} to {concurrency}")
+            endpoint_limit.lower(concurrency)
+        return endpoint_limit
+
+
+class InferenceRequest:
+    """A single model call within a test suite run."""
+
+    def __init__(self, iteration: int, test_index: int, messages: List[Dict[str, Any]], sampling: Optional[Dict[str, Any]] = None):
+        self.iteration = iteration
+        self.test_index = test_index
+        self.messages = messages
+        self.sampling = sampling
+
+    def deduplication_key(self) -> Optional[Tuple[str, str]]:
+        """Key shared by all requests that are certain to get the same response, or None if the response is sampled."""
+        if not is_deterministic_sampling(self.sampling):
+            return None
+        serialized = getattr(self.messages, 'json', None) or json.dumps(self.messages, ensure_ascii=False)
+        return serialized, json.dumps(self.sampling, sort_keys=True)
+
+
+class InferenceResult:
+    """
+    The outcome of an InferenceRequest, including the latency of the model call itself.
+
+    replicated is set on the copies of a deduplicated request's result, which share its response.
+    """
+
+    def __init__(self, request: InferenceRequest, response: Optional[ModelResponse], latency_ns: int, error: Optional[Exception] = None,
+                 replicated: bool = False):
+        self.request = request
+        self.response = response
+        self.latency_ns = latency_ns
+        self.error = error
+        self.replicated = replicated
+
+    @property
+    def latency(self) -> float:
+        return self.latency_ns / 1e9
+
+    @property
+    def response_text(self) -> Optional[str]:
+        return self.response.content if self.response is not None else None
+
+    @property
+    def sent(self) -> bool:
+        """True if the model was actually called, False for a replicated or cached response."""
+        return not self.replicated and not (self.response is not None and self.response.cached)
+
+
+def prefix_order(requests: List[InferenceRequest]) -> List[int]:
+    """
+    Return the request indices ordered so that requests with the longest common prompt prefix are adjacent.
+
+    Sorting the serialized conversations puts every group of requests sharing a prefix (the setup prompts,
+    then the whole prompt for repeated iterations of a test) next to each other. The sort is stable, so
+    iterations of the same test keep their order.
+    """
+    serialized = [json.dumps(request.messages, ensure_ascii=False) for request in requests]
+    return sorted(range(len(requests)), key=lambda i: serialized[i])
+
+
+class InferenceScheduler:
+    """
+    Runs model calls concurrently, bounded by a per-endpoint concurrency limit.
+
+    Results are always returned in the same order as the requests, regardless of the order
+    in which the calls are sent or complete.
+    """
+
+    def __init__(self, model: BaseLLMModel, endpoint: str, concurrency: int = 1, prefix_order: bool = False):
+        """
+        Initialize the scheduler.
+
+        Args:
+            model: The model to call
+            endpoint: The endpoint the model is served from, used to share the concurrency limit
+            concurrency: Maximum number of in-flight requests to the endpoint
+            prefix_order: Send requests sharing the longest prompt prefixes one after another, so that
+                servers with a prompt (KV) cache only evaluate the part of each prompt that differs
+        """
+        if concurrency < 1:
+            raise Exception(f"Invalid concurrency {concurrency}, must be at least 1")
+
+        self.model = model
+        self.concurrency = concurrency
+        self.prefix_order = prefix_order
+        self.endpoint_limit = get_endpoint_limit(endpoint, concurrency)
+
+    def _run_request(self, request: InferenceRequest) -> InferenceResult:
+        # only the model call itself is timed - not the wait for a free slot, nor any bookkeeping
+        with self.endpoint_limit:
+            start_time = time.perf_counter_ns()
+            try:
+                response = self.model.generate_with_messages(request.messages, request.iteration, request.sampling)
+            except Exception as e:
+                return InferenceResult(request, None, time.perf_counter_ns() - start_time, e)
+            latency_ns = time.perf_counter_ns() - start_time
+            if response.call_time is not None:
+                # models that retry (rate limits, server errors) report the time of the successful attempt only
+                latency_ns = int(response.call_time * 1e9)
+            return InferenceResult(request, response, latency_ns)
+
+    def run(self, requests: List[InferenceRequest], on_result: Optional[Callable[[InferenceResult], None]] = None) -> List[InferenceResult]:
+        """
+        Run all requests and return their results in request order.
+
+        Args:
+            requests: The requests to run
+            on_result: Optional callback invoked (on the calling thread) as soon as each result is available
+
+        Returns:
+            One InferenceResult per request, in the same order as the requests
+        """
+        results: List[Optional[InferenceResult]] = [None] * len(requests)
+        completed = 0
+
+        order = range(len(requests))
+        if self.prefix_order:
+            order = prefix_order(requests)
+
+        # greedy or seeded requests for the same prompt (e.g. every iteration of a test) are only sent once,
+        # and the response is replicated to the others
+        duplicates: Dict[int, List[int]] = {i: [] for i in order}
+        sent: Dict[Tuple[str, str], int] = {}
+        for i in order:
+            key = requests[i].deduplication_key()
+            if key is None:
+                continue
+            if key in sent:
+                duplicates[sent[key]].append(i)
+                del duplicates[i]
+            else:
+                sent[key] = i
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            future_to_index = {executor.submit(self._run_request, requests[i]): i for i in duplicates}
+
+            for future in as_completed(future_to_index):
+                result = future.result()
+                index = future_to_index[future]
+                replicated = [result] + [InferenceResult(requests[j], result.response, result.latency_ns, result.error, replicated=True)
+                                         for j in duplicates[index]]
+
+                for i, result in zip([index] + duplicates[index], replicated):
+                    results[i] = result
+                    completed += 1
+
+                    if on_result is not None:
+                        on_result(result)
+
+                percentage_progress = (completed * 100) / len(requests)
+                print(f"\rInference progress: {percentage_progress:.2f}% ...", end="", flush=True)
+
+        print()
+        return results
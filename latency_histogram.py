@@ -0,0 +1,93 @@
+import json
+import math
+from typing import Dict, List, Optional
+
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of call latencies in nanoseconds.
+
+    Each power of two range is split into a fixed number of linear sub-buckets, so every recorded value
+    is kept with a bounded relative error (about 1.5% with the default precision) however large it is,
+    while the memory used only grows with the number of distinct buckets hit.
+    """
+
+    def __init__(self, precision_bits: int = 7):
+        """
+        Initialize the histogram.
+
+        Args:
+            precision_bits: Number of bits of each value that are kept exactly
+        """
+        self.precision_bits = precision_bits
+        self.counts: Dict[int, int] = {}
+        self.total_count = 0
+        self.min_ns: Optional[int] = None
+        self.max_ns: Optional[int] = None
+        self.sum_ns = 0
+
+    def _bucket(self, value_ns: int) -> int:
+        shift = max(0, value_ns.bit_length() - self.precision_bits)
+        return (shift << self.precision_bits) + (value_ns >> shift)
+
+    def _bucket_range(self, bucket: int):
+        shift = bucket >> self.precision_bits
+        mantissa = bucket & ((1 << self.precision_bits) - 1)
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, value_ns: int) -> None:
+        value_ns = max(0, int(value_ns))
+        bucket = self._bucket(value_ns)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total_count += 1
+        self.sum_ns += value_ns
+        self.min_ns = value_ns if self.min_ns is None else min(self.min_ns, value_ns)
+        self.max_ns = value_ns if self.max_ns is None else max(self.max_ns, value_ns)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Return the latency in seconds below which the given percentage of calls completed."""
+        if self.total_count == 0:
+            return None
+        if percentile >= 100:
+            return self.max_ns / 1e9
+
+        target = max(1, math.ceil(percentile / 100 * self.total_count))
+        cumulative = 0
+        for bucket in sorted(self.counts):
+            cumulative += self.counts[bucket]
+            if cumulative >= target:
+                lower, upper = self._bucket_range(bucket)
+                # report the middle of the bucket, clamped to the exactly known extremes
+                value_ns = min(max((lower + upper) / 2, self.min_ns), self.max_ns)
+                return value_ns / 1e9
+        return self.max_ns / 1e9
+
+    def mean(self) -> Optional[float]:
+        if self.total_count == 0:
+            return None
+        return self.sum_ns / self.total_count / 1e9
+
+    def buckets(self) -> List[List[float]]:
+        """Return the non-empty buckets as [lower seconds, upper seconds, count]."""
+        result = []
+        for bucket in sorted(self.counts):
+            lower, upper = self._bucket_range(bucket)
+            result.append([lower / 1e9, upper / 1e9, self.counts[bucket]])
+        return result
+
+
+def dump_histogram(histogram_file: str, model_name: str, test_suite_name: str, histogram: LatencyHistogram) -> None:
+    """Append the histogram of a (model, suite) to a JSONL file."""
+    with open(histogram_file, "a", encoding='utf-8') as f:
+        f.write(json.dumps({
+            "model": model_name,
+            "suite": test_suite_name,
+            "count": histogram.total_count,
+            "min": histogram.min_ns / 1e9 if histogram.min_ns is not None else None,
+            "max": histogram.max_ns / 1e9 if histogram.max_ns is not None else None,
+            "mean": histogram.mean(),
+            "p50": histogram.percentile(50),
+            "p90": histogram.percentile(90),
+            "p99": histogram.percentile(99),
+            "buckets": histogram.buckets()
+        }) + "\n")
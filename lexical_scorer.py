@@ -0,0 +1,114 @@
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from scorer import Scorer
+from utils import clean_text
+
+# exact: identical apart from surrounding whitespace, normalized: identical after clean_text,
+# token_f1: F1 of the shared words, char_ngram: F1 (Dice coefficient) of the shared character n-grams
+LEXICAL_METRICS = ["exact", "normalized", "token_f1", "char_ngram"]
+
+
+class LexicalScorer(Scorer):
+    """
+    Scores responses by their text overlap with the expected response, without an LLM judge.
+
+    Meant for tests with a deterministic answer (e.g. "2" or the alphabet). Responses are normalized with
+    clean_text (punctuation, case and whitespace), and all candidates of a batch are scored at once.
+    """
+    supports_pipelining = True
+
+    def __init__(self, metric: str = "normalized", ngram_size: int = 3):
+        """
+        Initialize the scorer.
+
+        Args:
+            metric: One of LEXICAL_METRICS
+            ngram_size: Length of the character n-grams of the char_ngram metric
+        """
+        if metric not in LEXICAL_METRICS:
+            print(f"Error: unknown LexicalScorer metric {metric}, expected one of {LEXICAL_METRICS}")
+            raise Exception(f"Unknown LexicalScorer metric {metric}, expected one of {LEXICAL_METRICS}")
+        if ngram_size < 1:
+            print(f"Error: LexicalScorer ngram_size must be at least 1, got {ngram_size}")
+            raise Exception(f"LexicalScorer ngram_size must be at least 1, got {ngram_size}")
+        self.metric = metric
+        self.ngram_size = ngram_size
+
+    def score(self, model_name: str, test_name: str, questions: List[List[Dict[str, Any]]], references: List[str], candidates: List[str]) -> List[float]:
+        return lexical_scores(references, candidates, self.metric, self.ngram_size).tolist()
+
+    def shutdown(self):
+        pass
+
+
+def char_ngrams(text: str, size: int) -> List[str]:
+    """The overlapping character n-grams of a text, or the text itself if it is shorter than one n-gram."""
+    if len(text) <= size:
+        return [text] if text else []
+    return [text[i:i + size] for i in range(len(text) - size + 1)]
+
+
+def overlap_f1(reference_units: List[List[str]], candidate_units: List[List[str]]) -> np.ndarray:
+    """
+    F1 of the multiset overlap of each (reference, candidate) pair of unit lists (words or n-grams).
+
+    The units of every pair are counted in one pass: each unit is encoded as pair * vocabulary + unit id,
+    the shared keys of the references and candidates give the overlap of every pair at once. Two empty
+    lists count as a perfect match.
+    """
+    vocabulary: Dict[str, int] = {}
+    pair_count = len(reference_units)
+
+    def encode(units_per_pair: List[List[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        lengths = np.fromiter((len(units) for units in units_per_pair), dtype=np.int64, count=pair_count)
+        ids = np.fromiter((vocabulary.setdefault(unit, len(vocabulary)) for units in units_per_pair for unit in units),
+                          dtype=np.int64, count=int(lengths.sum()))
+        return np.repeat(np.arange(pair_count, dtype=np.int64), lengths), ids, lengths
+
+    reference_pairs, reference_ids, reference_lengths = encode(reference_units)
+    candidate_pairs, candidate_ids, candidate_lengths = encode(candidate_units)
+    vocabulary_size = max(len(vocabulary), 1)
+
+    reference_keys, reference_counts = np.unique(reference_pairs * vocabulary_size + reference_ids, return_counts=True)
+    candidate_keys, candidate_counts = np.unique(candidate_pairs * vocabulary_size + candidate_ids, return_counts=True)
+    shared_keys, reference_index, candidate_index = np.intersect1d(reference_keys, candidate_keys, assume_unique=True, return_indices=True)
+    overlap = np.bincount(shared_keys // vocabulary_size,
+                          weights=np.minimum(reference_counts[reference_index], candidate_counts[candidate_index]),
+                          minlength=pair_count)
+
+    total = reference_lengths + candidate_lengths
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, 2 * overlap / total, 1.0)
+
+
+def lexical_scores(references: List[str], candidates: List[str], metric: str = "normalized", ngram_size: int = 3) -> np.ndarray:
+    """
+    Score every candidate against its reference with a lexical metric (see LEXICAL_METRICS), from 0 to 1.
+
+    Identical (reference, candidate) pairs, common across iterations, are only scored once.
+    """
+    # the index of every candidate's unique pair
+    unique_pairs: Dict[Tuple[str, str], int] = {}
+    pair_indices = np.fromiter((unique_pairs.setdefault(pair, len(unique_pairs)) for pair in zip(references, candidates)),
+                               dtype=np.int64, count=len(candidates))
+    if not unique_pairs:
+        return np.zeros(0)
+
+    pairs = list(unique_pairs)
+    if metric == "exact":
+        scores = np.fromiter((reference.strip() == candidate.strip() for reference, candidate in pairs), dtype=float, count=len(pairs))
+        return scores[pair_indices]
+
+    cleaned = {text: clean_text(text) for pair in pairs for text in pair}
+    if metric == "normalized":
+        scores = np.fromiter((cleaned[reference] == cleaned[candidate] for reference, candidate in pairs), dtype=float, count=len(pairs))
+    elif metric == "token_f1":
+        scores = overlap_f1([cleaned[reference].split() for reference, _ in pairs], [cleaned[candidate].split() for _, candidate in pairs])
+    elif metric == "char_ngram":
+        scores = overlap_f1([char_ngrams(cleaned[reference], ngram_size) for reference, _ in pairs],
+                            [char_ngrams(cleaned[candidate], ngram_size) for _, candidate in pairs])
+    else:
+        raise Exception(f"Unknown lexical metric {metric}, expected one of {LEXICAL_METRICS}")
+    return scores[pair_indices]
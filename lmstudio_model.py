@@ -1,9 +1,12 @@
-import subprocess
+import time
 from typing import Dict, List, Any, Optional
 
-import requests
-
-from base_llm_model import BaseLLMModel
+from base_llm_model import BaseLLMModel, ModelResponse, is_deterministic_sampling
+from http_session import get_session
+from lmstudio_registry import get_registry
+from response_cache import ResponseCache, cached_call
+from streaming import read_sse_stream, response_from_completion
+from suite_compiler import encode_chat_request
 
 #lm studio wrapper - required because lm studio python API is not compatible with the older versions of python that work with tensorflow
 # use model_path to load the model, as this avoids LM Studio getting confused if there are multiple versions of the model e.g. different quants
@@ -12,7 +15,10 @@ class LmStudioModel(BaseLLMModel):
     def __init__(self, 
                  api_endpoint: str,
                  model_path: str = "default",
-                 context_length: int = 8192):
+                 context_length: int = 8192,
+                 cache: Optional[ResponseCache] = None,
+                 stream: bool = False,
+                 cache_prompt: bool = False):
         """
         Initialize the LM Studio model.
         
@@ -23,140 +29,73 @@ class LmStudioModel(BaseLLMModel):
             context_length: Context length for the model
             headers: Optional additional headers for the API requests
             timeout: Request timeout in seconds
+            cache: Optional response cache consulted before calling the API
+            stream: Stream responses, measuring time to first token and tokens/sec
+            cache_prompt: Ask the server to reuse the KV cache of the longest matching prompt prefix
         """
         
         # Set LM Studio specific attributes
         self.api_endpoint = api_endpoint
         self.model_path = model_path
         self.context_length = context_length
-
-    def _list_loaded_models(self):
-        process = subprocess.Popen(["lms", "ps"], 
-                                 stdout=subprocess.PIPE, 
-                                 stderr=subprocess.PIPE, 
-                                 universal_newlines=True,
-                                 encoding='utf-8',
-                                 errors='replace',
-                                 bufsize=1024*1024)  # 1MB buffer
-        try:
-            output, error = process.communicate(timeout=10)
-        except subprocess.TimeoutExpired as e:
-            process.kill()
-            raise Exception(f"`lms ps` Process timed out {e.output} / {e.stderr}")
-        
-        if process.returncode != 0:
-            print(f"Failed to check model status: {error}")
-            raise Exception(f"Failed to check model status: {error}")
-        return output
-
-    def _list_available_models(self):
-        process = subprocess.Popen(["lms", "ls", "--json"], 
-                                 stdout=subprocess.PIPE, 
-                                 stderr=subprocess.PIPE, 
-                                 universal_newlines=True,
-                                 encoding='utf-8',
-                                 errors='replace',
-                                 bufsize=1024*1024)  # 1MB buffer
-        try:
-            output, error = process.communicate(timeout=10)
-        except subprocess.TimeoutExpired as e:
-            process.kill()
-            raise Exception(f"`lms ls` Process timed out {e.output} / {e.stderr}")
-        
-        if process.returncode != 0:
-            print(f"Failed to check model status: {error}")
-            raise Exception(f"Failed to check model status: {error}")
-        return output
-
-
-    def _get_model_name(self) -> bool:
-        output = self._list_loaded_models()
-
-        #check if either the path or name is in the output
-        if not (self.model_path in output):
+        self.cache = cache
+        self.stream = stream
+        self.cache_prompt = cache_prompt
+        self.registry = get_registry(api_endpoint)
+
+    def get_size_bytes(self) -> Optional[int]:
+        """Size of the model on disk (roughly its memory footprint when loaded), from `lms ls --json`."""
+        model = self.registry.find_available(self.model_path)
+        return model.get('sizeBytes') if model else None
+
+    def _get_model_name(self) -> str:
+        model = self.registry.find_loaded(self.model_path)
+        if model is None:
             raise Exception(f"Model {self.model_path} is not loaded")
-        
-        #grep the output to find the model name
-        # Find the model identifier by matching the path in the output
-        lines = output.split('\n')
-        for i, line in enumerate(lines):
-            if self.model_path in line:
-                # The identifier is typically on the line starting with "Identifier:"
-                # Look at previous lines to find it
-                for j in range(i-3, i+1):
-                    if j >= 0 and lines[j].strip().startswith("Identifier:"):
-                        self.model_name = lines[j].split(":", 1)[1].strip()
-                        return self.model_name
-                        
-        raise Exception(f"Could not find identifier for model path {self.model_path} in output")
+
+        self.model_name = model.get('identifier') or model.get('modelKey')
+        if not self.model_name:
+            raise Exception(f"Could not find identifier for model path {self.model_path} in {model}")
+        return self.model_name
 
 
     def load(self):
 
-        if self.model_path in self._list_loaded_models():
+        if self.registry.find_loaded(self.model_path) is not None:
             print(f"Model {self.model_path} is already loaded")
             return
         
-        if self.model_path not in self._list_available_models():
+        if self.registry.find_available(self.model_path) is None:
             print(f"Model {self.model_path} is not available - download it first")
             raise Exception(f"Model {self.model_path} is not available")
 
         #load the model into lm studio
         print(f"Loading model {self.model_path} with context length {self.context_length}")
-        process = subprocess.Popen(["lms", "load", self.model_path, "--context-length", str(self.context_length)], 
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 universal_newlines=True,
-                                 encoding='utf-8',
-                                 errors='replace',
-                                 bufsize=1024*1024)  # 1MB buffer
-        
-        # Read output and wait for process to complete
         try:
-            output, error = process.communicate(timeout=60)
-        except subprocess.TimeoutExpired as e:
-            process.kill()
-            print(f"Failed to load model {self.model_path}: {e.output} / {e.stderr}")
-            raise Exception(f"Load model timed out {e.output} / {e.stderr}")
-        
-        #get return code
-        return_code = process.returncode
-        if return_code != 0:
+            self.registry.load(self.model_path, self.context_length)
+        except Exception as e:
             print(f"Failed to load model {self.model_path}")
-            print(f"Error: {error}")
-            raise Exception(f"Failed to load model {self.model_path}")
+            raise Exception(f"Failed to load model {self.model_path}: {e}")
         
 
     def unload(self):
         #check if model is not already loaded
-        #grep output for the model name
-        if not self.model_path in self._list_loaded_models():
+        if self.registry.find_loaded(self.model_path) is None:
             print(f"Model {self.model_path} is not loaded")
             return
 
         model_name = self._get_model_name()
 
         #unload the model from lm studio
-        process = subprocess.Popen(["lms", "unload", self.model_name], 
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 universal_newlines=True,
-                                 bufsize=1024*1024)  # 1MB buffer
         try:
-            output, error = process.communicate(timeout=60)  # 1 minute timeout
-        except subprocess.TimeoutExpired as e:
-            process.kill()
-            raise Exception(f"Process timed out after 1 minute: {e.output} / {e.stderr}")
-
-        #get return code
-        if process.returncode != 0:
-            print(f"Failed to unload model {self.model_name}")
-            print(f"Error: {error}")
-            raise Exception(f"Failed to unload model {self.model_name}")
+            self.registry.unload(model_name)
+        except Exception as e:
+            print(f"Failed to unload model {model_name}")
+            raise Exception(f"Failed to unload model {model_name}: {e}")
 
     def call(self, prompt: str) -> str:
         #call the model using the openapi endpoint
-        response = requests.post(
+        response = get_session().post(
             f"{self.api_endpoint}/v1/chat/completions",
             timeout=30,
             json={
@@ -171,17 +110,51 @@ class LmStudioModel(BaseLLMModel):
         return response_text
 
 
-    def call_with_messages(self, messages_json: str) -> str:
+    def call_with_messages(self, messages_json: str, iteration: int = 0) -> str:
+        return self.generate_with_messages(messages_json, iteration).content
+
+    def generate_with_messages(self, messages_json: str, iteration: int = 0, sampling: Optional[Dict[str, Any]] = None) -> ModelResponse:
+        key_fields = {
+            "model_type": "lmstudio",
+            "endpoint": self.api_endpoint,
+            "model": self.model_path,
+            "messages": messages_json,
+            "sampling": sampling or {},
+            # streamed responses carry timing metrics (TTFT, inter-token latency) that non-streamed ones lack
+            "stream": self.stream,
+            # greedy or seeded responses don't differ between iterations, so they are cached once for all of them
+            "iteration": 0 if is_deterministic_sampling(sampling) else iteration
+        }
+        return cached_call(self.cache, key_fields, lambda: self._post_chat(messages_json, sampling))
+
+    def _post_chat(self, messages_json: str, sampling: Optional[Dict[str, Any]] = None) -> ModelResponse:
+        payload = {
+            "model": self.model_path,
+            **(sampling or {})
+        }
+        if self.stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        if self.cache_prompt:
+            # llama.cpp prompt cache hint - only the part of the prompt after the shared prefix is evaluated
+            payload["cache_prompt"] = True
+
         #call the model using the openapi endpoint
-        response = requests.post(
+        start_time = time.perf_counter()
+        response = get_session().post(
             f"{self.api_endpoint}/v1/chat/completions",
             timeout=30,
-            json={
-                "model": self.model_path,
-                "messages": messages_json
-            }
+            data=encode_chat_request(payload, messages_json),
+            headers={"Content-Type": "application/json"},
+            stream=self.stream
         )
 
+        if self.stream:
+            if response.status_code != 200:
+                print(f"Streaming request failed: {response.status_code} {response.text}")
+                raise Exception(f"Streaming request failed: {response.status_code} {response.text}")
+            return read_sse_stream(response, start_time)
+
         # Parse the JSON response and extract the message content
         response_json = response.json()
 
@@ -189,5 +162,4 @@ class LmStudioModel(BaseLLMModel):
             print(f"No choices in response: {response_json}")
             raise Exception(f"No choices in response: {response_json}")
 
-        response_text = response_json['choices'][0]['message']['content']
-        return response_text
+        return response_from_completion(response_json)
@@ -0,0 +1,177 @@
+import json
+import os
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from http_session import get_session
+
+
+class LmStudioRegistry:
+    """
+    Cached view of the models LM Studio has loaded and available for loading.
+
+    Every `lms` invocation costs hundreds of milliseconds to seconds, so the state is queried once as
+    structured JSON (`lms ps --json` / `lms ls --json`, falling back to the REST model listing if the
+    installed `lms` is too old to produce JSON) and cached until a model is loaded or unloaded.
+    The `lms` executable can be overridden through the LMS_PATH environment variable. For an endpoint on
+    another machine `lms` is pointed at that machine's LM Studio with --host/--port.
+    """
+
+    def __init__(self, api_endpoint: str, lms_path: Optional[str] = None, max_age: float = 60):
+        """
+        Initialize the registry.
+
+        Args:
+            api_endpoint: The API endpoint URL for the LM Studio service, used for the REST fallback
+            lms_path: Path of the `lms` executable, defaults to LMS_PATH or `lms` on the PATH
+            max_age: Seconds after which the cached state is queried again, to pick up changes made outside the benchmark
+        """
+        self.api_endpoint = api_endpoint
+        self.lms_path = lms_path or os.environ.get("LMS_PATH", "lms")
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.loaded: Optional[List[Dict[str, Any]]] = None
+        self.loaded_time = 0.0
+        self.available: Optional[List[Dict[str, Any]]] = None
+        self.available_time = 0.0
+
+        url = urlparse(api_endpoint)
+        self.host_args = []
+        if url.hostname and url.hostname not in ["localhost", "127.0.0.1", "::1"]:
+            self.host_args = ["--host", url.hostname] + (["--port", str(url.port)] if url.port else [])
+
+    def _run_lms(self, args: List[str], timeout: float) -> str:
+        process = subprocess.Popen([self.lms_path] + args + self.host_args,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 universal_newlines=True,
+                                 encoding='utf-8',
+                                 errors='replace',
+                                 bufsize=1024*1024)  # 1MB buffer
+        try:
+            output, error = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            process.kill()
+            raise Exception(f"`lms {' '.join(args)}` Process timed out {e.output} / {e.stderr}")
+
+        if process.returncode != 0:
+            print(f"`lms {' '.join(args)}` failed: {error}")
+            raise Exception(f"`lms {' '.join(args)}` failed: {error}")
+        return output
+
+    def _list_rest_models(self) -> List[Dict[str, Any]]:
+        response = get_session().get(f"{self.api_endpoint}/api/v0/models", timeout=10)
+        response.raise_for_status()
+        # the REST listing names models by their key, which is also what they are loaded and unloaded by. It
+        # only reports a path in some LM Studio versions, _matches falls back to the id otherwise
+        return [{**model, "modelKey": model.get('id'), "identifier": model.get('id'), "path": model.get('path')}
+                for model in response.json().get('data', [])]
+
+    def _query_loaded(self) -> List[Dict[str, Any]]:
+        try:
+            return json.loads(self._run_lms(["ps", "--json"], timeout=10))
+        except Exception as e:
+            print(f"Could not list loaded models with lms, falling back to the REST API: {e}")
+            return [model for model in self._list_rest_models() if model.get('state') == 'loaded']
+
+    def _query_available(self) -> List[Dict[str, Any]]:
+        try:
+            return json.loads(self._run_lms(["ls", "--json"], timeout=10))
+        except Exception as e:
+            print(f"Could not list available models with lms, falling back to the REST API: {e}")
+            return self._list_rest_models()
+
+    def loaded_models(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            if self.loaded is None or time.monotonic() - self.loaded_time > self.max_age:
+                self.loaded = self._query_loaded()
+                self.loaded_time = time.monotonic()
+            return self.loaded
+
+    def available_models(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            if self.available is None or time.monotonic() - self.available_time > self.max_age:
+                self.available = self._query_available()
+                self.available_time = time.monotonic()
+            return self.available
+
+    def invalidate(self) -> None:
+        """Forget the cached list of loaded models, so that it is queried again on next use."""
+        with self.lock:
+            self.loaded = None
+
+    @staticmethod
+    def _normalize_path(path: str) -> str:
+        return path.replace('\\', '/').strip('/')
+
+    @staticmethod
+    def _matches(model: Dict[str, Any], model_path: str) -> bool:
+        """
+        True if the model is the one named by model_path - its exact model key, identifier or path.
+
+        Paths are compared with normalized separators, and a path may also be the end of the absolute path
+        LM Studio reports (whole path components only), so that qwen3-4b never matches qwen3-4b-instruct.
+        Models listed by the REST fallback without a path are matched by the whole model key the path names:
+        its file name (with or without .gguf) or its repository without the -GGUF suffix, ignoring case.
+        """
+        if model_path in [model.get('modelKey'), model.get('identifier')]:
+            return True
+        if not model_path:
+            return False
+        wanted = LmStudioRegistry._normalize_path(model_path)
+        if not model.get('path'):
+            return model.get('modelKey') is not None and model['modelKey'].lower() in LmStudioRegistry._path_keys(wanted)
+        path = LmStudioRegistry._normalize_path(model['path'])
+        return path == wanted or path.endswith('/' + wanted)
+
+    @staticmethod
+    def _path_keys(path: str) -> List[str]:
+        """The lower case model keys a model path may be listed under, e.g. by the REST API."""
+        components = path.lower().split('/')
+        keys = [components[-1]]
+        if keys[0].endswith('.gguf'):
+            keys.append(keys[0][:-len('.gguf')])
+        if len(components) > 1 and components[-2].endswith('-gguf'):
+            keys.append(components[-2][:-len('-gguf')])
+        return keys
+
+    def find_loaded(self, model_path: str) -> Optional[Dict[str, Any]]:
+        """Return the loaded instance of a model, or None if it is not loaded."""
+        for model in self.loaded_models():
+            if self._matches(model, model_path):
+                return model
+        return None
+
+    def find_available(self, model_path: str) -> Optional[Dict[str, Any]]:
+        """Return the downloaded model with the given path, or None if it is not available."""
+        for model in self.available_models():
+            if self._matches(model, model_path):
+                return model
+        return None
+
+    def load(self, model_path: str, context_length: int) -> None:
+        try:
+            self._run_lms(["load", model_path, "--context-length", str(context_length)], timeout=60)
+        finally:
+            self.invalidate()
+
+    def unload(self, identifier: str) -> None:
+        try:
+            self._run_lms(["unload", identifier], timeout=60)
+        finally:
+            self.invalidate()
+
+
+registries: Dict[str, LmStudioRegistry] = {}
+registries_lock = threading.Lock()
+
+
+def get_registry(api_endpoint: str) -> LmStudioRegistry:
+    """Return the registry shared by every model of an LM Studio endpoint."""
+    with registries_lock:
+        if api_endpoint not in registries:
+            registries[api_endpoint] = LmStudioRegistry(api_endpoint)
+        return registries[api_endpoint]
@@ -1,47 +1,148 @@
-import json
-import re
-from typing import Any, Dict, List
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
 
-from scorer import Scorer
+from scorer import (JudgeItem, Scorer, batch_judge_items, batch_scoring_message, group_judge_items,
+                    parse_batch_judge_scores, parse_judge_score)
 from lmstudio_model import LmStudioModel
+from response_cache import ResponseCache
 
 class LmStudioScorer(Scorer):
-    def __init__(self, endpoint: str, model: str):
+    supports_pipelining = True
+
+    def __init__(self, endpoint: str, model: str, cache: Optional[ResponseCache] = None, parallelism: int = 4,
+                 batch_size: int = 1):
+        """
+        Initialize the scorer.
+
+        The judge model is loaded on first use and stays loaded for the rest of the run, until shutdown().
+
+        Args:
+            endpoint: The API endpoint URL of the LM Studio server running the judge
+            model: Path of the judge model
+            cache: Optional verdict cache consulted before judging
+            parallelism: Number of judge requests sent to the server concurrently
+            batch_size: Maximum number of responses to the same question judged in a single request
+        """
         self.model = LmStudioModel(endpoint, model)
+        self.judge_model = model
+        self.cache = cache
+        self.pipeline_workers = parallelism
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.loaded = False
+        # verdicts of this run, in flight or successful, by (question, setup prompts, candidate) - identical
+        # candidates (e.g. of later iterations) share them even without a verdict cache
+        self.verdicts: Dict[Tuple[str, str, str], Future] = {}
+
+    def _ensure_loaded(self):
+        with self.lock:
+            if not self.loaded:
+                self.model.load()
+                self.loaded = True
+
+    def _judge_question(self, item: JudgeItem) -> Optional[float]:
+        """Judge one response, returning None if its score could not be parsed."""
+        self._ensure_loaded()
+        response_text = self.model.call(item.scoring_message())
+
+        #remove any non-numeric characters
+        try:
+            score = parse_judge_score(response_text)
+        except ValueError:
+            print(f"Failed to parse score from response: {response_text}")
+            return None
+        except Exception as e:
+            print(f"Unexpected error parsing score: {e}")
+            return None
+
+        if self.cache is not None:
+            self.cache.put(self.cache.make_key(item.key_fields), score)
+        return score
+
+    def _process_question(self, item: JudgeItem) -> float:
+        score = self._judge_question(item)
+        return 0.0 if score is None else score
+
+    def _process_batch(self, items: List[JudgeItem]) -> List[float]:
+        """Judge several responses to the same question in one request, falling back to one request per response."""
+        if len(items) == 1:
+            return [self._process_question(items[0])]
+
+        self._ensure_loaded()
+        response_text = self.model.call(batch_scoring_message(items))
+        scores = parse_batch_judge_scores(response_text, len(items))
+        if scores is None:
+            print(f"Failed to parse batched scores, judging the {len(items)} responses one at a time")
+            return [self._process_question(item) for item in items]
+
+        if self.cache is not None:
+            for item, score in zip(items, scores):
+                self.cache.put(self.cache.make_key(item.key_fields), score)
+        return scores
 
     def score(self, model_name: str, test_name: str, questions: List[List[Dict[str, Any]]], references: List[str], candidates: List[str]) -> List[float]:
-        self.model.load()
+        # identical candidates (common across iterations) are only judged once
+        unique_items, item_indices = group_judge_items(self.judge_model, questions, candidates)
+
+        unique_scores = []
+        for item in unique_items:
+            unique_scores.append(self.cache.get(self.cache.make_key(item.key_fields)) if self.cache is not None else None)
+
+        to_score = [u for u, score in enumerate(unique_scores) if score is None]
+        # responses to the same question are packed into judge requests of up to batch_size responses
+        batches = batch_judge_items(unique_items, to_score, self.batch_size)
+        print(f"Judging {len(to_score)} unique responses in {len(batches)} requests ({len(candidates) - len(to_score)} duplicate or cached)")
 
-        scores = []
-        for i, question in enumerate(questions):
+        completed = 0
+        with ThreadPoolExecutor(max_workers=self.pipeline_workers) as executor:
+            future_to_batch = {executor.submit(self._process_batch, [unique_items[u] for u in batch]): batch for batch in batches}
 
-            question_text = question[len(question) - 1]['content']
-            initial_prompts = json.dumps(question[:-1])
-            scoring_message = f"For the question, \"{question_text}\", and the initial prompts: \"{initial_prompts}\", rate the following response on a scale of 0-10, replying with just your numerical score in brackets like [8], and then including your reasoning: \"{candidates[i]}\""
+            for future in as_completed(future_to_batch):
+                for u, score in zip(future_to_batch[future], future.result()):
+                    unique_scores[u] = score
+                    completed += 1
 
-            response_text = self.model.call(scoring_message)
+                percentage_progress = (completed * 100) / len(to_score)
+                print(f"\rScoring progress: {percentage_progress:.2f}% ...", end="", flush=True)
 
-            #remove any non-numeric characters
+        if to_score:
+            print()
+        return [unique_scores[u] for u in item_indices]
+
+    def score_one(self, model_name: str, test_name: str, question: List[Dict[str, Any]], reference: str, candidate: str) -> float:
+        item = JudgeItem(self.judge_model, question, candidate)
+        key = (item.question_text, item.initial_prompts, candidate)
+
+        # identical candidates wait for the verdict of the first one, or reuse it once it is known
+        with self.lock:
+            verdict = self.verdicts.get(key)
+            is_first = verdict is None
+            if is_first:
+                verdict = Future()
+                self.verdicts[key] = verdict
+
+        if is_first:
+            judged = False
             try:
-                # Extract first number between square brackets using regex
-                match = re.search(r'\[(.*?)\]', response_text)
-                if match:
-                    score = float(match.group(1))/10.0
-                else:
-                    # Fallback to old behavior if no brackets found
-                    response_text_cleaned = re.sub(r'[^0-9]', '', response_text)
-                    score = float(response_text_cleaned)/10.0
-            except ValueError:
-                print(f"Failed to parse score from response: {response_text}")
-                score = 0.0
+                score = self.cache.get(self.cache.make_key(item.key_fields)) if self.cache is not None else None
+                if score is None:
+                    score = self._judge_question(item)
+                judged = score is not None
+                verdict.set_result(score if judged else 0.0)
             except Exception as e:
-                print(f"Unexpected error parsing score: {e}")
-                score = 0.0
+                verdict.set_exception(e)
+            finally:
+                # a failed judgement scores 0 but isn't kept, so that a later identical candidate is judged again
+                if not judged:
+                    with self.lock:
+                        del self.verdicts[key]
 
-            scores.append(score)
+        return verdict.result()
 
-        self.model.unload()
-        return scores
-    
     def shutdown(self):
-        return
\ No newline at end of file
+        # the judge stays loaded across every model and suite of the run, release it at the very end
+        with self.lock:
+            if self.loaded:
+                self.model.unload()
+                self.loaded = False
@@ -0,0 +1,316 @@
+import argparse
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+# default reply to non-judge prompts - a tool call, so that FunctionCallingScorer has something to compare
+DEFAULT_RESPONSE = "<tool_call>{\"name\": \"make_npc_wait\", \"arguments\": {\"is_waiting\": true}}</tool_call>"
+JUDGE_SCORE = 7
+
+BATCH_JUDGE_PATTERN = re.compile(r"rate each of the following (\d+) responses")
+JUDGE_PATTERN = re.compile(r"rate the following response")
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse a latency distribution, in seconds.
+
+    Understands "constant:S", "uniform:LOW,HIGH", "normal:MEAN,STDDEV", "lognormal:MEDIAN,SIGMA" and
+    "exponential:MEAN". Negative samples are clamped to 0.
+    """
+    name, _, arguments = spec.partition(":")
+    try:
+        values = [float(value) for value in arguments.split(",")] if arguments else []
+    except ValueError:
+        raise Exception(f"Invalid latency distribution {spec}, the parameters must be numbers")
+
+    distributions = {
+        "constant": (1, lambda rng, v: v[0]),
+        "uniform": (2, lambda rng, v: rng.uniform(v[0], v[1])),
+        "normal": (2, lambda rng, v: rng.gauss(v[0], v[1])),
+        "lognormal": (2, lambda rng, v: v[0] * rng.lognormvariate(0, v[1])),
+        "exponential": (1, lambda rng, v: rng.expovariate(1 / v[0]) if v[0] > 0 else 0.0)
+    }
+    if name not in distributions or len(values) != distributions[name][0]:
+        raise Exception(f"Invalid latency distribution {spec}, expected one of constant:S, uniform:LOW,HIGH, "
+                        f"normal:MEAN,STDDEV, lognormal:MEDIAN,SIGMA or exponential:MEAN")
+
+    sample = distributions[name][1]
+    return lambda rng: max(0.0, sample(rng, values))
+
+
+class MockServer:
+    """
+    OpenAI-compatible chat completions server for measuring the benchmark without a real model.
+
+    Each call waits for a sampled latency (time to first token) plus the time to generate its tokens at
+    tokens_per_second, and can be made to fail with a 500 or 429 at the given rates. Streaming, the model
+    listings (/v1/models and LM Studio's /api/v0/models) and judge prompts are supported, so every model
+    and scorer of the benchmark can be run against it. Counts of what was served are kept in stats().
+    """
+
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency: str = "constant:0",
+                 tokens_per_second: float = 0,
+                 error_rate: float = 0,
+                 rate_limit_rate: float = 0,
+                 retry_after: float = 1,
+                 response: str = DEFAULT_RESPONSE,
+                 models: Optional[List[str]] = None,
+                 seed: int = 0,
+                 poll_interval: float = 0.05):
+        """
+        Initialize the mock server.
+
+        Args:
+            host: Address to listen on
+            port: Port to listen on, 0 for any free port
+            latency: Distribution of the time to first token (see parse_distribution)
+            tokens_per_second: Generation speed of the response tokens, 0 for instant
+            error_rate: Fraction of calls answered with a 500
+            rate_limit_rate: Fraction of calls answered with a 429
+            retry_after: Retry-After of the 429 responses, in seconds
+            response: Reply to every prompt that isn't a judge prompt
+            models: Model names reported as loaded by the model listings
+            seed: Seed of the latency and fault sampling
+            poll_interval: How often the serving thread checks for stop(), in seconds
+        """
+        self.latency = parse_distribution(latency)
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.response = response
+        self.models = models or ["mock-model"]
+        self.random = random.Random(seed)
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "completions": 0, "streamed": 0, "errors": 0, "rate_limited": 0,
+                       "prompt_tokens": 0, "completion_tokens": 0, "delay_seconds": 0.0, "max_in_flight": 0}
+        self.in_flight = 0
+        # open client connections, closed by stop() like a server going down would
+        self.connections = set()
+
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """Serve in a background thread, returning the endpoint URL."""
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": self.poll_interval},
+                                       name="mock-server", daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+        # keep-alive connections would otherwise carry on being served by their handler threads. Their
+        # handlers now fail to write - expected, so not reported
+        self.server.handle_error = lambda request, client_address: None
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self) -> "MockServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.counts)
+
+    def _enter(self) -> None:
+        with self.lock:
+            self.in_flight += 1
+            self.counts['max_in_flight'] = max(self.counts['max_in_flight'], self.in_flight)
+
+    def _leave(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+    def _count(self, **increments) -> None:
+        with self.lock:
+            for key, value in increments.items():
+                self.counts[key] += value
+
+    def _sample(self) -> Dict[str, Any]:
+        """Sample the fault and latency of a call."""
+        with self.lock:
+            fault = self.random.random()
+            latency = self.latency(self.random)
+        if fault < self.error_rate:
+            return {"status": 500, "latency": latency}
+        if fault < self.error_rate + self.rate_limit_rate:
+            return {"status": 429, "latency": 0.0}
+        return {"status": 200, "latency": latency}
+
+    def reply(self, messages: List[Dict[str, Any]]) -> str:
+        """The response text to a conversation - a list of scores for judge prompts, the configured response otherwise."""
+        prompt = str(messages[-1].get('content', '')) if messages else ""
+        batch = BATCH_JUDGE_PATTERN.search(prompt)
+        if batch:
+            return f"[{', '.join([str(JUDGE_SCORE)] * int(batch.group(1)))}] The responses are reasonable."
+        if JUDGE_PATTERN.search(prompt):
+            return f"[{JUDGE_SCORE}] The response is reasonable."
+        return self.response
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep connections alive, as real servers do
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately - without TCP_NODELAY the client's delayed ACK adds ~40ms per call
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with mock.lock:
+                    mock.connections.add(self.connection)
+
+            def finish(self):
+                with mock.lock:
+                    mock.connections.discard(self.connection)
+                super().finish()
+
+            def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, data: str) -> None:
+                encoded = data.encode('utf-8')
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(encoded), encoded))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip("/") in ["/v1/models", "/api/v0/models"]:
+                    self._send_json(200, {"object": "list", "data": [
+                        {"id": model, "object": "model", "type": "llm", "state": "loaded"} for model in mock.models]})
+                elif self.path.rstrip("/") == "/mock/stats":
+                    self._send_json(200, mock.stats())
+                else:
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+
+                mock._count(requests=1)
+                # the highest number of chat completions in progress at once, to check client concurrency limits
+                mock._enter()
+                try:
+                    self._complete(body)
+                finally:
+                    mock._leave()
+
+            def _complete(self, body):
+                call = mock._sample()
+                if call['status'] == 429:
+                    mock._count(rate_limited=1)
+                    self._send_json(429, {"error": {"message": "Rate limit exceeded"}}, {"Retry-After": str(mock.retry_after)})
+                    return
+
+                time.sleep(call['latency'])
+                if call['status'] == 500:
+                    mock._count(errors=1, delay_seconds=call['latency'])
+                    self._send_json(500, {"error": {"message": "Injected server error"}})
+                    return
+
+                messages = body.get('messages', [])
+                tokens = mock.reply(messages).split(" ")
+                token_time = 1 / mock.tokens_per_second if mock.tokens_per_second > 0 else 0.0
+                usage = {"prompt_tokens": len(json.dumps(messages)) // 4, "completion_tokens": len(tokens),
+                         "total_tokens": len(json.dumps(messages)) // 4 + len(tokens)}
+                # the latency is the time to the first token, the others follow at tokens_per_second
+                generation_time = token_time * (len(tokens) - 1)
+                mock._count(completions=1, prompt_tokens=usage['prompt_tokens'], completion_tokens=usage['completion_tokens'],
+                            delay_seconds=call['latency'] + generation_time)
+
+                if not body.get('stream'):
+                    time.sleep(generation_time)
+                    self._send_json(200, {"id": "mock", "object": "chat.completion", "model": body.get('model'),
+                                          "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(tokens)},
+                                                       "finish_reason": "stop"}],
+                                          "usage": usage})
+                    return
+
+                mock._count(streamed=1)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for n, token in enumerate(tokens):
+                    if n > 0:
+                        time.sleep(token_time)
+                    content = token if n == 0 else " " + token
+                    self._send_chunk("data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": content}}]}) + "\n\n")
+                self._send_chunk("data: " + json.dumps({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}) + "\n\n")
+                self._send_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server for running the benchmark without a model",
+                                     epilog="Example: python mock_server.py --port 1234 --latency lognormal:0.3,0.5 --tokens-per-second 40")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=1234, help="Port to listen on")
+    parser.add_argument("--latency", default="constant:0", help="Time to first token distribution in seconds, e.g. constant:0.2, uniform:0.1,0.5, lognormal:0.3,0.5")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Generation speed of the response tokens (0 for instant)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of calls answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Fraction of calls answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After of the 429 responses in seconds")
+    parser.add_argument("--response", default=DEFAULT_RESPONSE, help="Reply to every prompt that isn't a judge prompt")
+    parser.add_argument("--models", nargs="+", default=["mock-model"], help="Model names reported as loaded")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the latency and fault sampling")
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, args.latency, args.tokens_per_second, args.error_rate, args.rate_limit_rate,
+                        args.retry_after, args.response, args.models, args.seed)
+    print(f"Mock server listening on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+        print(f"Served: {server.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import threading
+from typing import Callable, Dict, List, Optional
+
+from base_llm_model import BaseLLMModel
+from utils import Timer
+
+
+class ModelLifecycle:
+    """
+    Keeps models loaded across all of their test suites, and optionally warms up the next model.
+
+    A model is loaded on first use and stays resident until it is released, instead of being reloaded
+    for every test suite. With prefetching enabled, the next model is loaded in the background while the
+    current model's results are being scored - provided it fits in the configured memory budget.
+    """
+
+    def __init__(self,
+                 create_model: Callable[[str], BaseLLMModel],
+                 prefetch: bool = False,
+                 memory_budget_gb: Optional[float] = None,
+                 other_resident_models: Optional[Callable[[], List[BaseLLMModel]]] = None):
+        """
+        Initialize the model lifecycle.
+
+        Args:
+            create_model: Creates the (not yet loaded) model for a model name
+            prefetch: Load the next model in the background while the current one is being scored
+            memory_budget_gb: Optional upper bound on the size of all resident models; a model is only
+                prefetched if it fits alongside the models that are already loaded
+            other_resident_models: Returns the loaded models not managed here (e.g. an LM Studio judge), which
+                count against the memory budget too
+        """
+        self.create_model = create_model
+        self.prefetch_enabled = prefetch
+        self.memory_budget = memory_budget_gb * 1024 ** 3 if memory_budget_gb else None
+        self.other_resident_models = other_resident_models or (lambda: [])
+        self.lock = threading.Lock()
+        self.models: Dict[str, BaseLLMModel] = {}
+        self.prefetches: Dict[str, threading.Thread] = {}
+        self.prefetch_errors: Dict[str, Exception] = {}
+
+    def _model_size(self, model: BaseLLMModel) -> Optional[int]:
+        get_size_bytes = getattr(model, "get_size_bytes", None)
+        if get_size_bytes is None:
+            return None
+        try:
+            return get_size_bytes()
+        except Exception as e:
+            print(f"Could not determine the size of the model: {e}")
+            return None
+
+    def _fits_in_memory(self, model: BaseLLMModel) -> bool:
+        if self.memory_budget is None:
+            return True
+
+        # called under self.lock - the models still loaded here, the judge and anything else resident
+        resident = list(self.models.values()) + self.other_resident_models()
+        sizes = [self._model_size(model) for model in resident] + [self._model_size(model)]
+        if None in sizes:
+            # unknown sizes - be conservative and don't load two models at once
+            return not resident
+        return sum(sizes) <= self.memory_budget
+
+    def acquire(self, model_name: str) -> BaseLLMModel:
+        """Return the loaded model, loading it (or waiting for its prefetch to finish) if necessary."""
+        with self.lock:
+            prefetch = self.prefetches.pop(model_name, None)
+        if prefetch is not None:
+            with Timer(f"Waiting for prefetch of {model_name}"):
+                prefetch.join()
+            with self.lock:
+                error = self.prefetch_errors.pop(model_name, None)
+            if error is not None:
+                print(f"Prefetch of {model_name} failed, loading again: {error}")
+
+        with self.lock:
+            model = self.models.get(model_name)
+        if model is not None:
+            return model
+
+        model = self.create_model(model_name)
+        with Timer("Model load time"):
+            model.load()
+        with self.lock:
+            self.models[model_name] = model
+        return model
+
+    def prefetch(self, model_name: Optional[str]) -> None:
+        """
+        Start loading a model in the background, if prefetching is enabled and the model fits in memory.
+
+        Call it before releasing the current model - it is still resident while the next one loads.
+        """
+        if not self.prefetch_enabled or model_name is None:
+            return
+
+        with self.lock:
+            if model_name in self.models or model_name in self.prefetches:
+                return
+
+            model = self.create_model(model_name)
+            if not self._fits_in_memory(model):
+                print(f"Not prefetching {model_name}, it does not fit in the memory budget")
+                return
+
+            def load():
+                try:
+                    model.load()
+                except Exception as e:
+                    with self.lock:
+                        self.prefetch_errors[model_name] = e
+                    return
+                with self.lock:
+                    self.models[model_name] = model
+
+            print(f"Prefetching model {model_name}")
+            thread = threading.Thread(target=load, daemon=True)
+            self.prefetches[model_name] = thread
+            thread.start()
+
+    def release(self, model_name: str) -> None:
+        """Unload a model that is no longer needed."""
+        with self.lock:
+            model = self.models.pop(model_name, None)
+        if model is not None:
+            try:
+                model.unload()
+            except Exception as e:
+                print(f"Error unloading model {model_name}: {e}")
+
+    def release_others(self, model_name: str) -> None:
+        """Unload every resident model except the given one."""
+        with self.lock:
+            others = [resident for resident in self.models if resident != model_name]
+        for resident in others:
+            self.release(resident)
+
+    def shutdown(self) -> None:
+        """Wait for outstanding prefetches and unload every resident model."""
+        with self.lock:
+            prefetches = list(self.prefetches.values())
+            self.prefetches.clear()
+        for thread in prefetches:
+            thread.join()
+        with self.lock:
+            model_names = list(self.models)
+        for model_name in model_names:
+            self.release(model_name)
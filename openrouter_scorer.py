@@ -1,146 +1,196 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 import os
 import json
-import requests
 import time
-import re
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
-from scorer import Scorer
+from http_session import get_session
+from rate_limiter import RETRYABLE_STATUS_CODES, get_rate_limiter
+from response_cache import ResponseCache
+from scorer import (JudgeItem, Scorer, batch_judge_items, batch_scoring_message, group_judge_items,
+                    parse_batch_judge_scores, parse_judge_score)
 
-
-class RateLimiter:
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.last_rate_limit_time = 0
-        self.rate_limit_delay = 60  # 1 minute in seconds
-    
-    def handle_rate_limit(self):
-        with self.lock:
-            current_time = time.time()
-            time_since_last_limit = current_time - self.last_rate_limit_time
-            
-            if time_since_last_limit < self.rate_limit_delay:
-                # Need to wait for the remaining time
-                wait_time = self.rate_limit_delay - time_since_last_limit
-                print(f"Rate limit detected. All threads waiting {wait_time:.1f} seconds...")
-                time.sleep(wait_time)
-            
-            self.last_rate_limit_time = time.time()
-            print("Resuming after rate limit cooldown...")
+OPENROUTER_API_ENDPOINT = "https://openrouter.ai/api"
 
 
 class OpenRouterScorer(Scorer):
+    supports_pipelining = True
+    pipeline_workers = 10
 
-    def __init__(self, model: str):
+    def __init__(self, model: str, cache: Optional[ResponseCache] = None, batch_size: int = 1):
         self.api_key=os.getenv("OPENROUTER_API_KEY")
         if self.api_key is None or self.api_key == "":
             raise Exception("OPENROUTER_API_KEY is not set")
         self.model = model
-        self.rate_limiter = RateLimiter()
+        # OPENROUTER_API_ENDPOINT may point the judge at another OpenAI-compatible server, e.g. the mock server
+        self.endpoint = os.getenv("OPENROUTER_API_ENDPOINT") or OPENROUTER_API_ENDPOINT
+        self.rate_limiter = get_rate_limiter(self.endpoint, model)
+        self.cache = cache
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        # verdicts of this run, in flight or successful, by (question, setup prompts, candidate) - identical
+        # candidates (e.g. of later iterations) share them even without a verdict cache
+        self.verdicts: Dict[Tuple[str, str, str], Future] = {}
+
+    def _request_judgement(self, message: str, label: str) -> Optional[str]:
+        """Send a judge prompt, returning the judge's response text or None if the request failed."""
+        max_retries = 5
+        for attempt in range(max_retries):
+            self.rate_limiter.acquire()
+            try:
+                response = get_session().post(
+                    url=f"{self.endpoint}/v1/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {self.api_key}",
+                    },
+                    data=json.dumps({
+                        "model": self.model,
+                        "messages": [
+                        {
+                            "role": "user",
+                            "content": f"{message}"
+                        }
+                        ]
+                    })
+                )
+
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt == max_retries - 1:
+                    # Success, non-retryable error or out of retries
+                    break
+
+                if response.status_code == 429:  # Rate limited - only this model's bucket is paused
+                    self.rate_limiter.on_rate_limited(response.headers, attempt)
+                else:  # Transient server error
+                    time.sleep(self.rate_limiter.backoff(attempt))
+
+            except Exception as e:
+                print(f"Request failed for {label}: {e}")
+                if attempt < max_retries - 1:
+                    time.sleep(self.rate_limiter.backoff(attempt))
+                    continue
+                else:
+                    return None
+
+        #check if the response is valid
+        if response.status_code != 200:
+            print(f"Failed to score {label}: {response.status_code} {response.text}")
+            return None
+
+        self.rate_limiter.on_success(response.headers)
+
+        try:
+            return response.json()['choices'][0]['message']['content']
+        except Exception as e:
+            print(f"Unexpected judge response for {label}: {e}")
+            return None
+
+    def _judge_question(self, item: JudgeItem, label: str) -> Optional[float]:
+        """Judge one response, returning None if the request failed or its score could not be parsed."""
+        response_text = self._request_judgement(item.scoring_message(), label)
+        if response_text is None:
+            return None
+
+        #remove any non-numeric characters
+        try:
+            score = parse_judge_score(response_text)
+        except ValueError:
+            print(f"Failed to parse score from response: {response_text}")
+            return None
+        except Exception as e:
+            print(f"Unexpected error parsing score: {e}")
+            return None
+
+        if self.cache is not None:
+            self.cache.put(self.cache.make_key(item.key_fields), score)
+        return score
+
+    def _process_question(self, args):
+        i, item = args
+        score = self._judge_question(item, f"question {i}")
+        return i, 0.0 if score is None else score
+
+    def _process_batch(self, batch: List[Tuple[int, JudgeItem]]) -> List[Tuple[int, float]]:
+        """Judge several responses to the same question in one request, falling back to one request per response."""
+        if len(batch) == 1:
+            return [self._process_question(batch[0])]
+
+        items = [item for _, item in batch]
+        response_text = self._request_judgement(batch_scoring_message(items), f"batch of {len(items)} responses")
+        scores = parse_batch_judge_scores(response_text, len(items)) if response_text is not None else None
+        if scores is None:
+            print(f"Failed to parse batched scores, judging the {len(items)} responses one at a time")
+            return [self._process_question(args) for args in batch]
+
+        if self.cache is not None:
+            for item, score in zip(items, scores):
+                self.cache.put(self.cache.make_key(item.key_fields), score)
+        return [(i, score) for (i, _), score in zip(batch, scores)]
 
     def score(self, model_name: str, test_name: str, questions: List[List[Dict[str, Any]]], references: List[str], candidates: List[str]) -> List[float]:
 
-        def process_question(args):
-            i, question, candidate = args
-            
-            question_text = question[len(question) - 1]['content']
-            initial_prompts = json.dumps(question[:-1])
-            message = f"For the question, \"{question_text}\", and the initial prompts: \"{initial_prompts}\", rate the following response on a scale of 0-10, replying with just your numerical score in brackets like [8], and then including your reasoning: \"{candidate}\""
-
-            max_retries = 5
-            for attempt in range(max_retries):
-                try:
-                    response = requests.post(
-                        url="https://openrouter.ai/api/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {self.api_key}",
-                        },
-                        data=json.dumps({
-                            "model": self.model,
-                            "messages": [
-                            {
-                                "role": "user",
-                                "content": f"{message}"
-                            }
-                            ]
-                        })
-                    )
-
-                    # Check if we hit a rate limit
-                    if response.status_code in [429]:  # Rate limited
-                        self.rate_limiter.handle_rate_limit()
-                        continue  # Retry immediately after cooldown
-                    elif response.status_code in [400, 500, 502]:  # Other errors
-                        if attempt < max_retries - 1:
-                            time.sleep(2)  # Short delay for other errors
-                            continue
-                        else:
-                            break
-                    else:
-                        # Success or non-retryable error
-                        break
-
-                except Exception as e:
-                    print(f"Request failed for question {i}: {e}")
-                    if attempt < max_retries - 1:
-                        time.sleep(2)
-                        continue
-                    else:
-                        return i, 0.0
-
-            #check if the response is valid
-            if response.status_code != 200:
-                print(f"Failed to score question {i}: {response.status_code} {response.text}")
-                return i, 0.0
-
-            #remove any non-numeric characters
-            try:
-                response_json = response.json()
-                response_text = response_json['choices'][0]['message']['content']
-                
-                # Extract first number between square brackets using regex
-                match = re.search(r'\[(.*?)\]', response_text)
-                if match:
-                    score = float(match.group(1))/10.0
-                else:
-                    # Fallback to old behavior if no brackets found
-                    response_text_cleaned = re.sub(r'[^0-9]', '', response_text)
-                    score = float(response_text_cleaned)/10.0
-            except ValueError:
-                print(f"Failed to parse score from response: {response_text}")
-                score = 0.0
-            except Exception as e:
-                print(f"Unexpected error parsing score: {e}")
-                score = 0.0
+        # identical candidates (common across iterations) are only judged once
+        unique_items, item_indices = group_judge_items(self.model, questions, candidates)
 
-            return i, score
+        unique_scores = []
+        for item in unique_items:
+            unique_scores.append(self.cache.get(self.cache.make_key(item.key_fields)) if self.cache is not None else None)
 
-        # Prepare arguments for parallel processing
-        args_list = [(i, question, candidates[i]) for i, question in enumerate(questions)]
+        to_score = [u for u, score in enumerate(unique_scores) if score is None]
+        # responses to the same question are packed into judge requests of up to batch_size responses
+        batches = batch_judge_items(unique_items, to_score, self.batch_size)
+        print(f"Judging {len(to_score)} unique responses in {len(batches)} requests ({len(candidates) - len(to_score)} duplicate or cached)")
         
         # Use ThreadPoolExecutor for parallel processing
         # Use max_workers=5 to avoid overwhelming the API
-        scores = [0.0] * len(questions)  # Initialize with default scores
         completed = 0
         
         with ThreadPoolExecutor(max_workers=10) as executor:
             # Submit all tasks
-            future_to_index = {executor.submit(process_question, args): args[0] for args in args_list}
+            futures = [executor.submit(self._process_batch, [(u, unique_items[u]) for u in batch]) for batch in batches]
             
             # Process completed tasks
-            for future in as_completed(future_to_index):
-                index, score = future.result()
-                scores[index] = score
-                completed += 1
+            for future in as_completed(futures):
+                for index, score in future.result():
+                    unique_scores[index] = score
+                    completed += 1
                 
                 # Update progress
-                percentage_progress = (completed * 100) / len(questions)
+                percentage_progress = (completed * 100) / len(to_score)
                 print(f"\rScoring progress: {percentage_progress:.2f}% ...", end="", flush=True)
 
         print()
-        return scores
+        return [unique_scores[u] for u in item_indices]
     
+    def score_one(self, model_name: str, test_name: str, question: List[Dict[str, Any]], reference: str, candidate: str) -> float:
+        item = JudgeItem(self.model, question, candidate)
+        key = (item.question_text, item.initial_prompts, candidate)
+
+        # identical candidates wait for the verdict of the first one, or reuse it once it is known
+        with self.lock:
+            verdict = self.verdicts.get(key)
+            is_first = verdict is None
+            if is_first:
+                verdict = Future()
+                self.verdicts[key] = verdict
+
+        if is_first:
+            judged = False
+            try:
+                score = self.cache.get(self.cache.make_key(item.key_fields)) if self.cache is not None else None
+                if score is None:
+                    score = self._judge_question(item, "question 0")
+                judged = score is not None
+                verdict.set_result(score if judged else 0.0)
+            except Exception as e:
+                verdict.set_exception(e)
+            finally:
+                # a failed judgement scores 0 but isn't kept, so that a later identical candidate is judged again
+                if not judged:
+                    with self.lock:
+                        del self.verdicts[key]
+
+        return verdict.result()
+
     def shutdown(self):
         return
@@ -0,0 +1,195 @@
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+# status codes worth retrying - 400 is a malformed request and will fail the same way every time
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Return the number of seconds a server asked us to wait, or None if it did not say.
+
+    Understands the standard Retry-After header (seconds or HTTP date) as well as the
+    x-ratelimit-reset family used by OpenAI-compatible providers, which may be a duration
+    ("1s", "6m0s", "250ms"), or an epoch timestamp in seconds or milliseconds.
+    """
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    for header in ["x-ratelimit-reset-requests", "x-ratelimit-reset"]:
+        reset = headers.get(header)
+        if reset:
+            seconds = _parse_reset(reset)
+            if seconds is not None:
+                return seconds
+
+    return None
+
+
+def _parse_reset(value: str) -> Optional[float]:
+    try:
+        number = float(value)
+    except ValueError:
+        # duration such as "1m30s" or "250ms"
+        parts = re.findall(r'([0-9.]+)(ms|h|m|s)', value)
+        if not parts:
+            return None
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(amount) * units[unit] for amount, unit in parts)
+
+    if number > 1e12:  # epoch milliseconds
+        return max(0.0, number / 1000 - time.time())
+    if number > 1e9:  # epoch seconds
+        return max(0.0, number - time.time())
+    return max(0.0, number)
+
+
+def _parse_remaining(headers: Mapping[str, str]) -> Optional[int]:
+    for header in ["x-ratelimit-remaining-requests", "x-ratelimit-remaining"]:
+        remaining = headers.get(header)
+        if remaining:
+            try:
+                return int(float(remaining))
+            except ValueError:
+                pass
+    return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket rate limiter that tunes its rate from the responses it sees (AIMD).
+
+    The bucket starts out unlimited, so endpoints that never rate limit (e.g. a local server) are
+    never slowed down. The first 429 starts the limiting at max_rate; from then on every successful
+    call additively increases the allowed rate, and every 429 multiplicatively decreases it. When the server says how long to wait (Retry-After / x-ratelimit-* headers)
+    only this bucket is paused for that long, otherwise an exponential backoff with jitter is used.
+    """
+
+    def __init__(self,
+                 initial_rate: Optional[float] = None,
+                 min_rate: float = 0.1,
+                 max_rate: float = 50.0,
+                 rate_increase: float = 0.5,
+                 rate_decrease: float = 0.5,
+                 base_backoff: float = 1.0,
+                 max_backoff: float = 60.0):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            initial_rate: Requests per second allowed before any feedback is received, None for unlimited
+            min_rate: Lower bound for the requests per second
+            max_rate: Upper bound for the requests per second
+            rate_increase: Requests per second added after each successful call
+            rate_decrease: Factor the rate is multiplied by after a 429
+            base_backoff: Backoff in seconds for the first retry when the server gives no hint
+            max_backoff: Upper bound in seconds for a single backoff
+        """
+        self.lock = threading.Lock()
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_increase = rate_increase
+        self.rate_decrease = rate_decrease
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+
+    def _refill(self, now: float) -> None:
+        if self.rate is None:
+            self.last_refill = now
+            return
+        burst = max(1.0, self.rate)
+        self.tokens = min(burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait_time = self.blocked_until - now
+                if wait_time <= 0:
+                    if self.rate is None:
+                        return
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with jitter for the given (zero based) retry attempt."""
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def on_success(self, headers: Optional[Mapping[str, str]] = None) -> None:
+        """Record a successful call, pausing early if the server reports an exhausted quota."""
+        with self.lock:
+            if self.rate is not None:
+                self.rate = min(self.max_rate, self.rate + self.rate_increase)
+
+            if headers is not None and _parse_remaining(headers) == 0:
+                reset = parse_retry_after(headers)
+                if reset is not None:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+
+    def on_rate_limited(self, headers: Optional[Mapping[str, str]], attempt: int) -> float:
+        """
+        Record a 429 response.
+
+        Args:
+            headers: The response headers
+            attempt: The (zero based) retry attempt of the call that was rate limited
+
+        Returns:
+            The number of seconds this bucket is paused for
+        """
+        delay = parse_retry_after(headers) if headers is not None else None
+        if delay is None:
+            delay = self.backoff(attempt)
+        delay = min(delay, self.max_backoff)
+
+        with self.lock:
+            now = time.monotonic()
+            if self.rate is None:
+                self.rate = self.max_rate
+            # a burst of in-flight requests often all come back 429 - only back off the rate once for it
+            if now - self.last_decrease > 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.rate_decrease)
+                self.last_decrease = now
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, now + delay)
+        return delay
+
+
+_rate_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, model: str) -> AdaptiveRateLimiter:
+    """Return the rate limiter shared by every caller of the given provider endpoint and model."""
+    key = f"{provider}|{model}"
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(key)
+        if rate_limiter is None:
+            rate_limiter = AdaptiveRateLimiter()
+            _rate_limiters[key] = rate_limiter
+        return rate_limiter
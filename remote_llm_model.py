@@ -1,6 +1,11 @@
 import requests
 from typing import Dict, List, Any, Optional
-from base_llm_model import BaseLLMModel
+from base_llm_model import BaseLLMModel, ModelResponse, is_deterministic_sampling
+from http_session import get_session
+from rate_limiter import RETRYABLE_STATUS_CODES, get_rate_limiter
+from response_cache import ResponseCache, cached_call
+from streaming import read_sse_stream, response_from_completion
+from suite_compiler import encode_chat_request
 import json
 import time
 
@@ -13,7 +18,9 @@ class RemoteLLMModel(BaseLLMModel):
                  api_key: Optional[str] = None,
                  model_name: str = "default",
                  headers: Optional[Dict[str, str]] = None,
-                 timeout: int = 30):
+                 timeout: int = 30,
+                 cache: Optional[ResponseCache] = None,
+                 stream: bool = False):
         """
         Initialize the remote LLM model.
         
@@ -23,11 +30,15 @@ class RemoteLLMModel(BaseLLMModel):
             model_name: Name of the model to use
             headers: Optional additional headers for the API requests
             timeout: Request timeout in seconds
+            cache: Optional response cache consulted before calling the API
+            stream: Stream responses, measuring time to first token and tokens/sec
         """
         self.api_endpoint = api_endpoint
         self.api_key = api_key
         self.model_name = model_name
         self.timeout = timeout
+        self.cache = cache
+        self.stream = stream
         
         # Set up default headers
         self.headers = {
@@ -54,90 +65,94 @@ class RemoteLLMModel(BaseLLMModel):
         Returns:
             The generated response string
         """
-        max_retries = 5
-        retry_count = 0
-        
-        while retry_count <= max_retries:
-            try:
-                payload = {
-                    "model": self.model_name,
-                    "messages": [{"role": "user", "content": prompt}]
-                }
-                
-                response = requests.post(
-                    f"{self.api_endpoint}/v1/chat/completions",
-                    json=payload,
-                    headers=self.headers,
-                    timeout=self.timeout
-                )
-                response.raise_for_status()
-                
-                response_json = response.json()
-                return response_json['choices'][0]['message']['content']
-                
-            except requests.exceptions.HTTPError as e:
-                if (e.response.status_code in [400, 429, 502]) and retry_count < max_retries:
-                    print(f"Rate limit exceeded ({e.response.status_code}), retrying in 10 seconds... (attempt {retry_count + 1}/{max_retries + 1})")
-                    time.sleep(10)
-                    retry_count += 1
-                    continue
-                elif e.response.status_code in [400, 429, 502]:
-                    print(f"Rate limit exceeded ({e.response.status_code}) after retry: {e}")
-                    raise Exception(f"Rate limit exceeded after retry: {e}")
-                else:
-                    print(f"HTTP error occurred: {e}")
-                    raise Exception(f"HTTP error occurred: {e}")
-            except requests.exceptions.RequestException as e:
-                print(f"Failed to call remote LLM: {e}")
-                raise Exception(f"Failed to call remote LLM: {e}")
-            except (KeyError, IndexError) as e:
-                print(f"Invalid response format from remote LLM: {e}")
-                raise Exception(f"Invalid response format from remote LLM: {e}")
+        return self._post_chat([{"role": "user", "content": prompt}]).content
     
-    def call_with_messages(self, messages_json: str) -> str:
+    def call_with_messages(self, messages_json: str, iteration: int = 0) -> str:
         """
         Generate a response for a conversation with multiple messages.
         
         Args:
             messages_json: JSON string containing the conversation messages
+            iteration: Test iteration index, part of the response cache key
             
         Returns:
             The generated response string
         """
+        return self.generate_with_messages(messages_json, iteration).content
+
+    def generate_with_messages(self, messages_json: str, iteration: int = 0, sampling: Optional[Dict[str, Any]] = None) -> ModelResponse:
+        """Generate a response for a conversation, including the streaming metrics when streaming is enabled."""
+        key_fields = {
+            "model_type": "remote",
+            "endpoint": self.api_endpoint,
+            "model": self.model_name,
+            "messages": messages_json,
+            "sampling": sampling or {},
+            # streamed responses carry timing metrics (TTFT, inter-token latency) that non-streamed ones lack
+            "stream": self.stream,
+            # greedy or seeded responses don't differ between iterations, so they are cached once for all of them
+            "iteration": 0 if is_deterministic_sampling(sampling) else iteration
+        }
+        return cached_call(self.cache, key_fields, lambda: self._post_chat(messages_json, sampling))
+
+    def _post_chat(self, messages, sampling: Optional[Dict[str, Any]] = None) -> ModelResponse:
+        """
+        Send a chat completion request, retrying rate limits and transient server errors.
+
+        Requests are paced by the adaptive rate limiter shared by all callers of this endpoint and model.
+        """
         max_retries = 5
-        retry_count = 0
-        
-        while retry_count <= max_retries:
-            try:            
+        rate_limiter = get_rate_limiter(self.api_endpoint, self.model_name)
+
+        for attempt in range(max_retries + 1):
+            rate_limiter.acquire()
+            try:
                 payload = {
                     "model": self.model_name,
-                    "messages": messages_json
+                    **(sampling or {})
                 }
+                if self.stream:
+                    payload["stream"] = True
+                    payload["stream_options"] = {"include_usage": True}
                 
-                response = requests.post(
+                # timed per attempt, after the rate limiter - throttling and backoff are not part of the call latency
+                start_time = time.perf_counter()
+                response = get_session().post(
                     f"{self.api_endpoint}/v1/chat/completions",
-                    json=payload,
+                    data=encode_chat_request(payload, messages),
                     headers=self.headers,
-                    timeout=self.timeout
+                    timeout=self.timeout,
+                    stream=self.stream
                 )
+
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < max_retries:
+                    if response.status_code == 429:
+                        delay = rate_limiter.on_rate_limited(response.headers, attempt)
+                        print(f"Rate limit exceeded ({response.status_code}), retrying in {delay:.1f} seconds... (attempt {attempt + 1}/{max_retries + 1})")
+                    else:
+                        delay = rate_limiter.backoff(attempt)
+                        print(f"Server error ({response.status_code}), retrying in {delay:.1f} seconds... (attempt {attempt + 1}/{max_retries + 1})")
+                        time.sleep(delay)
+                    response.close()
+                    continue
+
                 response.raise_for_status()
-                
-                response_json = response.json()
-                return response_json['choices'][0]['message']['content']
+                rate_limiter.on_success(response.headers)
+
+                if self.stream:
+                    model_response = read_sse_stream(response, start_time)
+                else:
+                    model_response = response_from_completion(response.json())
+                model_response.call_time = time.perf_counter() - start_time
+                return model_response
                 
             except json.JSONDecodeError as e:
                 print(f"Invalid JSON format for messages: {e}")
                 raise Exception(f"Invalid JSON format for messages: {e}")
             except requests.exceptions.HTTPError as e:
-                if (e.response.status_code in [400, 429, 500, 502]):
-                    if retry_count < max_retries:
-                        print(f"Rate limit exceeded ({e.response.status_code}), retrying in 10 seconds... (attempt {retry_count + 1}/{max_retries + 1})")
-                        time.sleep(10)
-                        retry_count += 1
-                        continue
-                    else:
-                        print(f"Rate limit exceeded ({e.response.status_code}) after retry: {e}")
-                        raise Exception(f"Rate limit exceeded after retry: {e}")
+                if e.response.status_code in RETRYABLE_STATUS_CODES:
+                    print(f"Rate limit exceeded ({e.response.status_code}) after retry: {e}")
+                    raise Exception(f"Rate limit exceeded after retry: {e}")
                 else:
                     print(f"HTTP error occurred: {e}")
                     raise Exception(f"HTTP error occurred: {e}")
@@ -167,5 +182,6 @@ class RemoteLLMModel(BaseLLMModel):
             "api_endpoint": self.api_endpoint,
             "model_name": self.model_name,
             "has_api_key": bool(self.api_key),
-            "timeout": self.timeout
+            "timeout": self.timeout,
+            "stream": self.stream
         } 
\ No newline at end of file
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from base_llm_model import ModelResponse
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of model responses.
+
+    Each entry is stored in its own file named after the SHA-256 hash of the request that produced it.
+    The total size of the cache is bounded - when it is exceeded the least recently used entries are
+    evicted, where "used" is tracked through the modification time of the entry files.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 512, read_only: bool = False):
+        """
+        Initialize the response cache.
+
+        Args:
+            path: Directory the cache entries are stored in
+            max_size_mb: Maximum total size of the cache entries in megabytes
+            read_only: Only serve existing entries, never write, touch or evict (replay mode)
+        """
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        self.size = sum(os.path.getsize(entry) for entry in self._entries())
+
+    @staticmethod
+    def make_key(key_fields: Dict[str, Any]) -> str:
+        """Return the content hash identifying a request."""
+        canonical = json.dumps(key_fields, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def _entries(self):
+        if not os.path.isdir(self.path):
+            return
+        for shard in os.scandir(self.path):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.json'):
+                        yield entry.path
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for a key, or None if it is not cached."""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                value = json.load(f)['response']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        if not self.read_only:
+            try:
+                os.utime(entry_path)
+            except OSError:
+                pass
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """Store a value, evicting the least recently used entries if the cache grows too large."""
+        if self.read_only:
+            return
+
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+        # write to a temporary file first so a crash never leaves a truncated entry behind
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({"response": value}, f, ensure_ascii=False)
+        entry_size = os.path.getsize(temp_path)
+
+        with self.lock:
+            if os.path.exists(entry_path):
+                self.size -= os.path.getsize(entry_path)
+            os.replace(temp_path, entry_path)
+            self.size += entry_size
+
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        # evict down to 90% of the limit so that we are not evicting on every single put
+        target_size = self.max_size * 0.9
+        entries = sorted(((os.path.getmtime(entry), entry) for entry in self._entries()))
+        for _, entry in entries:
+            if self.size <= target_size:
+                break
+            try:
+                entry_size = os.path.getsize(entry)
+                os.remove(entry)
+                self.size -= entry_size
+            except OSError:
+                pass
+
+
+def cached_call(cache: Optional[ResponseCache], key_fields: Dict[str, Any], call: Callable[[], ModelResponse]) -> ModelResponse:
+    """
+    Return the cached response for a request, calling the model on a cache miss.
+
+    In replay (read only) mode a cache miss is an error instead, so a replayed run never hits the network.
+    """
+    if cache is None:
+        return call()
+
+    key = cache.make_key(key_fields)
+    cached = cache.get(key)
+    if cached is not None:
+        return ModelResponse.from_dict(cached, cached=True)
+
+    if cache.read_only:
+        raise Exception(f"Response {key} not found in cache (replay mode)")
+
+    response = call()
+    cache.put(key, response.to_dict())
+    return response
+
+
+def create_response_cache(cache_config: Optional[Dict[str, Any]], default_path: str = '.cache/responses') -> Optional[ResponseCache]:
+    """Create the cache described by a `response_cache`/`verdict_cache` config section, if any."""
+    if not cache_config:
+        return None
+
+    mode = cache_config.get('mode', 'readwrite')
+    if mode not in ['readwrite', 'replay']:
+        raise Exception(f"Invalid response cache mode {mode}, expected readwrite or replay")
+
+    return ResponseCache(cache_config.get('path', default_path),
+                         max_size_mb=cache_config.get('max_size_mb', 512),
+                         read_only=(mode == 'replay'))
@@ -0,0 +1,152 @@
+import csv
+import warnings
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# a response scoring at least this much counts as a pass - lower scores are dumped to responses.txt as failures
+PASS_SCORE = 0.5
+
+
+class SuiteScores:
+    """
+    Scores and call latencies of one (model, test suite), as arrays shaped (iterations, tests).
+
+    Cells without a result (e.g. a failed model call) are NaN and ignored by every statistic.
+    """
+
+    def __init__(self, iterations: int, test_count: int):
+        self.scores = np.full((iterations, test_count), np.nan)
+        self.latencies = np.full((iterations, test_count), np.nan)
+
+    @staticmethod
+    def from_cells(test_count: int, iterations: Sequence[int], test_indices: Sequence[int], scores: Sequence[Optional[float]],
+                   latencies: Sequence[float]) -> 'SuiteScores':
+        """Build the arrays from parallel per-call sequences, e.g. the typed arrays of CallRecords."""
+        iteration_indices = np.asarray(iterations, dtype=np.intp)
+        test_indices = np.asarray(test_indices, dtype=np.intp)
+        suite_scores = SuiteScores(int(iteration_indices.max()) + 1 if len(iteration_indices) else 0, test_count)
+        if len(iteration_indices):
+            # unscored calls (None or NaN) stay NaN
+            suite_scores.scores[iteration_indices, test_indices] = np.asarray(scores, dtype=float)
+            suite_scores.latencies[iteration_indices, test_indices] = np.asarray(latencies, dtype=float)
+        return suite_scores
+
+    def bootstrap(self, samples: int = 1000, confidence: float = 0.95, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, float, float]:
+        """
+        Bootstrap confidence intervals of the mean score, resampling the iterations of each test.
+
+        Returns:
+            The per-test lower and upper bounds, and the lower and upper bound of the suite average
+        """
+        iterations = self.scores.shape[0]
+        rng = np.random.default_rng(seed)
+        # the same resampled iterations are used for every test. Rather than gathering a
+        # (samples, iterations, tests) array, count how often each sample draws every iteration and
+        # weight the per-iteration scores with that, which only needs (samples, tests) arrays
+        drawn = rng.integers(0, iterations, size=(samples, iterations))
+        draws = np.bincount((drawn + np.arange(samples)[:, None] * iterations).ravel(),
+                            minlength=samples * iterations).reshape(samples, iterations).astype(float)
+        scored = ~np.isnan(self.scores)
+        counts = draws @ scored.astype(float)
+        sums = draws @ np.where(scored, self.scores, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            test_means = sums / counts
+            suite_means = np.sum(sums, axis=1) / np.sum(counts, axis=1)
+
+        alpha = (1 - confidence) / 2
+        with warnings.catch_warnings():
+            # tests without a single result have no interval
+            warnings.simplefilter('ignore', RuntimeWarning)
+            test_low, test_high = np.nanquantile(test_means, [alpha, 1 - alpha], axis=0)
+            suite_low, suite_high = np.nanquantile(suite_means, [alpha, 1 - alpha])
+        return test_low, test_high, float(suite_low), float(suite_high)
+
+    def per_test(self, tests: List[Any], samples: int = 1000, confidence: float = 0.95) -> Tuple[List[Dict[str, Any]], float, float]:
+        """
+        Per-test statistics: number of runs, pass rate, mean score with its bootstrap confidence interval, and mean latency.
+
+        Returns:
+            The statistics of each test, and the confidence interval of the suite average
+        """
+        runs = np.sum(~np.isnan(self.scores), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pass_rate = np.sum(self.scores >= PASS_SCORE, axis=0) / runs
+            mean_score = np.nansum(self.scores, axis=0) / runs
+            # calls without a latency of their own (replicated or cached responses) are NaN
+            mean_latency = np.nansum(self.latencies, axis=0) / np.sum(~np.isnan(self.latencies), axis=0)
+        ci_low, ci_high, suite_low, suite_high = self.bootstrap(samples, confidence)
+
+        per_test = []
+        for test_index, test in enumerate(tests):
+            per_test.append({
+                "test": test_index,
+                "input": test.input,
+                "runs": int(runs[test_index]),
+                "pass_rate": _optional(pass_rate[test_index]),
+                "mean_score": _optional(mean_score[test_index]),
+                "score_ci_low": _optional(ci_low[test_index]),
+                "score_ci_high": _optional(ci_high[test_index]),
+                "mean_latency": _optional(mean_latency[test_index])
+            })
+        return per_test, suite_low, suite_high
+
+
+def _optional(value) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def usage_summary(latencies: Sequence[float], prompt_tokens: Sequence[float], output_tokens: Sequence[float],
+                  provider_costs: Sequence[float], pricing: Optional[Dict[str, float]] = None,
+                  sent: Optional[Sequence[int]] = None) -> Dict[str, Optional[float]]:
+    """
+    Token usage, throughput and cost of the calls of a (model, suite).
+
+    The arguments are per-call sequences with NaN where a value was not reported. A call's cost is the cost
+    reported by the provider, or else its token counts at the model's pricing (USD per million prompt and
+    completion tokens), if configured. If sent is given, only the calls it marks (non-zero) are counted -
+    replicated and cached responses repeat the usage of another call and would count it again.
+
+    Returns:
+        Total prompt and output tokens, average output tokens, output tokens per second of call time, and the
+        total cost and cost per 1000 calls of the calls with a known cost (None where nothing is known)
+    """
+    latencies = np.asarray(latencies, dtype=float)
+    prompt_tokens = np.asarray(prompt_tokens, dtype=float)
+    output_tokens = np.asarray(output_tokens, dtype=float)
+    costs = np.asarray(provider_costs, dtype=float)
+    if sent is not None:
+        counted = np.asarray(sent, dtype=bool)
+        latencies, prompt_tokens, output_tokens, costs = latencies[counted], prompt_tokens[counted], output_tokens[counted], costs[counted]
+    if pricing:
+        priced = (prompt_tokens * pricing.get('prompt', 0) + output_tokens * pricing.get('completion', 0)) / 1e6
+        costs = np.where(np.isnan(costs), priced, costs)
+
+    # generation speed including the time to first token, comparable between streamed and non-streamed calls
+    timed = ~np.isnan(output_tokens) & (latencies > 0)
+    known_costs = costs[~np.isnan(costs)]
+    return {
+        "total_prompt_tokens": float(np.nansum(prompt_tokens)) if np.any(~np.isnan(prompt_tokens)) else None,
+        "total_output_tokens": float(np.nansum(output_tokens)) if np.any(~np.isnan(output_tokens)) else None,
+        "average_output_tokens": float(np.nanmean(output_tokens)) if np.any(~np.isnan(output_tokens)) else None,
+        "output_tokens_per_second": float(np.sum(output_tokens[timed]) / np.sum(latencies[timed])) if np.any(timed) else None,
+        "total_cost": float(np.sum(known_costs)) if len(known_costs) else None,
+        "cost_per_1k_calls": float(np.mean(known_costs) * 1000) if len(known_costs) else None
+    }
+
+
+PER_TEST_RESULTS_HEADER = ["Model", "Test Suite", "Test", "Input", "Runs", "Pass Rate", "Mean Score", "Score CI Low", "Score CI High", "Mean Latency"]
+
+
+def write_per_test_results(per_test_results_file: str, model_name: str, test_suite_name: str, per_test: List[Dict[str, Any]]) -> None:
+    """Append the per-test statistics of a (model, suite) to the per-test results file."""
+    def format_value(value, decimals):
+        return "" if value is None else f"{value:.{decimals}f}"
+
+    with open(per_test_results_file, "a", newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        for test in per_test:
+            writer.writerow([model_name, test_suite_name, test['test'], test['input'], test['runs'],
+                             format_value(test['pass_rate'], 3), format_value(test['mean_score'], 3),
+                             format_value(test['score_ci_low'], 3), format_value(test['score_ci_high'], 3),
+                             format_value(test['mean_latency'], 2)])
@@ -0,0 +1,397 @@
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    config_file TEXT,
+    journal TEXT,
+    config TEXT
+);
+
+CREATE TABLE IF NOT EXISTS calls (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    model TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    test INTEGER NOT NULL,
+    input TEXT,
+    reference TEXT,
+    response TEXT,
+    PRIMARY KEY (run_id, model, suite, iteration, test)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS scores (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    model TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    test INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (run_id, model, suite, iteration, test)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS timings (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    model TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    test INTEGER NOT NULL,
+    latency REAL,
+    ttft REAL,
+    inter_token_latency REAL,
+    tokens_per_second REAL,
+    output_tokens INTEGER,
+    prompt_tokens INTEGER,
+    cached_prompt_tokens INTEGER,
+    finish_reason TEXT,
+    cost REAL,
+    PRIMARY KEY (run_id, model, suite, iteration, test)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    model TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    min_score REAL,
+    max_score REAL,
+    average_score REAL,
+    score_ci_low REAL,
+    score_ci_high REAL,
+    average_inference_time REAL,
+    p50_inference_time REAL,
+    p90_inference_time REAL,
+    p99_inference_time REAL,
+    max_inference_time REAL,
+    result TEXT,
+    total_prompt_tokens INTEGER,
+    total_output_tokens INTEGER,
+    output_tokens_per_second REAL,
+    total_cost REAL,
+    cost_per_1k_calls REAL,
+    PRIMARY KEY (run_id, model, suite)
+);
+
+CREATE INDEX IF NOT EXISTS calls_model_suite_test ON calls (model, suite, test);
+CREATE INDEX IF NOT EXISTS scores_model_suite_test ON scores (model, suite, test);
+CREATE INDEX IF NOT EXISTS timings_model_suite_test ON timings (model, suite, test);
+CREATE INDEX IF NOT EXISTS results_model_suite ON results (model, suite);
+"""
+
+TIMING_FIELDS = ["latency", "ttft", "inter_token_latency", "tokens_per_second", "output_tokens", "prompt_tokens", "cached_prompt_tokens",
+                 "finish_reason", "cost"]
+
+RESULT_COLUMNS = {
+    "min_score": "min",
+    "max_score": "max",
+    "average_score": "average",
+    "score_ci_low": "average_score_ci_low",
+    "score_ci_high": "average_score_ci_high",
+    "average_inference_time": "average_inference_time",
+    "p50_inference_time": "p50_inference_time",
+    "p90_inference_time": "p90_inference_time",
+    "p99_inference_time": "p99_inference_time",
+    "max_inference_time": "max_inference_time",
+    "total_prompt_tokens": "total_prompt_tokens",
+    "total_output_tokens": "total_output_tokens",
+    "output_tokens_per_second": "output_tokens_per_second",
+    "total_cost": "total_cost",
+    "cost_per_1k_calls": "cost_per_1k_calls"
+}
+
+# columns added after the first release of the store, added to existing databases when they are opened
+MIGRATIONS = {
+    "timings": [("finish_reason", "TEXT"), ("cost", "REAL")],
+    "results": [("total_prompt_tokens", "INTEGER"), ("total_output_tokens", "INTEGER"), ("output_tokens_per_second", "REAL"),
+                ("total_cost", "REAL"), ("cost_per_1k_calls", "REAL")]
+}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+def _average(values) -> Optional[float]:
+    """Average of the values that are known, None if none is."""
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+class ResultsStore:
+    """
+    SQLite store of every benchmark run, kept across runs to compare models and runs over time.
+
+    Each run gets a row in `runs`; the response, score and timings of every call go to the `calls`, `scores`
+    and `timings` tables, and the aggregate of every (model, suite) to `results`. The calls of a suite are
+    inserted in a single transaction once the suite has been scored. The database uses WAL mode, so it can be
+    queried (e.g. exported) while a run is writing to it.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the results store.
+
+        Args:
+            path: Path of the SQLite database file
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        # written from the endpoint threads of sharded runs, always under self.lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # with WAL, NORMAL only risks the last transactions on power loss - the run journal covers those
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        with self.connection:
+            for table, columns in MIGRATIONS.items():
+                existing = {row['name'] for row in self.connection.execute(f"PRAGMA table_info({table})")}
+                for name, column_type in columns:
+                    if name not in existing:
+                        self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    def start_run(self, config_file: str, journal: str, config: Dict[str, Any], resume: bool = False) -> int:
+        """
+        Record the start of a run, or find the unfinished run written to the same journal when resuming.
+
+        Returns:
+            The id of the run
+        """
+        with self.lock, self.connection:
+            if resume:
+                row = self.connection.execute("SELECT id FROM runs WHERE journal = ? AND finished_at IS NULL ORDER BY id DESC LIMIT 1",
+                                              (journal,)).fetchone()
+                if row is not None:
+                    return row['id']
+            cursor = self.connection.execute("INSERT INTO runs (started_at, config_file, journal, config) VALUES (?, ?, ?, ?)",
+                                             (_now(), config_file, journal, json.dumps(config, ensure_ascii=False, default=str)))
+            return cursor.lastrowid
+
+    def finish_run(self, run_id: int) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (_now(), run_id))
+
+    def record_suite(self, run_id: int, model: str, suite: str, calls: List[Dict[str, Any]], result: Dict[str, Any]) -> None:
+        """
+        Record the calls and result of a (model, suite) in one transaction.
+
+        Args:
+            run_id: The run the suite belongs to
+            model: The model name
+            suite: The test suite name
+            calls: One dict per scored call, with iteration, test, input, reference, response, score and the TIMING_FIELDS
+            result: The aggregate result of the suite, as written to the journal
+        """
+        keys = [(run_id, model, suite, call['iteration'], call['test']) for call in calls]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        [key + (call['input'], call['reference'], call['response']) for key, call in zip(keys, calls)])
+            self.connection.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?)",
+                                        [key + (call['score'],) for key, call in zip(keys, calls)])
+            # columns by name, migrated databases have them in a different order
+            self.connection.executemany(f"INSERT OR REPLACE INTO timings (run_id, model, suite, iteration, test, {', '.join(TIMING_FIELDS)}) "
+                                        f"VALUES (?, ?, ?, ?, ?{', ?' * len(TIMING_FIELDS)})",
+                                        [key + tuple(call.get(field) for field in TIMING_FIELDS) for key, call in zip(keys, calls)])
+            self._insert_result(run_id, model, suite, result)
+
+    def record_result(self, run_id: int, model: str, suite: str, result: Dict[str, Any]) -> None:
+        """Record the result of a suite finished by an earlier attempt of the run, unless it is already stored."""
+        with self.lock, self.connection:
+            self._insert_result(run_id, model, suite, result, replace=False)
+
+    def _insert_result(self, run_id: int, model: str, suite: str, result: Dict[str, Any], replace: bool = True) -> None:
+        self.connection.execute(f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO results (run_id, model, suite, {', '.join(RESULT_COLUMNS)}, result) "
+                                f"VALUES (?, ?, ?{', ?' * len(RESULT_COLUMNS)}, ?)",
+                                (run_id, model, suite) + tuple(result.get(key) for key in RESULT_COLUMNS.values())
+                                + (json.dumps(result, ensure_ascii=False),))
+
+    def runs(self) -> List[sqlite3.Row]:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT runs.id, started_at, finished_at, config_file, COUNT(DISTINCT results.model) AS models, COUNT(results.suite) AS suites "
+                "FROM runs LEFT JOIN results ON results.run_id = runs.id GROUP BY runs.id ORDER BY runs.id").fetchall()
+
+    def latest_run_id(self) -> Optional[int]:
+        with self.lock:
+            row = self.connection.execute("SELECT MAX(run_id) AS id FROM results").fetchone()
+        return row['id']
+
+    def results(self, run_id: int, suites: Optional[List[str]] = None) -> List[sqlite3.Row]:
+        """The suite results of a run, in the order they were reported."""
+        query = "SELECT * FROM results WHERE run_id = ?"
+        parameters: List[Any] = [run_id]
+        if suites:
+            query += f" AND suite IN ({', '.join('?' * len(suites))})"
+            parameters += suites
+        with self.lock:
+            return self.connection.execute(query + " ORDER BY rowid", parameters).fetchall()
+
+    def failures(self, run_id: int, below: float) -> List[sqlite3.Row]:
+        """The calls of a run scoring below a threshold, by suite in the order they were reported."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT calls.model, calls.input, calls.reference, calls.response, scores.score FROM calls "
+                "JOIN scores USING (run_id, model, suite, iteration, test) "
+                "JOIN results USING (run_id, model, suite) "
+                "WHERE calls.run_id = ? AND scores.score < ? ORDER BY results.rowid, calls.iteration, calls.test",
+                (run_id, below)).fetchall()
+
+    def leaderboard(self, run_id: int, suites: Optional[List[str]] = None, min_score: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Average score, call time, output tokens per second and cost per 1000 calls of every model of a run across its suites, best first.
+
+        Args:
+            run_id: The run
+            suites: Only average these suites (default all)
+            min_score: Leave out models averaging below this score
+        """
+        models: Dict[str, List[sqlite3.Row]] = {}
+        for row in self.results(run_id, suites):
+            models.setdefault(row['model'], []).append(row)
+
+        leaderboard = []
+        for model, rows in models.items():
+            average_score = sum(row['average_score'] for row in rows) / len(rows)
+            if min_score is not None and average_score < min_score:
+                continue
+            leaderboard.append({"model": model, "suites": len(rows), "average_score": average_score,
+                                "average_call_time": _average(row['average_inference_time'] for row in rows),
+                                "output_tokens_per_second": _average(row['output_tokens_per_second'] for row in rows),
+                                "cost_per_1k_calls": _average(row['cost_per_1k_calls'] for row in rows)})
+        return sorted(leaderboard, key=lambda entry: entry['average_score'], reverse=True)
+
+    def history(self, model: str, suite: Optional[str] = None) -> List[sqlite3.Row]:
+        """The results of a model in every run, oldest first."""
+        query = ("SELECT results.run_id, runs.started_at, results.suite, results.average_score, results.score_ci_low, "
+                 "results.score_ci_high, results.average_inference_time FROM results JOIN runs ON runs.id = results.run_id "
+                 "WHERE results.model = ?")
+        parameters = [model]
+        if suite is not None:
+            query += " AND results.suite = ?"
+            parameters.append(suite)
+        with self.lock:
+            return self.connection.execute(query + " ORDER BY results.run_id, results.suite", parameters).fetchall()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+RESULTS_CSV_HEADER = ["Model", "Test", "Min", "Max", "Average", "Average Inference Time", "P50 Inference Time", "P90 Inference Time",
+                      "P99 Inference Time", "Max Inference Time", "Average TTFT", "Average Inter-Token Latency", "Average Tokens Per Second",
+                      "Average Prompt Tokens", "Average Cached Prompt Tokens", "Average Score CI Low", "Average Score CI High",
+                      "Average Output Tokens", "Total Prompt Tokens", "Total Output Tokens", "Output Tokens Per Second", "Total Cost",
+                      "Cost Per 1k Calls"]
+
+# the fields of a suite's result written to results.csv after the model and suite, with their decimals (None as stored)
+RESULTS_CSV_FIELDS = [("min", None), ("max", None), ("average", None), ("average_inference_time", 2), ("p50_inference_time", 2),
+                      ("p90_inference_time", 2), ("p99_inference_time", 2), ("max_inference_time", 2), ("average_ttft", 3),
+                      ("average_inter_token_latency", 4), ("average_tokens_per_second", 1), ("average_prompt_tokens", 0),
+                      ("average_cached_prompt_tokens", 0), ("average_score_ci_low", 3), ("average_score_ci_high", 3),
+                      ("average_output_tokens", 0), ("total_prompt_tokens", 0), ("total_output_tokens", 0),
+                      ("output_tokens_per_second", 1), ("total_cost", 4), ("cost_per_1k_calls", 4)]
+
+
+def _format_field(value: Any, decimals: Optional[int]) -> str:
+    if value is None:
+        return ""
+    return str(value) if decimals is None else f"{value:.{decimals}f}"
+
+
+def export_csv(store: ResultsStore, run_id: int, suites: Optional[List[str]] = None) -> str:
+    """The suite results of a run as CSV, in the layout of the results.csv a run writes."""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(RESULTS_CSV_HEADER)
+    for row in store.results(run_id, suites):
+        result = json.loads(row['result'])
+        writer.writerow([row['model'], row['suite']] + [_format_field(result.get(field), decimals) for field, decimals in RESULTS_CSV_FIELDS])
+    return output.getvalue()
+
+
+def export_failures(store: ResultsStore, run_id: int, below: float) -> str:
+    """The calls of a run scoring below a threshold, in the layout of the responses.txt a run writes."""
+    lines = []
+    for row in store.failures(run_id, below):
+        # only the test input - the setup prompts are the same for every test of the suite
+        lines += [f"Model: {row['model']}", f"Question: {row['input']}", f"Reference: {row['reference']}",
+                  f"Candidate: {row['response']}", f" = Score: {row['score']}", "--------------------------------"]
+    return "".join(line + "\n" for line in lines)
+
+
+def export_markdown(store: ResultsStore, run_id: int, suites: Optional[List[str]] = None, min_score: Optional[float] = None) -> str:
+    """The leaderboard of a run as a markdown table, in the layout of the README's leaderboard."""
+    lines = ["| Model | Average Score | Average Call Time (seconds) | Tokens/sec | Cost (per 1k calls) |",
+             "| ----- | ------------- | --------------------------- | ---------- | ------------------- |"]
+    for entry in store.leaderboard(run_id, suites, min_score):
+        tokens_per_second = "" if entry['output_tokens_per_second'] is None else f"{entry['output_tokens_per_second']:.1f}"
+        cost = "" if entry['cost_per_1k_calls'] is None else f"${entry['cost_per_1k_calls']:.2f}"
+        call_time = "" if entry['average_call_time'] is None else f"{entry['average_call_time']:.2f}"
+        lines.append(f"| {entry['model']} | {entry['average_score'] * 100:.0f}% | {call_time} | {tokens_per_second} | {cost} |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and export the benchmark results store",
+                                     epilog="Example: python results_store.py export --format markdown --min-score 0.75")
+    parser.add_argument("--db", default="results.db", help="Results database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("runs", help="List the runs in the store")
+
+    export_parser = commands.add_parser("export", help="Export the results of a run")
+    export_parser.add_argument("--format", choices=["csv", "markdown"], default="csv", help="csv for the suite results, markdown for the leaderboard")
+    export_parser.add_argument("--run", type=int, help="Run id (default the latest run with results)")
+    export_parser.add_argument("--suites", nargs="+", help="Only these test suites")
+    export_parser.add_argument("--min-score", type=float, help="Leave models averaging below this score out of the leaderboard")
+    export_parser.add_argument("--output", metavar="FILE", help="Write to a file instead of the console")
+
+    history_parser = commands.add_parser("history", help="Show the results of a model across runs")
+    history_parser.add_argument("model", help="Model name")
+    history_parser.add_argument("--suite", help="Only this test suite")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    try:
+        if args.command == "runs":
+            for run in store.runs():
+                print(f"{run['id']:>5}  {run['started_at']}  {run['finished_at'] or 'unfinished':<25}  {run['models']} models, "
+                      f"{run['suites']} suite results  {run['config_file']}")
+
+        elif args.command == "export":
+            run_id = args.run if args.run is not None else store.latest_run_id()
+            if run_id is None:
+                print(f"Error: no results in {args.db}")
+                sys.exit(1)
+            if args.format == "csv":
+                exported = export_csv(store, run_id, args.suites)
+            else:
+                exported = export_markdown(store, run_id, args.suites, args.min_score)
+            if args.output:
+                with open(args.output, "w", newline='', encoding='utf-8') as f:
+                    f.write(exported)
+            else:
+                print(exported, end="")
+
+        elif args.command == "history":
+            for row in store.history(args.model, args.suite):
+                print(f"run {row['run_id']:>5}  {row['started_at']}  {row['suite']:<40}  score {row['average_score']:.3f} "
+                      f"(95% CI {row['score_ci_low']:.3f}-{row['score_ci_high']:.3f})  call time {'-' if row['average_inference_time'] is None else format(row['average_inference_time'], '.2f')}s")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
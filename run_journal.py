@@ -0,0 +1,125 @@
+import json
+import os
+import sys
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+
+class RunJournal:
+    """
+    Append-only JSONL journal of a benchmark run, used to resume a run that died part way through.
+
+    Every completed inference, score and suite result is appended as one JSON line as soon as it is
+    available. Lines are flushed immediately and fsynced in batches, so a crash of the benchmark
+    loses nothing and a crash of the machine loses at most the last batch.
+
+    Only the file offsets of the inferences are kept in memory, their responses are read back from the
+    journal when a resumed run asks for them.
+    """
+
+    def __init__(self, path: str, resume: bool = False, fsync_every: int = 20):
+        """
+        Initialize the journal.
+
+        Args:
+            path: Path of the journal file
+            resume: Append to an existing journal instead of starting a new one
+            fsync_every: Number of records written between fsyncs
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self.lock = threading.Lock()
+        self.unsynced = 0
+
+        # cells that are already finished, loaded from the journal when resuming
+        self.inferences: Dict[Tuple[str, str, int, int], int] = {}
+        self.scores: Dict[Tuple[str, str, int, int], float] = {}
+        self.results: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+        if resume:
+            for offset, record in self.load(path):
+                self._index(record, offset)
+            print(f"Resuming from {path}: {len(self.inferences)} inferences, {len(self.scores)} scores, {len(self.results)} suite results")
+
+        self.file = open(path, "ab" if resume else "wb")
+        self.offset = self.file.tell()
+        # opened on the first lookup of an inference
+        self.reader = None
+
+        # terminate a line truncated by a crash, so that the first new record starts on its own line
+        if resume and self.offset > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write(b"\n")
+                    self.offset += 1
+
+    @staticmethod
+    def load(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Read the records of a journal with their file offsets, ignoring a truncated final line left behind by a crash."""
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    yield offset, json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    print(f"Ignoring truncated journal line: {line[:80].decode('utf-8', errors='replace')}")
+                offset += len(line)
+
+    def _index(self, record: Dict[str, Any], offset: int) -> None:
+        # the same few model and suite names are in every key
+        key = (sys.intern(record['model']), sys.intern(record['suite']))
+        if record['type'] == 'inference':
+            self.inferences[key + (record['iteration'], record['test'])] = offset
+        elif record['type'] == 'score':
+            self.scores[key + (record['iteration'], record['test'])] = record['score']
+        elif record['type'] == 'result':
+            self.results[key] = record
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self._index(record, self.offset)
+            self.offset += len(line)
+
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+    def record_inference(self, model: str, suite: str, iteration: int, test: int, response: str, latency: float,
+                         metrics: Optional[Dict[str, Any]] = None) -> None:
+        self._write({"type": "inference", "model": model, "suite": suite, "iteration": iteration, "test": test,
+                     "response": response, "latency": latency, **(metrics or {})})
+
+    def record_score(self, model: str, suite: str, iteration: int, test: int, score: float) -> None:
+        self._write({"type": "score", "model": model, "suite": suite, "iteration": iteration, "test": test, "score": score})
+
+    def record_result(self, model: str, suite: str, result: Dict[str, Any]) -> None:
+        self._write({"type": "result", "model": model, "suite": suite, **result})
+
+    def get_inference(self, model: str, suite: str, iteration: int, test: int) -> Optional[Dict[str, Any]]:
+        offset = self.inferences.get((model, suite, iteration, test))
+        if offset is None:
+            return None
+        with self.lock:
+            if self.reader is None:
+                self.reader = open(self.path, "rb")
+            self.reader.seek(offset)
+            return json.loads(self.reader.readline())
+
+    def get_score(self, model: str, suite: str, iteration: int, test: int) -> Optional[float]:
+        return self.scores.get((model, suite, iteration, test))
+
+    def get_result(self, model: str, suite: str) -> Optional[Dict[str, Any]]:
+        return self.results.get((model, suite))
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            if self.reader is not None:
+                self.reader.close()
@@ -0,0 +1,142 @@
+import math
+import sys
+import tempfile
+import threading
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+from base_llm_model import ModelResponse
+
+# the metrics of every call, stored as float arrays with NaN where a metric is not available
+METRIC_FIELDS = ["ttft", "inter_token_latency", "tokens_per_second", "output_tokens", "prompt_tokens", "cached_prompt_tokens", "cost"]
+
+
+class SpillableTexts:
+    """
+    Append-only list of strings that moves to a temporary file once it holds more than max_memory_bytes.
+
+    Keeps the responses of a long run from growing memory without bound - once spilled, only the offset
+    and length of each string stay in memory and strings are read back from the file on access.
+    """
+
+    def __init__(self, max_memory_bytes: int):
+        self.max_memory_bytes = max_memory_bytes
+        self.lock = threading.Lock()
+        self.texts: Optional[List[str]] = []
+        self.memory_bytes = 0
+        self.file = None
+        self.offsets = array('q')
+        self.lengths = array('q')
+
+    def __len__(self) -> int:
+        return len(self.texts) if self.file is None else len(self.offsets)
+
+    def _write(self, text: str) -> None:
+        encoded = text.encode('utf-8')
+        self.file.seek(0, 2)
+        self.offsets.append(self.file.tell())
+        self.lengths.append(len(encoded))
+        self.file.write(encoded)
+
+    def append(self, text: str) -> None:
+        with self.lock:
+            if self.file is not None:
+                self._write(text)
+                return
+
+            self.texts.append(text)
+            self.memory_bytes += len(text.encode('utf-8'))
+            if self.memory_bytes > self.max_memory_bytes:
+                self.file = tempfile.TemporaryFile()
+                for spilled in self.texts:
+                    self._write(spilled)
+                self.texts = None
+
+    def __getitem__(self, index: int) -> str:
+        with self.lock:
+            if self.file is None:
+                return self.texts[index]
+            self.file.seek(self.offsets[index])
+            return self.file.read(self.lengths[index]).decode('utf-8')
+
+    @property
+    def spilled(self) -> bool:
+        return self.file is not None
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+
+
+class CallRecords:
+    """
+    Compact record of the calls of one (model, test suite).
+
+    Calls refer to their test by index - the prompt messages and expected response live once in the
+    compiled suite, however many iterations there are. Cells, latencies, scores and metrics are kept in
+    typed arrays, and the candidate responses in SpillableTexts.
+    """
+
+    def __init__(self, spill_threshold_bytes: int = 16 * 1024 ** 2):
+        self.iterations = array('i')
+        self.test_indices = array('i')
+        self.latencies = array('d')
+        self.scores = array('d')
+        self.metrics = {field: array('d') for field in METRIC_FIELDS}
+        # 1 if the model was actually called, 0 for a replicated or cached response - only sent calls count
+        # towards the metric averages and totals, repeats of a response would inflate them
+        self.sent = array('b')
+        # interned, there are only a handful of distinct finish reasons
+        self.finish_reasons: List[Optional[str]] = []
+        self.candidates = SpillableTexts(spill_threshold_bytes)
+
+    def __len__(self) -> int:
+        return len(self.iterations)
+
+    def append(self, iteration: int, test_index: int, candidate: str, latency: float, response: ModelResponse, sent: bool = True) -> None:
+        self.iterations.append(iteration)
+        self.test_indices.append(test_index)
+        self.latencies.append(latency)
+        # not scored yet
+        self.scores.append(math.nan)
+        for field, values in self.metrics.items():
+            value = getattr(response, field)
+            values.append(math.nan if value is None else value)
+        self.finish_reasons.append(None if response.finish_reason is None else sys.intern(response.finish_reason))
+        self.sent.append(1 if sent else 0)
+        self.candidates.append(candidate)
+
+    def cell(self, index: int) -> Tuple[int, int]:
+        return self.iterations[index], self.test_indices[index]
+
+    def cells(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.iterations, self.test_indices)
+
+    def sent_latencies(self) -> List[float]:
+        """The call latencies, NaN for replicated or cached responses - their latency is not that of a model call."""
+        return [latency if sent else math.nan for latency, sent in zip(self.latencies, self.sent)]
+
+    def is_scored(self, index: int) -> bool:
+        return not math.isnan(self.scores[index])
+
+    def metric(self, field: str, index: int) -> Optional[float]:
+        value = self.metrics[field][index]
+        return None if math.isnan(value) else value
+
+    def average(self, field: str) -> Optional[float]:
+        """Average of a metric over the sent calls it is available for, None if it is not available for any."""
+        values = [value for value, sent in zip(self.metrics[field], self.sent) if sent and not math.isnan(value)]
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    def total(self, field: str) -> Optional[float]:
+        """Sum of a metric over the sent calls it is available for, None if it is not available for any."""
+        values = [value for value, sent in zip(self.metrics[field], self.sent) if sent and not math.isnan(value)]
+        if not values:
+            return None
+        return sum(values)
+
+    def close(self) -> None:
+        self.candidates.close()
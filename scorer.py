@@ -1,8 +1,16 @@
+import json
+import math
+import re
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
 class Scorer(ABC):
     """Abstract base class for model response scorers."""
+
+    # scorers that can score candidates one at a time, as soon as each one is produced
+    supports_pipelining = False
+    # number of candidates a pipelined scorer may score concurrently
+    pipeline_workers = 1
     
     @abstractmethod
     def __init__(self):
@@ -12,7 +20,105 @@ class Scorer(ABC):
     def score(self, system_prompt: str, model_name: str, test_name: str, questions: List[List[Dict[str, Any]]], references: List[str], candidates: List[str]) -> List[float]:
         pass
     
+    def score_one(self, model_name: str, test_name: str, question: List[Dict[str, Any]], reference: str, candidate: str) -> float:
+        """Score a single candidate. Used when scoring is pipelined with inference."""
+        return self.score(model_name=model_name, test_name=test_name, questions=[question], references=[reference], candidates=[candidate])[0]
+
     @abstractmethod
     def shutdown(self):
         pass
 
+
+
+class JudgeItem:
+    """A unique (judge model, question, setup prompts, candidate) tuple to be scored by an LLM judge."""
+
+    def __init__(self, judge_model: str, question: List[Dict[str, Any]], candidate: str):
+        self.question_text = question[len(question) - 1]['content']
+        self.initial_prompts = json.dumps(question[:-1])
+        self.candidate = candidate
+        self.key_fields = {
+            "judge": judge_model,
+            "question": self.question_text,
+            "setup_prompts": self.initial_prompts,
+            "candidate": candidate
+        }
+
+    def scoring_message(self) -> str:
+        return f"For the question, \"{self.question_text}\", and the initial prompts: \"{self.initial_prompts}\", rate the following response on a scale of 0-10, replying with just your numerical score in brackets like [8], and then including your reasoning: \"{self.candidate}\""
+
+
+def group_judge_items(judge_model: str, questions: List[List[Dict[str, Any]]], candidates: List[str]) -> Tuple[List[JudgeItem], List[int]]:
+    """
+    Deduplicate the items to be judged.
+
+    Returns:
+        The unique judge items, and for every candidate the index of its unique item
+    """
+    unique_items: List[JudgeItem] = []
+    item_indices: List[int] = []
+    seen: Dict[Tuple[str, str, str], int] = {}
+
+    for question, candidate in zip(questions, candidates):
+        item = JudgeItem(judge_model, question, candidate)
+        key = (item.question_text, item.initial_prompts, candidate)
+        if key not in seen:
+            seen[key] = len(unique_items)
+            unique_items.append(item)
+        item_indices.append(seen[key])
+
+    return unique_items, item_indices
+
+
+def batch_judge_items(unique_items: List[JudgeItem], indices: List[int], batch_size: int) -> List[List[int]]:
+    """
+    Split the items to be judged into batches of up to batch_size items that share a question and setup prompts.
+
+    Returns:
+        The batches, as lists of indices into unique_items
+    """
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for u in indices:
+        groups.setdefault((unique_items[u].question_text, unique_items[u].initial_prompts), []).append(u)
+
+    batches = []
+    for group in groups.values():
+        for start in range(0, len(group), batch_size):
+            batches.append(group[start:start + batch_size])
+    return batches
+
+
+def batch_scoring_message(items: List[JudgeItem]) -> str:
+    """Judge prompt scoring several responses to the same question at once, stating the question and setup prompts only once."""
+    responses = "\n".join(f"Response {n + 1}: \"{item.candidate}\"" for n, item in enumerate(items))
+    return f"For the question, \"{items[0].question_text}\", and the initial prompts: \"{items[0].initial_prompts}\", rate each of the following {len(items)} responses on a scale of 0-10, replying with just a list of your {len(items)} numerical scores in the order of the responses in brackets like [8, 5, 7], and then including your reasoning:\n{responses}"
+
+
+def parse_judge_score(response_text: str) -> float:
+    """Extract the 0-10 score from a judge response and scale it to 0-1. Raises ValueError if there is none."""
+    # Extract first number between square brackets using regex
+    match = re.search(r'\[(.*?)\]', response_text)
+    if match:
+        score = float(match.group(1))/10.0
+    else:
+        # Fallback to old behavior if no brackets found
+        response_text_cleaned = re.sub(r'[^0-9]', '', response_text)
+        score = float(response_text_cleaned)/10.0
+    # e.g. a judge replying [nan] - not a score
+    if not math.isfinite(score):
+        raise ValueError(f"Judge score {match.group(1) if match else response_text} is not a number")
+    return score
+
+
+def parse_batch_judge_scores(response_text: str, count: int) -> Optional[List[float]]:
+    """Extract the list of 0-10 scores from a batched judge response and scale them to 0-1, or None if it can't be parsed."""
+    match = re.search(r'\[([^\[\]]*)\]', response_text)
+    if not match:
+        return None
+    try:
+        scores = [float(score) for score in match.group(1).split(',')]
+    except ValueError:
+        return None
+    if len(scores) != count or any(not 0 <= score <= 10 for score in scores):
+        return None
+    return [score / 10.0 for score in scores]
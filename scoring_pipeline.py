@@ -0,0 +1,56 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from scorer import Scorer
+
+
+class ScoringPipeline:
+    """
+    Scores candidates in the background as soon as they are produced.
+
+    Used instead of scoring the whole (model, suite) batch after inference, so that scoring overlaps
+    with the remaining inference, and with the load and inference of the next model.
+    Candidates are identified by their (iteration, test index) cell.
+    """
+
+    def __init__(self, scorer: Scorer, model_name: str, test_name: str,
+                 on_score: Optional[Callable[[Tuple[int, int], float], None]] = None):
+        """
+        Initialize the pipeline.
+
+        Args:
+            scorer: A scorer that supports pipelining
+            model_name: Name of the model being scored
+            test_name: Name of the test suite being scored
+            on_score: Optional callback invoked (on a worker thread) with the cell and score of every scored candidate
+        """
+        if not scorer.supports_pipelining:
+            raise Exception(f"Scorer {type(scorer).__name__} does not support pipelined scoring")
+
+        self.scorer = scorer
+        self.model_name = model_name
+        self.test_name = test_name
+        self.on_score = on_score
+        self.executor = ThreadPoolExecutor(max_workers=scorer.pipeline_workers)
+        self.futures: Dict[Tuple[int, int], Future] = {}
+
+    def _score(self, cell: Tuple[int, int], question: List[Dict[str, Any]], reference: str, candidate: str) -> float:
+        score = self.scorer.score_one(self.model_name, self.test_name, question, reference, candidate)
+        if self.on_score is not None:
+            self.on_score(cell, score)
+        return score
+
+    def submit(self, cell: Tuple[int, int], question: List[Dict[str, Any]], reference: str, candidate: str) -> None:
+        """Queue a candidate for scoring."""
+        self.futures[cell] = self.executor.submit(self._score, cell, question, reference, candidate)
+
+    def done(self) -> bool:
+        """True once every submitted candidate has been scored."""
+        return all(future.done() for future in self.futures.values())
+
+    def results(self) -> Dict[Tuple[int, int], float]:
+        """Wait for every submitted candidate to be scored and return the scores by cell."""
+        try:
+            return {cell: future.result() for cell, future in self.futures.items()}
+        finally:
+            self.executor.shutdown(wait=True)
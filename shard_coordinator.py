@@ -0,0 +1,174 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+
+class WorkUnit:
+    """One (model, test suite) of a run, the unit of work handed out to the endpoints."""
+
+    def __init__(self, index: int, model_name: str, test_suite: Any):
+        self.index = index
+        self.model_name = model_name
+        self.test_suite = test_suite
+        # endpoints the unit failed on, it is not handed to them again
+        self.failed_endpoints: Set[str] = set()
+
+
+class EndpointHealth:
+    """Success and failure counts of an endpoint. An endpoint failing max_failures units in a row is taken out of the run."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.completed = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.busy_seconds = 0.0
+        self.healthy = True
+        self.last_error: Optional[str] = None
+
+    def summary(self) -> str:
+        status = "healthy" if self.healthy else f"unhealthy ({self.last_error})"
+        return f"{self.endpoint}: {self.completed} completed, {self.failures} failed, busy {self.busy_seconds:.0f} seconds, {status}"
+
+
+class EndpointFailure(Exception):
+    """Raised by a worker when a unit failed because of its endpoint (e.g. a model that could not be loaded or called)."""
+
+
+class ShardCoordinator:
+    """
+    Distributes the (model, test suite) units of a run across several model endpoints.
+
+    Every endpoint gets its own worker thread, which takes the next unit as soon as it is free. A worker
+    prefers the remaining suites of the model it already has loaded, so that models are not loaded on every
+    endpoint. A unit that fails because of its endpoint is put back for another endpoint, and an endpoint
+    failing max_failures units in a row is considered down and gets no more work.
+    """
+
+    def __init__(self, endpoints: List[str], units: List[WorkUnit], max_failures: int = 3):
+        """
+        Initialize the coordinator.
+
+        Args:
+            endpoints: The model endpoints to distribute the units across
+            units: The units of the run, in run order
+            max_failures: Number of consecutive failed units after which an endpoint gets no more work
+        """
+        self.endpoints = endpoints
+        self.max_failures = max_failures
+        self.health: Dict[str, EndpointHealth] = {endpoint: EndpointHealth(endpoint) for endpoint in endpoints}
+        self.queue: List[WorkUnit] = list(units)
+        self.in_progress = 0
+        self.condition = threading.Condition()
+
+    def _eligible(self, unit: WorkUnit) -> bool:
+        """True if a healthy endpoint the unit has not failed on yet is left to run it."""
+        return any(health.healthy and endpoint not in unit.failed_endpoints for endpoint, health in self.health.items())
+
+    def next_unit(self, endpoint: str, current_model: Optional[str]) -> Optional[WorkUnit]:
+        """
+        Take the next unit for an endpoint, waiting while units could still be put back by other endpoints.
+
+        Returns:
+            The unit, or None once there is no more work for the endpoint
+        """
+        with self.condition:
+            while True:
+                if not self.health[endpoint].healthy:
+                    return None
+
+                candidates = [unit for unit in self.queue if endpoint not in unit.failed_endpoints]
+                if candidates:
+                    unit = next((unit for unit in candidates if unit.model_name == current_model), candidates[0])
+                    self.queue.remove(unit)
+                    self.in_progress += 1
+                    return unit
+
+                if self.in_progress == 0:
+                    return None
+                self.condition.wait()
+
+    def _finish(self, unit: WorkUnit, endpoint: str, started: float, error: Optional[Exception], retry: bool = True) -> List[WorkUnit]:
+        """
+        Record the outcome of a unit, putting it back for another endpoint if it failed and retry is set.
+
+        Returns:
+            The units given up on, because no endpoint is left to run them
+        """
+        with self.condition:
+            health = self.health[endpoint]
+            health.busy_seconds += time.monotonic() - started
+            self.in_progress -= 1
+
+            if error is None:
+                health.completed += 1
+                health.consecutive_failures = 0
+            else:
+                print(f"Model {unit.model_name}, test suite {unit.test_suite.name} failed on {endpoint}: {error}")
+                health.failures += 1
+                health.consecutive_failures += 1
+                health.last_error = str(error)
+                unit.failed_endpoints.add(endpoint)
+                if health.consecutive_failures >= self.max_failures:
+                    print(f"Endpoint {endpoint} failed {health.consecutive_failures} times in a row, not sending it any more work")
+                    health.healthy = False
+                if retry:
+                    self.queue.append(unit)
+
+            abandoned = [queued for queued in self.queue if not self._eligible(queued)]
+            for queued in abandoned:
+                self.queue.remove(queued)
+
+            self.condition.notify_all()
+            return abandoned
+
+    def run(self,
+            worker: Callable[[str, WorkUnit], None],
+            on_abandoned: Callable[[WorkUnit], None],
+            on_endpoint_done: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Run every unit on one of the endpoints and wait until all are done.
+
+        Args:
+            worker: Runs a unit on an endpoint, raising EndpointFailure if the endpoint is to blame for a failure
+            on_abandoned: Called for a unit that failed on every endpoint
+            on_endpoint_done: Called by each endpoint's thread once it has no more work, e.g. to unload its model
+        """
+        def work(endpoint: str) -> None:
+            current_model = None
+            while True:
+                unit = self.next_unit(endpoint, current_model)
+                if unit is None:
+                    break
+
+                started = time.monotonic()
+                error = None
+                retry = True
+                try:
+                    worker(endpoint, unit)
+                    current_model = unit.model_name
+                except EndpointFailure as e:
+                    error = e
+                except Exception as e:
+                    # not the endpoint's fault, another endpoint would fail the same way - still a failure of the unit
+                    print(f"Error running model {unit.model_name}, test suite {unit.test_suite.name} on {endpoint}: {e}")
+                    error = e
+                    retry = False
+                    on_abandoned(unit)
+
+                for abandoned in self._finish(unit, endpoint, started, error, retry):
+                    print(f"Giving up on model {abandoned.model_name}, test suite {abandoned.test_suite.name}: failed on every endpoint")
+                    on_abandoned(abandoned)
+
+            if on_endpoint_done is not None:
+                on_endpoint_done(endpoint)
+
+        threads = [threading.Thread(target=work, args=(endpoint,), name=f"endpoint-{endpoint}", daemon=True) for endpoint in self.endpoints]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        print("Endpoints:")
+        for health in self.health.values():
+            print(f"  {health.summary()}")
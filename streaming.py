@@ -0,0 +1,111 @@
+import json
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+from base_llm_model import ModelResponse
+
+
+def prompt_token_usage(body: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Return the number of prompt tokens of a chat completion, and how many of them came from the prompt cache.
+
+    Understands the OpenAI usage block (usage.prompt_tokens_details.cached_tokens) and the llama.cpp
+    timings block (timings.prompt_n evaluated + timings.cache_n reused) returned by llama.cpp based servers.
+    """
+    usage = body.get('usage') or {}
+    prompt_tokens = usage.get('prompt_tokens')
+    cached_prompt_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+
+    timings = body.get('timings') or {}
+    if timings.get('cache_n') is not None:
+        cached_prompt_tokens = timings['cache_n']
+        if prompt_tokens is None and timings.get('prompt_n') is not None:
+            prompt_tokens = timings['prompt_n'] + timings['cache_n']
+
+    return prompt_tokens, cached_prompt_tokens
+
+
+def completion_usage(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return the usage of a chat completion (or of the final chunk of a stream) as ModelResponse arguments.
+
+    Besides the prompt tokens this picks up the completion tokens and provider cost of the usage block, and
+    the generation speed of the llama.cpp timings block. Missing values are None.
+    """
+    usage = body.get('usage') or {}
+    timings = body.get('timings') or {}
+    prompt_tokens, cached_prompt_tokens = prompt_token_usage(body)
+    output_tokens = usage.get('completion_tokens')
+    if output_tokens is None:
+        output_tokens = timings.get('predicted_n')
+    return {"prompt_tokens": prompt_tokens, "cached_prompt_tokens": cached_prompt_tokens, "output_tokens": output_tokens,
+            "tokens_per_second": timings.get('predicted_per_second'), "cost": usage.get('cost')}
+
+
+def response_from_completion(body: Dict[str, Any]) -> ModelResponse:
+    """Build the response of a (non-streamed) chat completion, with its finish reason and usage."""
+    choice = body['choices'][0]
+    return ModelResponse(choice['message']['content'], finish_reason=choice.get('finish_reason'), **completion_usage(body))
+
+
+def read_sse_stream(response: requests.Response, start_time: float) -> ModelResponse:
+    """
+    Read a streamed (server-sent events) chat completion, measuring the latency of each chunk.
+
+    Args:
+        response: A response opened with stream=True for a request with "stream": true
+        start_time: time.perf_counter() taken when the request was sent
+
+    Returns:
+        The complete response with time to first token, inter-token latency and tokens/sec
+    """
+    content_parts = []
+    chunk_times = []
+    usage = completion_usage({})
+    finish_reason = None
+
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+
+        chunk = json.loads(data)
+        if chunk.get('usage') or chunk.get('timings'):
+            usage = completion_usage(chunk)
+
+        choices = chunk.get('choices')
+        if not choices:
+            continue
+
+        if choices[0].get('finish_reason'):
+            finish_reason = choices[0]['finish_reason']
+
+        delta_content = choices[0].get('delta', {}).get('content')
+        if delta_content:
+            chunk_times.append(time.perf_counter())
+            content_parts.append(delta_content)
+
+    end_time = time.perf_counter()
+
+    if not chunk_times:
+        return ModelResponse("", output_tokens=0, prompt_tokens=usage['prompt_tokens'], cached_prompt_tokens=usage['cached_prompt_tokens'],
+                             finish_reason=finish_reason, cost=usage['cost'])
+
+    # servers that report usage give the exact token count, otherwise each chunk is (typically) one token
+    output_tokens = usage['output_tokens'] or len(chunk_times)
+
+    ttft = chunk_times[0] - start_time
+    inter_token_latency = None
+    tokens_per_second = None
+    if len(chunk_times) > 1:
+        inter_token_latency = (chunk_times[-1] - chunk_times[0]) / (len(chunk_times) - 1)
+    if output_tokens > 1 and end_time > chunk_times[0]:
+        tokens_per_second = (output_tokens - 1) / (end_time - chunk_times[0])
+
+    return ModelResponse("".join(content_parts), ttft, inter_token_latency, tokens_per_second, output_tokens,
+                         usage['prompt_tokens'], usage['cached_prompt_tokens'], finish_reason, usage['cost'])
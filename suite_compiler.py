@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from base_llm_model import SAMPLING_PARAMETERS
+
+# bump whenever the layout of the compiled file changes, so stale compiled files are recompiled
+COMPILED_FORMAT_VERSION = 3
+
+MESSAGE_ROLES = ["system", "user", "assistant"]
+
+
+class CompiledMessages(tuple):
+    """
+    Immutable conversation of a test, shared by every iteration of the test.
+
+    The setup prompts (the first setup_count messages) and their JSON serialization are shared by every
+    test of the suite, so the json of a conversation is built by splicing in only the test's own turns -
+    building a request body never serializes the (large) setup prompts again, and they are held in memory once.
+    """
+
+    def __new__(cls, messages, setup_json: Optional[str] = None, setup_count: int = 0):
+        compiled = super().__new__(cls, messages)
+        compiled.setup_json = setup_json
+        compiled.setup_count = setup_count if setup_json is not None else 0
+        return compiled
+
+    @property
+    def json(self) -> str:
+        turns = json.dumps(list(self[self.setup_count:]), ensure_ascii=False)
+        if not self.setup_count:
+            return turns
+        # same separators as json.dumps of the whole conversation
+        return f"{self.setup_json[:-1]}, {turns[1:]}" if len(turns) > 2 else self.setup_json
+
+
+class CompiledTest:
+    """A validated test of a suite, with its prompt messages built once."""
+
+    __slots__ = ["input", "expected_response", "messages"]
+
+    def __init__(self, input: str, expected_response: str, messages: CompiledMessages):
+        self.input = input
+        self.expected_response = expected_response
+        self.messages = messages
+
+
+class CompiledSuite:
+    """A validated test suite."""
+
+    def __init__(self, name: str, scorer: Dict[str, Any], tests: List[CompiledTest], sampling: Dict[str, Any]):
+        self.name = name
+        self.scorer = scorer
+        self.tests = tests
+        self.sampling = sampling
+
+
+def encode_chat_request(payload: Dict[str, Any], messages) -> bytes:
+    """Serialize a chat completion request body, reusing the pre-serialized messages of compiled suites."""
+    serialized = getattr(messages, 'json', None)
+    if serialized is None:
+        return json.dumps({**payload, "messages": messages}, ensure_ascii=False).encode('utf-8')
+    body = json.dumps(payload, ensure_ascii=False)
+    return f"{body[:-1]}, \"messages\": {serialized}}}".encode('utf-8')
+
+
+def validate_sampling(sampling: Optional[Dict[str, Any]], owner: str) -> Dict[str, Any]:
+    """Check the sampling parameters of a `sampling:` section, returning them (empty for server defaults)."""
+    if not sampling:
+        return {}
+    if not isinstance(sampling, dict):
+        raise Exception(f"Invalid sampling parameters for {owner}, expected a mapping of {SAMPLING_PARAMETERS}")
+    unknown = [key for key in sampling if key not in SAMPLING_PARAMETERS]
+    if unknown:
+        raise Exception(f"Unknown sampling parameters {unknown} for {owner}, expected any of {SAMPLING_PARAMETERS}")
+    return dict(sampling)
+
+
+def _compile_suite(test_suite: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate a test suite from the YAML and return its compiled form as plain (JSON serializable) data."""
+    if not isinstance(test_suite, dict) or len(test_suite) != 1:
+        raise Exception(f"Invalid test suite {str(test_suite)[:80]}, expected a single suite name")
+    name = list(test_suite.keys())[0]
+    suite = test_suite[name] or {}
+
+    scorer = suite.get('scorer')
+    if not scorer or 'type' not in scorer:
+        raise Exception(f"Scorer not configured for test suite {name}")
+
+    sampling = validate_sampling(suite.get('sampling'), f"test suite {name}")
+
+    setup_messages = []
+    for prompt in suite.get('setup_prompts') or []:
+        if not isinstance(prompt, dict) or len(prompt) != 1:
+            raise Exception(f"Invalid setup prompt in test suite {name}, expected a single role: content entry")
+        role = list(prompt.keys())[0]
+        if role not in MESSAGE_ROLES:
+            raise Exception(f"Invalid setup prompt role {role} in test suite {name}, expected one of {MESSAGE_ROLES}")
+        setup_messages.append({"role": role, "content": str(prompt[role])})
+
+    tests = []
+    for test_index, test in enumerate(suite.get('tests') or []):
+        if not isinstance(test, dict) or 'input' not in test or 'expected_response' not in test:
+            raise Exception(f"Test {test_index} of test suite {name} needs an input and an expected_response")
+        tests.append({"input": test['input'], "expected_response": test['expected_response']})
+
+    if not tests:
+        raise Exception(f"Test suite {name} has no tests")
+
+    # the setup prompts are stored once per suite, each test only adds its user turn
+    return {"name": name, "scorer": scorer, "setup_messages": setup_messages,
+            "setup_json": json.dumps(setup_messages, ensure_ascii=False), "tests": tests, "sampling": sampling}
+
+
+def _load_suite(suite: Dict[str, Any]) -> CompiledSuite:
+    setup_messages = suite['setup_messages']
+    tests = [CompiledTest(test['input'], test['expected_response'],
+                          CompiledMessages(setup_messages + [{"role": "user", "content": test['input']}], suite['setup_json'], len(setup_messages)))
+             for test in suite['tests']]
+    return CompiledSuite(suite['name'], suite['scorer'], tests, suite['sampling'])
+
+
+def _load_suites(compiled_suites: List[Dict[str, Any]]) -> List[CompiledSuite]:
+    return [_load_suite(suite) for suite in compiled_suites]
+
+
+def compiled_path(yaml_file_path: str) -> str:
+    directory, file_name = os.path.split(yaml_file_path)
+    return os.path.join(directory, f".{file_name}.compiled.json")
+
+
+def load_compiled_config(yaml_file_path: str) -> Tuple[Dict[str, Any], List[CompiledSuite]]:
+    """
+    Load the config and compiled test suites of a test YAML file.
+
+    The YAML is only parsed and validated when it has changed - the compiled form is cached in a file next to
+    the YAML, keyed by the SHA-256 hash of its content.
+
+    Returns:
+        The `config` section, and its test suites compiled
+    """
+    with open(yaml_file_path, 'rb') as f:
+        source = f.read()
+    source_hash = hashlib.sha256(source).hexdigest()
+    cache_path = compiled_path(yaml_file_path)
+
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            compiled = json.load(f)
+        if compiled.get('version') == COMPILED_FORMAT_VERSION and compiled.get('source_hash') == source_hash:
+            return compiled['config'], _load_suites(compiled['test_suites'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    data = yaml.load(source, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)) or {}
+    config = data.get('config', {})
+    compiled_suites = [_compile_suite(test_suite) for test_suite in config.get('test_suites', [])]
+    # the suites are only kept in compiled form
+    config = {key: value for key, value in config.items() if key != 'test_suites'}
+    config['sampling'] = validate_sampling(config.get('sampling'), "config")
+
+    try:
+        compiled_json = json.dumps({"version": COMPILED_FORMAT_VERSION, "source_hash": source_hash,
+                                    "config": config, "test_suites": compiled_suites}, ensure_ascii=False)
+        # write to a temporary file first so a crash never leaves a truncated compiled file behind
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or '.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(compiled_json)
+        os.replace(temp_path, cache_path)
+    except (OSError, TypeError, ValueError) as e:
+        # e.g. a read only directory, or config values JSON can't represent - just compile again next time
+        print(f"Could not cache compiled test suites in {cache_path}: {e}")
+
+    return config, _load_suites(compiled_suites)
@@ -0,0 +1,29 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_server import MockServer
+from remote_llm_model import RemoteLLMModel
+
+
+def test_concurrent_acall_with_messages():
+    # 16 calls through a 4 thread executor - concurrent, but never more than 4 requests in flight
+    messages = [[{"role": "user", "content": f"question {n}"}] for n in range(16)]
+
+    async def call_all(model):
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=4))
+        return await asyncio.gather(*[model.acall_with_messages(message, iteration=n) for n, message in enumerate(messages)])
+
+    with MockServer(latency="constant:0.05", response="answer") as server:
+        model = RemoteLLMModel(server.url, model_name="mock-model")
+        responses = asyncio.run(call_all(model))
+        stats = server.stats()
+
+    assert responses == ["answer"] * len(messages)
+    assert stats['completions'] == len(messages)
+    assert 1 < stats['max_in_flight'] <= 4
+
+
+def test_acall():
+    with MockServer(response="hello") as server:
+        model = RemoteLLMModel(server.url, model_name="mock-model")
+        assert asyncio.run(model.acall("hi")) == "hello"
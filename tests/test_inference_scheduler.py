@@ -0,0 +1,23 @@
+import threading
+
+from inference_scheduler import InferenceRequest, InferenceScheduler
+from mock_server import MockServer
+from remote_llm_model import RemoteLLMModel
+
+
+def test_schedulers_on_one_endpoint_share_the_smallest_limit():
+    # e.g. the model under test and an LM Studio judge on the same server, asking for different limits
+    with MockServer(latency="constant:0.05") as server:
+        schedulers = [InferenceScheduler(RemoteLLMModel(server.url, model_name="mock-model"), server.url, concurrency)
+                      for concurrency in (4, 2)]
+        threads = [threading.Thread(target=scheduler.run, args=([InferenceRequest(n, 0, [{"role": "user", "content": f"question {n}"}])
+                                                                  for n in range(8)],))
+                   for scheduler in schedulers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = server.stats()
+
+    assert stats['completions'] == 16
+    assert stats['max_in_flight'] == 2
@@ -0,0 +1,73 @@
+import json
+import stat
+import sys
+
+import pytest
+
+from lmstudio_model import LmStudioModel
+from lmstudio_registry import LmStudioRegistry
+from mock_server import MockServer
+
+LOADED = [{"identifier": "qwen3-4b-instruct-2507", "modelKey": "qwen3-4b-instruct-2507",
+           "path": "C:\\Users\\player\\.lmstudio\\models\\lmstudio-community\\Qwen3-4B-Instruct-2507-GGUF\\Qwen3-4B-Instruct-2507-Q4_K_M.gguf"}]
+AVAILABLE = [{"type": "llm", "modelKey": "qwen3-4b-instruct-2507", "sizeBytes": 2497280000,
+              "path": "lmstudio-community/Qwen3-4B-Instruct-2507-GGUF/Qwen3-4B-Instruct-2507-Q4_K_M.gguf"},
+             {"type": "llm", "modelKey": "qwen3-4b", "sizeBytes": 2497280256,
+              "path": "lmstudio-community/Qwen3-4B-GGUF/Qwen3-4B-Q4_K_M.gguf"}]
+
+
+@pytest.fixture
+def lms_stub(tmp_path, monkeypatch):
+    """A stub `lms` printing fixed `ps --json` / `ls --json` output and logging its invocations."""
+    log = tmp_path / "lms.log"
+    script = tmp_path / "lms"
+    script.write_text(f"""#!{sys.executable}
+import sys
+with open({str(log)!r}, "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\\n")
+if sys.argv[1] == "ps":
+    print({json.dumps(json.dumps(LOADED))})
+elif sys.argv[1] == "ls":
+    print({json.dumps(json.dumps(AVAILABLE))})
+""")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("LMS_PATH", str(script))
+    return log
+
+
+def test_matches_whole_names_only(lms_stub):
+    registry = LmStudioRegistry("http://127.0.0.1:1234")
+    assert registry.find_loaded("qwen3-4b") is None
+    assert registry.find_available("qwen3-4b")['path'] == "lmstudio-community/Qwen3-4B-GGUF/Qwen3-4B-Q4_K_M.gguf"
+    assert registry.find_available("Qwen3-4B") is None
+
+
+def test_matches_paths(lms_stub):
+    registry = LmStudioRegistry("http://127.0.0.1:1234")
+    path = "lmstudio-community/Qwen3-4B-Instruct-2507-GGUF/Qwen3-4B-Instruct-2507-Q4_K_M.gguf"
+    # the absolute Windows path of the loaded model ends with the relative path
+    assert registry.find_loaded(path)['identifier'] == "qwen3-4b-instruct-2507"
+    assert registry.find_loaded("Qwen3-4B-Instruct-2507-Q4_K_M.gguf")['identifier'] == "qwen3-4b-instruct-2507"
+    assert registry.find_loaded("Qwen3-4B-Instruct-2507") is None
+    assert registry.find_available(path)['sizeBytes'] == 2497280000
+
+
+def test_similarly_named_model_is_loaded(lms_stub):
+    model = LmStudioModel("http://127.0.0.1:1234", "qwen3-4b")
+    model.load()
+    calls = lms_stub.read_text().splitlines()
+    assert any(call.startswith("load qwen3-4b ") for call in calls)
+
+
+def test_rest_fallback_matches_configured_paths(tmp_path, monkeypatch):
+    # no `lms`, so the registry lists the models through LM Studio's REST API, which only reports their keys
+    monkeypatch.setenv("LMS_PATH", str(tmp_path / "missing-lms"))
+    with MockServer(models=["qwen3-1.7b", "qwen3-4b-instruct-2507"]) as server:
+        registry = LmStudioRegistry(server.url)
+        available = registry.find_available("lmstudio-community/Qwen3-1.7B-GGUF/Qwen3-1.7B-Q8_0.gguf")
+        loaded = registry.find_loaded("lmstudio-community\\Qwen3-4B-Instruct-2507-GGUF\\Qwen3-4B-Instruct-2507-Q4_K_M.gguf")
+        missing = registry.find_available("lmstudio-community/Qwen3-4B-GGUF/Qwen3-4B-Q4_K_M.gguf")
+
+    assert available is not None and available['modelKey'] == "qwen3-1.7b"
+    assert loaded is not None and loaded['identifier'] == "qwen3-4b-instruct-2507"
+    assert missing is None
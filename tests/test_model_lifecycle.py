@@ -0,0 +1,49 @@
+from model_lifecycle import ModelLifecycle
+
+GB = 1024 ** 3
+
+
+class FakeModel:
+    def __init__(self, name, size_gb):
+        self.name = name
+        self.size_gb = size_gb
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+
+    def unload(self):
+        self.loaded = False
+
+    def get_size_bytes(self):
+        return int(self.size_gb * GB)
+
+
+def create_lifecycle(sizes_gb, budget_gb, judges=()):
+    return ModelLifecycle(lambda name: FakeModel(name, sizes_gb[name]), prefetch=True, memory_budget_gb=budget_gb,
+                          other_resident_models=lambda: list(judges))
+
+
+def test_prefetch_counts_the_current_model():
+    lifecycle = create_lifecycle({"a": 6, "b": 6}, budget_gb=10)
+    lifecycle.acquire("a")
+    lifecycle.prefetch("b")
+    with lifecycle.lock:
+        assert "b" not in lifecycle.prefetches and "b" not in lifecycle.models
+    lifecycle.shutdown()
+
+    lifecycle = create_lifecycle({"a": 4, "b": 6}, budget_gb=10)
+    current = lifecycle.acquire("a")
+    lifecycle.prefetch("b")
+    assert lifecycle.acquire("b").loaded
+    assert current.loaded
+    lifecycle.shutdown()
+
+
+def test_prefetch_counts_the_judge():
+    lifecycle = create_lifecycle({"a": 4, "b": 4}, budget_gb=10, judges=[FakeModel("judge", 3)])
+    lifecycle.acquire("a")
+    lifecycle.prefetch("b")
+    with lifecycle.lock:
+        assert "b" not in lifecycle.prefetches
+    lifecycle.shutdown()
@@ -0,0 +1,35 @@
+from mock_server import MockServer
+from openrouter_scorer import OpenRouterScorer
+
+QUESTION = [{"role": "user", "content": "What is 2 + 2?"}]
+
+
+def test_identical_candidates_are_judged_once_without_a_verdict_cache(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "mock")
+    with MockServer() as server:
+        monkeypatch.setenv("OPENROUTER_API_ENDPOINT", server.url)
+        scorer = OpenRouterScorer("mock-judge")
+        # one after the other, as for the same test in consecutive iterations
+        scores = [scorer.score_one("mock-model", "test", QUESTION, "4", "four") for _ in range(3)]
+        stats = server.stats()
+
+    assert len(set(scores)) == 1
+    assert stats['completions'] == 1
+
+
+def test_failed_judgements_are_judged_again(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "mock")
+    scorer = OpenRouterScorer("mock-judge")
+    replies = iter(["no score here", "[8] Correct."])
+    monkeypatch.setattr(scorer, "_request_judgement", lambda message, label: next(replies))
+
+    assert scorer.score_one("mock-model", "test", QUESTION, "4", "four") == 0.0
+    assert scorer.score_one("mock-model", "test", QUESTION, "4", "four") > 0.0
+
+
+def test_non_numeric_judge_scores_count_as_failed(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "mock")
+    scorer = OpenRouterScorer("mock-judge")
+    monkeypatch.setattr(scorer, "_request_judgement", lambda message, label: "[nan] Unsure.")
+
+    assert scorer.score_one("mock-model", "test", QUESTION, "4", "four") == 0.0
@@ -0,0 +1,15 @@
+from inference_scheduler import InferenceRequest, InferenceScheduler
+from mock_server import MockServer
+from remote_llm_model import RemoteLLMModel
+
+
+def test_latency_excludes_rate_limit_retries():
+    # a third of the calls are rate limited with a 0.3 second Retry-After, every call takes 0.05 seconds
+    with MockServer(latency="constant:0.05", rate_limit_rate=0.3, retry_after=0.3, seed=1) as server:
+        scheduler = InferenceScheduler(RemoteLLMModel(server.url, model_name="mock-model"), server.url, concurrency=2)
+        results = scheduler.run([InferenceRequest(n, 0, [{"role": "user", "content": "hi"}]) for n in range(10)])
+        stats = server.stats()
+
+    assert stats['rate_limited'] > 0
+    assert all(result.error is None for result in results)
+    assert all(0.05 <= result.latency < 0.25 for result in results)
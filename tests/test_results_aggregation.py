@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from base_llm_model import ModelResponse
+from benchmark import SuiteRun
+from inference_scheduler import InferenceRequest, InferenceResult, InferenceScheduler
+from mock_server import MockServer
+from remote_llm_model import RemoteLLMModel
+from results_aggregation import SuiteScores, usage_summary
+from run_state import CallRecords
+
+
+def naive_bootstrap(scores, samples, confidence, seed):
+    """Reference bootstrap gathering the whole (samples, iterations, tests) array."""
+    iterations = scores.shape[0]
+    rng = np.random.default_rng(seed)
+    resampled = scores[rng.integers(0, iterations, size=(samples, iterations))]
+    counts = np.sum(~np.isnan(resampled), axis=1)
+    sums = np.nansum(resampled, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        test_means = sums / counts
+        suite_means = np.sum(sums, axis=1) / np.sum(counts, axis=1)
+    alpha = (1 - confidence) / 2
+    test_low, test_high = np.nanquantile(test_means, [alpha, 1 - alpha], axis=0)
+    suite_low, suite_high = np.nanquantile(suite_means, [alpha, 1 - alpha])
+    return test_low, test_high, suite_low, suite_high
+
+
+def test_bootstrap_matches_resampling_the_iterations():
+    rng = np.random.default_rng(3)
+    suite_scores = SuiteScores(7, 5)
+    suite_scores.scores = rng.random((7, 5))
+    # failed calls stay NaN
+    suite_scores.scores[rng.random((7, 5)) < 0.3] = np.nan
+
+    test_low, test_high, suite_low, suite_high = suite_scores.bootstrap(samples=200, seed=4)
+    expected = naive_bootstrap(suite_scores.scores, 200, 0.95, 4)
+    np.testing.assert_allclose(test_low, expected[0])
+    np.testing.assert_allclose(test_high, expected[1])
+    assert np.isclose(suite_low, expected[2]) and np.isclose(suite_high, expected[3])
+    assert np.all(test_low <= test_high) and suite_low <= suite_high
+
+
+def test_usage_counts_deduplicated_and_cached_calls_once():
+    pricing = {"prompt": 1.0, "completion": 2.0}
+    # greedy sampling, so the 5 iterations of the test are sent once and the response is replicated
+    with MockServer(response="four") as server:
+        scheduler = InferenceScheduler(RemoteLLMModel(server.url, model_name="mock-model"), server.url, concurrency=2)
+        results = scheduler.run([InferenceRequest(n, 0, [{"role": "user", "content": "2 + 2?"}], {"temperature": 0}) for n in range(5)])
+        stats = server.stats()
+
+    records = CallRecords()
+    for result in results:
+        records.append(result.request.iteration, 0, result.response_text, result.latency, result.response, result.sent)
+    # a response replayed from the response cache
+    cached = ModelResponse("four", output_tokens=results[0].response.output_tokens, prompt_tokens=results[0].response.prompt_tokens, cached=True)
+    records.append(5, 0, "four", 0.001, cached, sent=False)
+
+    assert stats['completions'] == 1
+    assert sum(1 for result in results if result.replicated) == 4
+    usage = usage_summary(records.latencies, records.metrics['prompt_tokens'], records.metrics['output_tokens'],
+                          records.metrics['cost'], pricing, records.sent)
+    assert usage['total_prompt_tokens'] == stats['prompt_tokens']
+    assert usage['total_output_tokens'] == stats['completion_tokens']
+    assert np.isclose(usage['total_cost'], (stats['prompt_tokens'] * 1.0 + stats['completion_tokens'] * 2.0) / 1e6)
+    assert np.isclose(usage['output_tokens_per_second'], stats['completion_tokens'] / results[0].latency)
+    assert records.total('output_tokens') == stats['completion_tokens']
+
+
+def test_latency_only_counts_sent_calls():
+    suite_run = SuiteRun("mock-model", "suite", [None], 16 * 1024 ** 2)
+    request = InferenceRequest(0, 0, [{"role": "user", "content": "2 + 2?"}], {"temperature": 0})
+    response = ModelResponse("four")
+    suite_run.add(InferenceResult(request, response, 2_000_000_000))
+    # the replicas of the call and a response cache hit, which takes no time
+    for iteration in range(1, 4):
+        suite_run.add(InferenceResult(InferenceRequest(iteration, 0, request.messages, request.sampling), response, 2_000_000_000, replicated=True))
+    suite_run.add(InferenceResult(InferenceRequest(4, 0, request.messages), ModelResponse("four", cached=True), 1000))
+
+    assert suite_run.latency_histogram.total_count == 1
+    assert np.isclose(suite_run.latency_histogram.mean(), 2.0)
+    records = suite_run.records
+    suite_scores = SuiteScores.from_cells(1, records.iterations, records.test_indices, [1.0] * len(records), records.sent_latencies())
+    per_test, _, _ = suite_scores.per_test([SimpleNamespace(input="2 + 2?")], samples=10)
+    assert per_test[0]['runs'] == 5
+    assert np.isclose(per_test[0]['mean_latency'], 2.0)
@@ -0,0 +1,78 @@
+import csv
+import sys
+import threading
+import time
+
+import yaml
+
+import benchmark
+from mock_server import MockServer
+from shard_coordinator import EndpointFailure, ShardCoordinator, WorkUnit
+
+
+class Suite:
+    def __init__(self, name):
+        self.name = name
+
+
+def test_failed_unit_is_not_counted_as_completed():
+    units = [WorkUnit(n, "m1", Suite(f"suite{n}")) for n in range(3)]
+
+    def worker(endpoint, unit):
+        if unit.index == 1:
+            raise ValueError("broken suite")
+
+    abandoned = []
+    coordinator = ShardCoordinator(["a"], units)
+    coordinator.run(worker, on_abandoned=abandoned.append)
+
+    assert [unit.index for unit in abandoned] == [1]
+    assert coordinator.health["a"].completed == 2
+    assert coordinator.health["a"].failures == 1
+
+
+def test_endpoint_failure_is_retried_elsewhere():
+    units = [WorkUnit(n, "m1", Suite(f"suite{n}")) for n in range(4)]
+    ran = []
+
+    def worker(endpoint, unit):
+        if endpoint == "dead":
+            raise EndpointFailure("not answering")
+        ran.append(unit.index)
+
+    abandoned = []
+    coordinator = ShardCoordinator(["dead", "live"], units, max_failures=1)
+    coordinator.run(worker, on_abandoned=abandoned.append)
+
+    assert sorted(ran) == [0, 1, 2, 3]
+    assert abandoned == []
+    assert not coordinator.health["dead"].healthy
+
+
+def test_units_are_reported_once_in_run_order_when_an_endpoint_dies(tmp_path, monkeypatch):
+    tests = [{"input": f"question {n}", "expected_response": "answer"} for n in range(4)]
+    test_suites = [{f"suite{n}": {"scorer": {"type": "LexicalScorer"}, "setup_prompts": [{"system": "Answer."}], "tests": tests}}
+                   for n in range(2)]
+
+    with MockServer(latency="constant:0.02", response="answer") as live, MockServer(latency="constant:0.02", response="answer") as dying:
+        config_file = tmp_path / "shard.yaml"
+        config_file.write_text(yaml.safe_dump({"config": {
+            "model_type": "remote", "model_endpoints": [live.url, dying.url], "models": ["m1", "m2", "m3"],
+            "test_iterations": 2, "concurrency": 2, "endpoint_max_failures": 1, "test_suites": test_suites}}), encoding='utf-8')
+
+        def kill():
+            # once the endpoint has started answering
+            while dying.stats()['completions'] == 0:
+                time.sleep(0.005)
+            dying.stop()
+
+        killer = threading.Thread(target=kill, daemon=True)
+        killer.start()
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(sys, "argv", ["benchmark.py", str(config_file)])
+        benchmark.main()
+        killer.join()
+
+    with open(tmp_path / "results.csv", newline='', encoding='utf-8') as f:
+        reported = [(row[0], row[1]) for row in list(csv.reader(f))[1:]]
+    assert reported == [(model, f"suite{n}") for model in ["m1", "m2", "m3"] for n in range(2)]
@@ -0,0 +1,27 @@
+import json
+
+import yaml
+
+from suite_compiler import compiled_path, encode_chat_request, load_compiled_config
+
+SETUP_PROMPTS = [{"system": "You are a helpful assistant. " * 50}, {"user": "Hi"}, {"assistant": "Hello, how can I help?"}]
+
+
+def test_setup_prompts_are_compiled_once_per_suite(tmp_path):
+    test_file = tmp_path / "suites.yaml"
+    tests = [{"input": f"question {n}", "expected_response": "answer"} for n in range(20)]
+    test_file.write_text(yaml.safe_dump({"config": {"test_suites": [
+        {"suite": {"scorer": {"type": "LexicalScorer"}, "setup_prompts": SETUP_PROMPTS, "tests": tests}}]}}), encoding='utf-8')
+
+    for _ in range(2):
+        # compiled, then loaded from the compiled file
+        _, suites = load_compiled_config(str(test_file))
+        messages = [test.messages for test in suites[0].tests]
+        assert all(test_messages.json == json.dumps(list(test_messages), ensure_ascii=False) for test_messages in messages)
+        assert json.loads(encode_chat_request({"model": "m"}, messages[3]))['messages'][-1] == {"role": "user", "content": "question 3"}
+        # the setup messages are shared, not copied per test
+        assert all(test_messages[0] is messages[0][0] for test_messages in messages)
+
+    with open(compiled_path(str(test_file)), encoding='utf-8') as f:
+        compiled = f.read()
+    assert compiled.count("You are a helpful assistant.") == 2 * 50
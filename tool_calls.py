@@ -0,0 +1,135 @@
+import json
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+
+TOOL_CALL_START = "<tool_call>"
+TOOL_CALL_END = "</tool_call>"
+
+
+def markdown_to_tool_calls(response_text: str) -> str:
+    """Change blocks in markdown format (e.g. ```json ... ```) to xml (<tool_call></tool_call>)."""
+    if '```json' in response_text:
+        response_text = response_text.replace('```json', TOOL_CALL_START).replace('```', TOOL_CALL_END)
+    elif response_text.count('```') > 1:
+        response_text = response_text.replace('```', TOOL_CALL_START, 1)
+        response_text = response_text.replace('```', TOOL_CALL_END, 1)
+
+        if response_text.count('```') > 0:
+            # just return the first tool call block
+            response_text = response_text.split(TOOL_CALL_END)[0] + TOOL_CALL_END
+    return response_text
+
+
+def extract_tool_calls(text: str) -> Tuple[str, ...]:
+    """
+    Return the text of every <tool_call> block of a response, in order.
+
+    A response without any <tool_call> tag is interpreted as a single tool call.
+    """
+    if TOOL_CALL_START not in text:
+        return (text,)
+    return tuple(block.split(TOOL_CALL_END)[0] for block in text.split(TOOL_CALL_START)[1:])
+
+
+@lru_cache(maxsize=None)
+def reference_tool_calls(reference: str) -> Tuple[str, ...]:
+    """The tool call blocks of a reference response - there are few unique references, so each is only split once."""
+    return extract_tool_calls(reference)
+
+
+def canonicalize(value: Any) -> Tuple:
+    """
+    Return a hashable, normalized form of a parsed JSON value.
+
+    Objects become their items sorted by key, and every value is tagged with its type so that e.g. 1, 1.0
+    and True stay different, as they are for the comparison.
+    """
+    if isinstance(value, dict):
+        return (dict, tuple(sorted((key, canonicalize(item)) for key, item in value.items())))
+    if isinstance(value, list):
+        return (list, tuple(canonicalize(item) for item in value))
+    return (type(value), value)
+
+
+@lru_cache(maxsize=65536)
+def parse_tool_call(block: str) -> Optional[Tuple]:
+    """Parse a tool call block (allowing single quoted JSON) into its canonical form, or None if it isn't valid JSON."""
+    try:
+        return canonicalize(json.loads(block.replace("'", '"').strip()))
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return None
+
+
+def matches_ignoring_additional_fields(candidate: Tuple, reference: Tuple) -> bool:
+    """
+    True if the canonical candidate contains everything in the canonical reference.
+
+    Objects may have additional keys, and lists additional items in any order. Handles arbitrary levels of nesting.
+    """
+    if candidate == reference:
+        return True
+
+    candidate_type, candidate_value = candidate
+    reference_type, reference_value = reference
+    if candidate_type is not reference_type:
+        return False
+
+    if reference_type is dict:
+        # all reference keys must exist in the candidate with matching values
+        candidate_items = dict(candidate_value)
+        for key, item in reference_value:
+            if key not in candidate_items or not matches_ignoring_additional_fields(candidate_items[key], item):
+                return False
+        return True
+
+    if reference_type is list:
+        # all reference items must be present in the candidate (order may vary)
+        if len(candidate_value) < len(reference_value):
+            return False
+        exact_items = set(candidate_value)
+        for reference_item in reference_value:
+            if reference_item in exact_items:
+                continue
+            if not any(matches_ignoring_additional_fields(candidate_item, reference_item) for candidate_item in candidate_value):
+                return False
+        return True
+
+    # For primitive types (str, int, float, bool, None), exact match
+    return candidate_value == reference_value
+
+
+@lru_cache(maxsize=65536)
+def tool_call_matches(candidate_block: str, reference_block: str) -> bool:
+    """Compare two tool call blocks, first as text and then as JSON ignoring additional fields in the candidate."""
+    if candidate_block == reference_block:
+        return True
+
+    candidate = parse_tool_call(candidate_block)
+    reference = parse_tool_call(reference_block)
+    if candidate is None or reference is None:
+        print(f"Error comparing JSON strings: Candidate: {candidate_block}, Reference: {reference_block}")
+        return False
+    return matches_ignoring_additional_fields(candidate, reference)
+
+
+def tool_calls_match(response_text: str, reference: str) -> bool:
+    """
+    True if the tool calls of a response match those of the reference.
+
+    Each reference tool call has to be matched by a different one of the response's first tool calls (as many
+    as the reference has), in any order. With a single reference tool call only the first tool call of the
+    response is compared.
+    """
+    references = reference_tool_calls(reference)
+    candidates = list(extract_tool_calls(response_text)[:len(references)])
+    if len(candidates) < len(references):
+        return False
+
+    for reference_block in references:
+        for n, candidate_block in enumerate(candidates):
+            if tool_call_matches(candidate_block, reference_block):
+                del candidates[n]
+                break
+        else:
+            return False
+    return True